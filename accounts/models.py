@@ -14,6 +14,13 @@ class UserProfile(models.Model):
     nickname = models.CharField(null=True, max_length=30)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # maintained on follow / unfollow, NULL until counted once from the friendships
+    # nullable, no table lock to fill the existing profiles in migrations
+    follower_count = models.IntegerField(null=True)
+    following_count = models.IntegerField(null=True)
+    # set once the follower count reaches CELEBRITY_FOLLOWER_THRESHOLD and
+    # never unset, the tweets of a celebrity are not fanned out
+    is_celebrity = models.BooleanField(null=True)
 
     def __str__(self):
         return f'{self.created_at} User {self.user.id} ({self.nickname}) created user profile.'
@@ -20,6 +20,21 @@ class UserService:
         cache.set(key, profile)
         return profile
 
+    @classmethod
+    def find_profile_through_cache(cls, user_id):
+        """
+        Same as get_profile_through_cache for the reads, None instead of
+        creating the profile of a user without one
+        """
+        key = USER_PROFILE_PATTERN.format(user_id=user_id)
+        profile = cache.get(key)
+        if profile is not None:
+            return profile
+        profile = UserProfile.objects.filter(user_id=user_id).first()
+        if profile is not None:
+            cache.set(key, profile)
+        return profile
+
     @classmethod
     def invalidate_profile_cache(cls, user_id):
         key = USER_PROFILE_PATTERN.format(user_id=user_id)
@@ -0,0 +1,40 @@
+"""
+Benchmarks against the local services configured in twitter.settings
+
+Run a benchmark from the project root, e.g.
+    $ python -m benchmarks.redis_load_objects
+Benchmarks only touch keys under the 'benchmark:' prefix and remove them afterwards.
+"""
+import os
+import time
+
+
+def setup_django():
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'twitter.settings')
+    django.setup()
+
+
+def measure(func, rounds):
+    """
+    Call func rounds times, return the latencies in milliseconds sorted ascending
+    """
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return sorted(latencies)
+
+
+def percentile(sorted_latencies, p):
+    index = min(len(sorted_latencies) - 1, int(len(sorted_latencies) * p / 100))
+    return sorted_latencies[index]
+
+
+def report(title, latencies):
+    print('{:<48} p50 {:8.3f} ms    p99 {:8.3f} ms'.format(
+        title,
+        percentile(latencies, 50),
+        percentile(latencies, 99),
+    ))
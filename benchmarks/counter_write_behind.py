@@ -0,0 +1,78 @@
+"""
+Likes per second on one hot tweet, from concurrent workers
+
+before: UPDATE like_count = like_count + 1 on the tweet row, then INCR in Redis
+after: write-behind, HINCRBY in the delta log and INCRBY in Redis, the deltas
+are flushed to the db with one grouped UPDATE
+
+Needs the db and creates a temporary tweet, its counter keys are removed
+afterwards. The flush at the end also applies any pending production deltas,
+as the periodic flush task would.
+"""
+import threading
+import time
+
+from benchmarks import setup_django
+
+WORKERS = 8
+LIKES_PER_WORKER = 500
+
+
+def run_workers(func):
+    from django.db import connection
+
+    def work():
+        try:
+            for _ in range(LIKES_PER_WORKER):
+                func()
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=work) for _ in range(WORKERS)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def main():
+    setup_django()
+    from django.db.models import F
+    from tweets.models import Tweet
+    from tweets.services import TweetService
+    from utils.redis_client import RedisClient
+    from utils.redis_helper import RedisHelper
+
+    conn = RedisClient.get_connection()
+    tweet = Tweet.objects.create(content='benchmark hot tweet')
+    num_likes = WORKERS * LIKES_PER_WORKER
+
+    def like_before():
+        Tweet.objects.filter(id=tweet.id).update(like_count=F('like_count') + 1)
+        RedisHelper.incr_count(tweet, 'like_count')
+
+    def like_after():
+        RedisHelper.log_count_delta(tweet, 'like_count', 1)
+
+    try:
+        seconds = run_workers(like_before)
+        print('{:<48} {:10.0f} likes/s'.format('before: row update per like', num_likes / seconds))
+        seconds = run_workers(like_after)
+        print('{:<48} {:10.0f} likes/s'.format('after: write-behind delta log', num_likes / seconds))
+        start = time.perf_counter()
+        TweetService.flush_count_deltas()
+        print('{:<48} {:10.3f} ms'.format(
+            'after: flush {} deltas'.format(num_likes),
+            (time.perf_counter() - start) * 1000,
+        ))
+        tweet.refresh_from_db()
+        assert tweet.like_count == 2 * num_likes, tweet.like_count
+    finally:
+        conn.delete(RedisHelper.get_count_name(tweet, 'like_count'))
+        tweet.delete()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Peak RSS of reading the followers of an author with 1M followers into fanout
+batches, materialized as Friendship rows vs streamed as ids
+
+Each way runs in its own process, ru_maxrss only ever grows. Needs the db,
+creates the benchmark_* users with their friendships and removes them
+afterwards.
+"""
+import resource
+import subprocess
+import sys
+
+from benchmarks import setup_django
+
+FOLLOWERS = 1000000
+MODES = ('materialized', 'streamed')
+
+
+def peak_rss_mb():
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def read_batches(mode, author_id):
+    from friendships.models import Friendship
+    from friendships.services import FriendshipService
+    from newsfeeds.constants import FANOUT_BATCH_SIZE
+    from itertools import islice
+
+    if mode == 'materialized':
+        # the way the fanout used to read the followers
+        follower_ids = [
+            f.from_user_id
+            for f in Friendship.objects.filter(to_user_id=author_id)
+        ]
+        batches = [
+            follower_ids[index:index + FANOUT_BATCH_SIZE]
+            for index in range(0, len(follower_ids), FANOUT_BATCH_SIZE)
+        ]
+        return sum(len(batch) for batch in batches)
+
+    num_followers = 0
+    follower_ids = FriendshipService.iterate_follower_ids(author_id, batch_size=FANOUT_BATCH_SIZE)
+    while True:
+        batch_ids = list(islice(follower_ids, FANOUT_BATCH_SIZE))
+        if not batch_ids:
+            break
+        num_followers += len(batch_ids)
+    return num_followers
+
+
+def run_mode(mode, author_id):
+    setup_django()
+    before = peak_rss_mb()
+    num_followers = read_batches(mode, int(author_id))
+    print('{:<48} {:10.1f} MB peak RSS, {:10.1f} MB over baseline, {} followers'.format(
+        mode,
+        peak_rss_mb(),
+        peak_rss_mb() - before,
+        num_followers,
+    ))
+
+
+def main():
+    setup_django()
+    from django.contrib.auth.models import User
+    from friendships.models import Friendship
+
+    author = User.objects.create(username='benchmark_author')
+    try:
+        for start in range(0, FOLLOWERS, 10000):
+            User.objects.bulk_create([
+                User(username='benchmark_follower_{}'.format(i))
+                for i in range(start, min(start + 10000, FOLLOWERS))
+            ])
+        follower_ids = User.objects.filter(
+            username__startswith='benchmark_follower_',
+        ).values_list('id', flat=True).iterator()
+        friendships = []
+        for follower_id in follower_ids:
+            friendships.append(Friendship(from_user_id=follower_id, to_user_id=author.id))
+            if len(friendships) == 10000:
+                Friendship.objects.bulk_create(friendships)
+                friendships = []
+        Friendship.objects.bulk_create(friendships)
+
+        for mode in MODES:
+            subprocess.run(
+                [sys.executable, '-m', 'benchmarks.fanout_memory', mode, str(author.id)],
+                check=True,
+            )
+    finally:
+        Friendship.objects.filter(to_user=author).delete()
+        User.objects.filter(username__startswith='benchmark_').delete()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:
+        run_mode(*sys.argv[1:])
+    else:
+        main()
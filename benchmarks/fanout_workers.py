@@ -0,0 +1,94 @@
+"""
+Wall-clock time of the fanout of one tweet to 100k followers with 1, 4 and 16
+celery worker processes
+
+The batches are dispatched as a celery chord onto the newsfeeds queue, the
+time is read from the fanout progress kept in Redis. Needs the db, Redis and
+the celery broker, the workers are started by the benchmark. Creates the
+benchmark_* users with their friendships, newsfeeds and tweets, and removes
+them afterwards.
+"""
+import socket
+import subprocess
+import sys
+import time
+
+from benchmarks import setup_django
+
+FOLLOWERS = 100000
+WORKER_COUNTS = (1, 4, 16)
+TIMEOUT = 3600
+
+
+def start_worker(concurrency):
+    from twitter.celery import app
+
+    node_name = 'benchmark@{}'.format(socket.gethostname())
+    worker = subprocess.Popen([
+        sys.executable, '-m', 'celery', '-A', 'twitter', 'worker',
+        '-Q', 'default,newsfeeds',
+        '-c', str(concurrency),
+        '-n', node_name,
+        '-l', 'WARNING',
+    ])
+    # wait until the worker answers
+    while not app.control.ping(destination=[node_name], timeout=1):
+        time.sleep(1)
+    return worker
+
+
+def main():
+    setup_django()
+    from django.contrib.auth.models import User
+    from friendships.models import Friendship
+    from newsfeeds.models import NewsFeed
+    from newsfeeds.services import NewsFeedService
+    from newsfeeds.tasks import fanout_to_followers_main_task
+    from tweets.models import Tweet
+
+    author = User.objects.create(username='benchmark_author')
+    User.objects.bulk_create(
+        [User(username='benchmark_follower_{}'.format(i)) for i in range(FOLLOWERS)],
+        batch_size=1000,
+    )
+    follower_ids = User.objects.filter(
+        username__startswith='benchmark_follower_',
+    ).values_list('id', flat=True)
+    Friendship.objects.bulk_create(
+        [Friendship(from_user_id=follower_id, to_user_id=author.id) for follower_id in follower_ids],
+        batch_size=1000,
+    )
+    tweet_ids = []
+    try:
+        for concurrency in WORKER_COUNTS:
+            worker = start_worker(concurrency)
+            try:
+                tweet = Tweet.objects.create(user=author, content='benchmark fanout')
+                tweet_ids.append(tweet.id)
+                start = time.perf_counter()
+                fanout_to_followers_main_task.delay(tweet.id, author.id)
+                progress = None
+                while time.perf_counter() - start < TIMEOUT:
+                    progress = NewsFeedService.get_fanout_progress(tweet.id)
+                    if progress is not None and progress['finished']:
+                        break
+                    time.sleep(0.1)
+                print('{:<48} {:10.3f} s wall clock, {:10.3f} s fanout, {}/{} batches'.format(
+                    '{} worker processes'.format(concurrency),
+                    time.perf_counter() - start,
+                    progress['elapsed'] if progress else float('nan'),
+                    progress['done'] if progress else 0,
+                    progress['total'] if progress else 0,
+                ))
+            finally:
+                worker.terminate()
+                worker.wait()
+    finally:
+        NewsFeed.objects.filter(tweet_id__in=tweet_ids).delete()
+        Tweet.objects.filter(id__in=tweet_ids).delete()
+        Friendship.objects.filter(to_user=author).delete()
+        User.objects.filter(username__startswith='benchmark_').delete()
+
+
+if __name__ == '__main__':
+    main()
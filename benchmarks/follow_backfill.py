@@ -0,0 +1,83 @@
+"""
+Follow and unfollow with a full cached newsfeed timeline, including the
+first newsfeed read after the change
+
+before: the newsfeed rows are written, the cached timeline is dropped and the
+first read rebuilds it from the db
+after: the newsfeed rows are written and merged into (removed from) the cached
+timeline in one WATCH/MULTI rewrite, the first read is served from Redis
+
+Needs the db and Redis, creates the benchmark_* users with their tweets and
+newsfeeds and removes them afterwards.
+"""
+from benchmarks import measure, report, setup_django
+
+FOLLOWEE_TWEETS = 50
+ROUNDS = 100
+
+
+def main():
+    setup_django()
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from newsfeeds.models import NewsFeed
+    from newsfeeds.services import NewsFeedService
+    from tweets.models import Tweet
+    from utils.redis_client import RedisClient, RedisRole
+
+    follower = User.objects.create(username='benchmark_follower')
+    author = User.objects.create(username='benchmark_author')
+    followee = User.objects.create(username='benchmark_followee')
+    try:
+        # a full timeline of the tweets of author, the tweets of followee are
+        # newer and merged into the cached part
+        for _ in range(settings.REDIS_LIST_LENGTH_LIMIT):
+            tweet = Tweet.objects.create(user=author, content='benchmark tweet')
+            NewsFeed.objects.create(user=follower, tweet=tweet)
+        for _ in range(FOLLOWEE_TWEETS):
+            Tweet.objects.create(user=followee, content='benchmark tweet')
+        name, _, _ = NewsFeedService._get_timeline_names(follower.id)
+        conn = RedisClient.get_connection(RedisRole.TIMELINE, name)
+
+        def read():
+            NewsFeedService.load_newsfeeds_through_cache(follower.id, limit=21)
+
+        def follow_before():
+            tweets = Tweet.objects.filter(user=followee).order_by('-created_at')[:20]
+            NewsFeedService._create_backdated_newsfeeds(follower.id, list(tweets))
+            conn.delete(name)
+            read()
+
+        def unfollow_before():
+            NewsFeed.objects.filter(user=follower, tweet__user=followee).delete()
+            conn.delete(name)
+            read()
+
+        def follow_after():
+            NewsFeedService.backfill_followed_tweets(follower.id, followee.id)
+            read()
+
+        def unfollow_after():
+            NewsFeedService.remove_unfollowed_tweets(follower.id, followee.id)
+            read()
+
+        for title, follow, unfollow in [
+            ('before: drop the cached timeline', follow_before, unfollow_before),
+            ('after: merge into the cached timeline', follow_after, unfollow_after),
+        ]:
+            read()
+            follow_latencies, unfollow_latencies = [], []
+            for _ in range(ROUNDS):
+                follow_latencies += measure(follow, 1)
+                unfollow_latencies += measure(unfollow, 1)
+            report('{}, follow'.format(title), sorted(follow_latencies))
+            report('{}, unfollow'.format(title), sorted(unfollow_latencies))
+    finally:
+        RedisClient.get_connection(RedisRole.TIMELINE, name).delete(name)
+        NewsFeed.objects.filter(user=follower).delete()
+        Tweet.objects.filter(user__username__startswith='benchmark_').delete()
+        User.objects.filter(username__startswith='benchmark_').delete()
+
+
+if __name__ == '__main__':
+    main()
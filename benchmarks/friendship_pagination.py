@@ -0,0 +1,83 @@
+"""
+Latency of a page of the followers of a user with 100k followers, page 1 vs
+page 10,000 of 10 followers
+
+offset: FriendShipPagination, COUNT(*) + LIMIT/OFFSET per page
+keyset: FriendShipKeysetPagination, (created_at, id) seek + maintained counter
+
+Needs the db, creates the benchmark_* users with their friendships and removes
+them afterwards.
+"""
+from types import SimpleNamespace
+
+from benchmarks import measure, report, setup_django
+
+FOLLOWERS = 100010
+PAGE_SIZE = 10
+PAGES = [1, 10000]
+ROUNDS = 50
+
+
+def offset_page(queryset, page_number):
+    from django.core.paginator import Paginator
+
+    page = Paginator(queryset, PAGE_SIZE).page(page_number)
+    return page.paginator.count, list(page)
+
+
+def keyset_page(author_id, queryset, cursor):
+    from friendships.api.paginations import FriendShipKeysetPagination
+    from friendships.services import FriendshipService
+
+    query_params = {'before': cursor} if cursor else {}
+    paginator = FriendShipKeysetPagination()
+    paginator.total_results = FriendshipService.get_follower_count(author_id)
+    return paginator.total_results, paginator.paginate_queryset(queryset, SimpleNamespace(query_params=query_params))
+
+
+def main():
+    setup_django()
+    from django.contrib.auth.models import User
+    from friendships.models import Friendship
+    from utils.cursors import encode_cursor, get_object_cursor
+
+    author = User.objects.create(username='benchmark_author')
+    try:
+        for start in range(0, FOLLOWERS, 10000):
+            User.objects.bulk_create([
+                User(username='benchmark_follower_{}'.format(i))
+                for i in range(start, min(start + 10000, FOLLOWERS))
+            ])
+        follower_ids = User.objects.filter(
+            username__startswith='benchmark_follower_',
+        ).values_list('id', flat=True).iterator()
+        friendships = []
+        for follower_id in follower_ids:
+            friendships.append(Friendship(from_user_id=follower_id, to_user_id=author.id))
+            if len(friendships) == 10000:
+                Friendship.objects.bulk_create(friendships)
+                friendships = []
+        Friendship.objects.bulk_create(friendships)
+
+        queryset = Friendship.objects.filter(to_user_id=author.id).order_by('-created_at', '-id')
+        for page_number in PAGES:
+            # the cursor a client scrolling down would hold, the last row of the previous page
+            cursor = None
+            if page_number > 1:
+                cursor = encode_cursor(get_object_cursor(queryset[(page_number - 1) * PAGE_SIZE - 1]))
+            assert offset_page(queryset, page_number) == keyset_page(author.id, queryset, cursor)
+            report(
+                'page {} offset'.format(page_number),
+                measure(lambda: offset_page(queryset, page_number), ROUNDS),
+            )
+            report(
+                'page {} keyset'.format(page_number),
+                measure(lambda: keyset_page(author.id, queryset, cursor), ROUNDS),
+            )
+    finally:
+        Friendship.objects.filter(to_user=author).delete()
+        User.objects.filter(username__startswith='benchmark_').delete()
+
+
+if __name__ == '__main__':
+    main()
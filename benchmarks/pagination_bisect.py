@@ -0,0 +1,75 @@
+"""
+Cursor lookup in cached timelines by EndlessPagination._paginate_ordered_list
+
+linear: the previous scan for the created_at boundary + dateutil cursor parsing
+bisect: binary search over the created_at keys + fixed-format cursor parsing
+Cursors point at the head, the middle and the tail of 200 and 2000 element lists.
+"""
+from datetime import timedelta
+from types import SimpleNamespace
+
+from benchmarks import measure, report, setup_django
+
+ROUNDS = 5000
+LIST_SIZES = [200, 2000]
+PAGE_SIZE = 20
+
+
+def linear_paginate(reversed_list, query_params):
+    from dateutil import parser
+
+    if 'created_at__gt' in query_params:
+        created_at__gt = parser.isoparse(query_params['created_at__gt'])
+        objects = []
+        for obj in reversed_list:
+            if obj.created_at > created_at__gt:
+                objects.append(obj)
+            else:
+                break
+        return objects
+
+    index = 0
+    if 'created_at__lt' in query_params:
+        created_at__lt = parser.isoparse(query_params['created_at__lt'])
+        for index, obj in enumerate(reversed_list):
+            if obj.created_at < created_at__lt:
+                break
+        else:
+            reversed_list = []
+    return reversed_list[index:(index + PAGE_SIZE)]
+
+
+def bisect_paginate(reversed_list, query_params):
+    from utils.paginations import EndlessPagination
+
+    paginator = EndlessPagination()
+    paginator.page_size = PAGE_SIZE
+    return paginator._paginate_ordered_list(reversed_list, SimpleNamespace(query_params=query_params))
+
+
+def main():
+    setup_django()
+    from dateutil import parser
+    from utils.time_helper import parse_iso_datetime, utc_now
+
+    cursor = utc_now().isoformat().replace('+00:00', 'Z')
+    for title, func in [('parse cursor dateutil', parser.isoparse), ('parse cursor fixed-format', parse_iso_datetime)]:
+        report(title, measure(lambda: func(cursor), ROUNDS))
+
+    now = utc_now()
+    for size in LIST_SIZES:
+        objects = [SimpleNamespace(created_at=now - timedelta(seconds=index)) for index in range(size)]
+        for position, index in [('head', 1), ('middle', size // 2), ('tail', size - PAGE_SIZE)]:
+            cursor = objects[index].created_at.isoformat().replace('+00:00', 'Z')
+            for key in ['created_at__lt', 'created_at__gt']:
+                query_params = {key: cursor}
+                assert linear_paginate(objects, query_params) == bisect_paginate(objects, query_params)
+                for name, func in [('linear', linear_paginate), ('bisect', bisect_paginate)]:
+                    report(
+                        '{} {} {} {}'.format(size, position, key[-4:], name),
+                        measure(lambda: func(objects, query_params), ROUNDS),
+                    )
+
+
+if __name__ == '__main__':
+    main()
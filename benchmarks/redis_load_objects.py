@@ -0,0 +1,57 @@
+"""
+p50/p99 latency of reading cached lists from Redis
+
+before: EXISTS and LRANGE in two round trips, one list per call
+after: RedisHelper.load_objects / load_objects_batch, pipelined
+"""
+from benchmarks import measure, report, setup_django
+
+ROUNDS = 2000
+
+
+def main():
+    setup_django()
+    from django.conf import settings
+    from tweets.models import Tweet
+    from utils.redis_client import RedisClient
+    from utils.redis_helper import RedisHelper
+    from utils.redis_serializers import DjangoModelSerializer
+    from utils.time_helper import utc_now
+
+    conn = RedisClient.get_connection()
+    names = ['benchmark:usertweet:1', 'benchmark:usernewsfeed:1']
+    tweets = [
+        Tweet(id=i, user_id=1, content='benchmark tweet {}'.format(i), created_at=utc_now())
+        for i in range(settings.REDIS_LIST_LENGTH_LIMIT)
+    ]
+    for name in names:
+        conn.delete(name)
+        RedisHelper._load_objects_to_cache(name, tweets)
+    # never hit on the cache miss path
+    queryset = Tweet.objects.none()
+
+    def load_objects_before(name):
+        if conn.exists(name):
+            return [
+                DjangoModelSerializer.deserialize(serialized_object)
+                for serialized_object in conn.lrange(name, 0, -1)
+            ]
+        return []
+
+    try:
+        report('before: exists + lrange, 1 list', measure(
+            lambda: load_objects_before(names[0]), ROUNDS))
+        report('after: load_objects, 1 list', measure(
+            lambda: RedisHelper.load_objects(names[0], queryset), ROUNDS))
+        report('before: exists + lrange, 2 lists', measure(
+            lambda: [load_objects_before(name) for name in names], ROUNDS))
+        report('after: load_objects_batch, 2 lists', measure(
+            lambda: RedisHelper.load_objects_batch(
+                [(name, queryset, DjangoModelSerializer) for name in names]
+            ), ROUNDS))
+    finally:
+        conn.delete(*names)
+
+
+if __name__ == '__main__':
+    main()
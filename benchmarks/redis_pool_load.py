@@ -0,0 +1,88 @@
+"""
+Redis connection pools under high concurrency, against a local redis-server
+
+Timeline threads read a long list while counter threads increment counters.
+before: one client and one unbounded pool shared by every role
+after: RedisClient, a bounded blocking pool per role
+
+Reports the p50/p99 of the counter increments, the connections opened and
+the errors, e.g. 'max number of clients reached' or pool timeouts.
+"""
+import threading
+
+from benchmarks import measure, report, setup_django
+
+TIMELINE_THREADS = 200
+COUNTER_THREADS = 50
+ROUNDS = 200
+
+
+def count_connections(pool):
+    # BlockingConnectionPool keeps every connection it opened in _connections
+    if hasattr(pool, '_connections'):
+        return len(pool._connections)
+    return pool._created_connections
+
+
+def run_load(timeline_conn, counter_conn, title):
+    list_name = 'benchmark:pool:timeline'
+    counter_name = 'benchmark:pool:counter'
+    errors = []
+    counter_latencies = []
+
+    def read_timeline():
+        try:
+            for _ in range(ROUNDS):
+                timeline_conn.lrange(list_name, 0, -1)
+        except Exception as e:
+            errors.append(e)
+
+    def incr_counter():
+        try:
+            counter_latencies.extend(measure(lambda: counter_conn.incr(counter_name), ROUNDS))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=read_timeline) for _ in range(TIMELINE_THREADS)]
+    threads += [threading.Thread(target=incr_counter) for _ in range(COUNTER_THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if counter_latencies:
+        report('{}: counter incr'.format(title), sorted(counter_latencies))
+    pools = {id(conn.connection_pool): conn.connection_pool for conn in (timeline_conn, counter_conn)}
+    print('{:<48} {} connections, {} errors'.format(
+        '{}: pools'.format(title),
+        sum(count_connections(pool) for pool in pools.values()),
+        len(errors),
+    ))
+
+
+def main():
+    setup_django()
+    import redis
+    from django.conf import settings
+    from utils.redis_client import RedisClient, RedisRole
+
+    shared_conn = redis.Redis(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        db=settings.REDIS_DB,
+    )
+    shared_conn.delete('benchmark:pool:timeline')
+    shared_conn.rpush('benchmark:pool:timeline', *['x' * 100] * settings.REDIS_LIST_LENGTH_LIMIT)
+    try:
+        run_load(shared_conn, shared_conn, 'before: shared pool')
+        run_load(
+            RedisClient.get_connection(RedisRole.TIMELINE),
+            RedisClient.get_connection(RedisRole.COUNTER),
+            'after: pool per role',
+        )
+    finally:
+        shared_conn.delete('benchmark:pool:timeline', 'benchmark:pool:counter')
+
+
+if __name__ == '__main__':
+    main()
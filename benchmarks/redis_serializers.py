@@ -0,0 +1,56 @@
+"""
+Encode/decode throughput and bytes per entry of the Redis cache codecs
+
+legacy: one-element Django JSON fixture through django.core.serializers
+compact: version header + JSON array of the concrete field values
+"""
+import time
+
+from benchmarks import setup_django
+
+ROUNDS = 20000
+
+
+def throughput(func, items):
+    start = time.perf_counter()
+    for item in items:
+        func(item)
+    return len(items) / (time.perf_counter() - start)
+
+
+def main():
+    setup_django()
+    from newsfeeds.models import NewsFeed
+    from tweets.models import Tweet
+    from utils.redis_serializers import CompactCodec, JSONFixtureCodec
+    from utils.time_helper import utc_now
+
+    instances = {
+        'tweet': Tweet(
+            id=123456,
+            user_id=4321,
+            content='x' * 140,
+            created_at=utc_now(),
+            like_count=10,
+            comment_count=2,
+        ),
+        'newsfeed': NewsFeed(id=654321, user_id=1234, tweet_id=123456, created_at=utc_now()),
+    }
+    for model_name, instance in instances.items():
+        for codec in [JSONFixtureCodec, CompactCodec]:
+            data = codec.encode(instance)
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            encode_ops = throughput(codec.encode, [instance] * ROUNDS)
+            decode_ops = throughput(codec.decode, [data] * ROUNDS)
+            print('{:<10} {:<18} {:>5} bytes    encode {:>9.0f} ops/s    decode {:>9.0f} ops/s'.format(
+                model_name,
+                codec.__name__,
+                len(data),
+                encode_ops,
+                decode_ops,
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,25 @@
 from rest_framework import serializers
 from accounts.api.serializers import UserSerializerForComment
 from comments.models import Comment
+from django.db.models import Manager
 from tweets.models import Tweet
+from tweets.services import TweetService
 from rest_framework.exceptions import ValidationError
 from likes.services import LikeService
 
 
+class CommentListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        comments = list(data.all() if isinstance(data, Manager) else data)
+        # has_liked of the whole page in one query instead of one per comment
+        self.context['liked_comment_ids'] = LikeService.get_liked_object_ids(
+            self.context['request'].user,
+            comments,
+        )
+        return super(CommentListSerializer, self).to_representation(comments)
+
+
 class CommentSerializer(serializers.ModelSerializer):
     user = UserSerializerForComment(source='cached_user')
     like_count = serializers.SerializerMethodField()
@@ -23,11 +37,15 @@ class CommentSerializer(serializers.ModelSerializer):
             'like_count',
             'has_liked',
         )
+        list_serializer_class = CommentListSerializer
 
     def get_like_count(self, obj):
         return obj.like_set.count()
 
     def get_has_liked(self, obj):
+        liked_comment_ids = self.context.get('liked_comment_ids')
+        if liked_comment_ids is not None:
+            return obj.id in liked_comment_ids
         return LikeService.get_has_liked(
             user=self.context['request'].user,
             obj=obj,
@@ -48,11 +66,15 @@ class CommentSerializerForTweet(serializers.ModelSerializer):
             'like_count',
             'has_liked',
         )
+        list_serializer_class = CommentListSerializer
 
     def get_like_count(self, obj):
         return obj.like_set.count()
 
     def get_has_liked(self, obj):
+        liked_comment_ids = self.context.get('liked_comment_ids')
+        if liked_comment_ids is not None:
+            return obj.id in liked_comment_ids
         return LikeService.get_has_liked(
             self.context['request'].user,
             obj,
@@ -70,8 +92,8 @@ class CommentSerializerForCreate(serializers.ModelSerializer):
 
     def validate(self, attrs):
         tweet_id = attrs['tweet_id']
-        # check if the tweet exists
-        if not Tweet.objects.filter(id=tweet_id):
+        # check if the tweet exists, a deleted one waits to be compacted
+        if not Tweet.objects.filter(id=tweet_id) or TweetService.is_tweet_deleted(tweet_id):
             raise ValidationError({
                 'message': [
                     "tweet doesn't exist."
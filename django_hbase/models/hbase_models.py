@@ -159,6 +159,25 @@ class HBaseModel:
         instance.save()
         return instance
 
+    @classmethod
+    def batch_create(cls, batch_data, batch_size=None):
+        """
+        Save many rows with one batch of puts instead of one request per row
+
+        Input:
+        @batch_data(list): kwargs of the instances
+        @batch_size(int): puts sent to HBase per request, all at once if None
+        """
+        instances = [cls(**data) for data in batch_data]
+        table = cls.get_table()
+        with table.batch(batch_size=batch_size) as batch:
+            for instance in instances:
+                row_data = cls.serialize_row_data(instance.__dict__)
+                if len(row_data) == 0:
+                    raise EmptyColumnException()
+                batch.put(instance.row_key, row_data)
+        return instances
+
     @classmethod
     def get_table_name(cls):
         if not cls.Meta.table_name:
@@ -242,6 +261,20 @@ class HBaseModel:
         table = cls.get_table()
         table.delete(row=row_key)
 
+    @classmethod
+    def batch_delete(cls, batch_keys, batch_size=None):
+        """
+        Delete many rows with one batch of deletes
+
+        Input:
+        @batch_keys(list): kwargs of the row keys
+        @batch_size(int): deletes sent to HBase per request, all at once if None
+        """
+        table = cls.get_table()
+        with table.batch(batch_size=batch_size) as batch:
+            for keys in batch_keys:
+                batch.delete(cls.serialize_row_key(keys))
+
 
 class EmptyColumnException(Exception):
     pass
@@ -1,6 +1,9 @@
+from math import ceil
 from rest_framework import pagination
 from rest_framework.response import Response
 from rest_framework import status
+from utils.cursors import encode_cursor
+from utils.paginations import EndlessPagination
 
 
 class FriendShipPagination(pagination.PageNumberPagination):
@@ -19,4 +22,56 @@ class FriendShipPagination(pagination.PageNumberPagination):
             'page_number': self.page.number,
             'has_next_page': self.page.has_next(),
             'friendships': data,
-        }, status=status.HTTP_200_OK)
\ No newline at end of file
+        }, status=status.HTTP_200_OK)
+
+
+class FriendShipKeysetPagination(EndlessPagination):
+    """
+    Keyset pagination of follower / following lists with their totals
+
+    Pages are seeked on the (to_user, created_at) / (from_user, created_at)
+    indexes with ?before=<next_cursor> instead of OFFSET scans, and the totals
+    come from the counters maintained on follow / unfollow instead of a
+    COUNT(*) per page. The view sets total_results.
+    No page numbers, a page cannot be jumped to.
+    """
+    page_size = 10 # default page size
+    page_size_query_param = 'size' # query_param to define the page size
+    max_page_size = 20 # max page size in query_param
+
+    def __init__(self):
+        super(FriendShipKeysetPagination, self).__init__()
+        self.total_results = 0
+
+    def _set_page_size(self, request):
+        try:
+            self.page_size = pagination._positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size,
+            )
+        except (KeyError, ValueError):
+            pass
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self._set_page_size(request)
+        return super(FriendShipKeysetPagination, self).paginate_queryset(queryset, request, view)
+
+    def paginate_hbase(self, hbase_model_class, row_prefix, request):
+        self._set_page_size(request)
+        return super(FriendShipKeysetPagination, self).paginate_hbase(hbase_model_class, row_prefix, request)
+
+    def get_paginated_response(self, data):
+        """
+        Override the response from the pagination
+        """
+        first_cursor, last_cursor = self.page_cursors
+        return Response({
+            'total_results': self.total_results,
+            'total_pages': max(1, ceil(self.total_results / self.page_size)),
+            'has_next_page': self.has_next_page,
+            'has_gap': self.has_gap,
+            'next_cursor': encode_cursor(last_cursor) if self.has_next_page else None,
+            'refresh_cursor': encode_cursor(first_cursor) if first_cursor else None,
+            'friendships': data,
+        }, status=status.HTTP_200_OK)
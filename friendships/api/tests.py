@@ -1,5 +1,8 @@
+from accounts.models import UserProfile
 from django.conf import settings
 from django.core.cache import caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from friendships.services import FriendshipService
 from gatekeeper.models import GateKeeper
 from testing.testcases import TestCase
@@ -202,6 +205,7 @@ class FriendshipTest(TestCase):
 class FriendShipPaginationTest(TestCase):
 
     def setUp(self) -> None:
+        super(FriendShipPaginationTest, self).setUp()
         self.user1, self.user1_client = self.create_user_and_client(username='user1')
         self.user2, self.user2_client = self.create_user_and_client(username='user2')
         self.user3, self.user3_client = self.create_user_and_client(username='user3')
@@ -274,6 +278,52 @@ class FriendShipPaginationTest(TestCase):
         self.assertEqual(response.data['page_number'], 2)
         self.assertTrue(response.data['has_next_page'])
 
+    def test_friendship_keyset_pagination(self):
+        GateKeeper.set_kv('switch_friendship_keyset_pagination', 'percent', 100)
+        for i in range(10):
+            dummy_user = self.create_user(username='dummy{}'.format(i))
+            self.create_friendship(
+                from_user=self.user1,
+                to_user=dummy_user,
+            )
+
+        # scroll down with the cursors, no page numbers
+        pages = []
+        params = {'type': 'followings', 'user_id': self.user1.id, 'size': 5}
+        response = self.user2_client.get(LIST_FOLLOWINGS_URL, params)
+        pages.append(response.data)
+        while response.data['has_next_page']:
+            response = self.user2_client.get(LIST_FOLLOWINGS_URL, {
+                **params,
+                'before': response.data['next_cursor'],
+            })
+            pages.append(response.data)
+        self.assertEqual([len(page['friendships']) for page in pages], [5, 5, 1])
+        self.assertEqual(pages[-1]['friendships'][0]['user']['id'], self.user2.id) # only user 2 in page 3
+        for page in pages:
+            self.assertEqual(page['total_results'], 11)  # 10 dummies + user2
+            self.assertEqual(page['total_pages'], 3)
+
+        # totals from the maintained counters, no COUNT(*) per page
+        self.create_friendship(from_user=self.user1, to_user=self.user3)
+        FriendshipService.unfollow(from_user_id=self.user1.id, to_user_id=self.user2.id)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.user2_client.get(LIST_FOLLOWINGS_URL, params)
+        self.assertEqual(response.data['total_results'], 11)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+
+    def test_friendship_keyset_pagination_unknown_user(self):
+        GateKeeper.set_kv('switch_friendship_keyset_pagination', 'percent', 100)
+        response = self.user2_client.get(LIST_FOLLOWERS_URL, {'type': 'followers', 'user_id': 'abc'})
+        self.assertEqual(response.status_code, 400)
+        # a read doesn't create the profile of a user
+        profile_count = UserProfile.objects.count()
+        response = self.user2_client.get(LIST_FOLLOWERS_URL, {'type': 'followers', 'user_id': 999})
+        self.assertEqual(response.status_code, 404)
+        response = self.user2_client.get(LIST_FOLLOWINGS_URL, {'type': 'followings', 'user_id': 999})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(UserProfile.objects.count(), profile_count)
+
     def test_friendship_has_followed(self):
         # anonymous client not allowed
         response = self.anonymous_client.get(
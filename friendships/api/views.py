@@ -1,5 +1,6 @@
 from django.contrib.auth.models import User
 from django.utils.decorators import method_decorator
+from friendships.api.paginations import FriendShipKeysetPagination
 from friendships.api.paginations import FriendShipPagination
 from friendships.api.serializers import FriendshipCreateSerializer
 from friendships.api.serializers import FriendshipFollowerSerializer
@@ -37,7 +38,7 @@ class FriendshipViewSet(viewsets.GenericViewSet):
             page = paginator.paginate_hbase(HBaseFollower, (pk, ), request)
         else:
             friendships = Friendship.objects.filter(to_user_id=pk).order_by('-created_at')
-            page = paginator.paginate_queryset(friendships)
+            page = self.paginate_queryset(friendships)
         serializer = FriendshipFollowerSerializer(page, many=True, context={'request': request})
         return paginator.get_paginated_response(serializer.data)
 
@@ -50,14 +51,18 @@ class FriendshipViewSet(viewsets.GenericViewSet):
             page = paginator.paginate_hbase(HBaseFollowing, (pk,), request)
         else:
             friendships = Friendship.objects.filter(from_user_id=pk).order_by('-created_at')
-            page = paginator.paginate_queryset(friendships)
+            page = self.paginate_queryset(friendships)
         serializer = FriendshipFollowingSerializer(page, many=True, context={'request': request})
         return paginator.get_paginated_response(serializer.data)
 
     @require_params(require_attrs='query_params', params=['type', 'user_id'])
     @method_decorator(ratelimit(key='user', rate='3/s', method='GET', block=True))
     def list(self, request):
-        paginator = self.paginator
+        # HBase rows can only be seeked, MySQL pages by number until the
+        # keyset pages are switched on
+        keyset = GateKeeper.is_switch_on('switch_friendship_to_hbase') \
+            or GateKeeper.is_switch_on('switch_friendship_keyset_pagination')
+        paginator = FriendShipKeysetPagination() if keyset else FriendShipPagination()
         # list out followers or followings with Rest Framework Query Style
         # check query type
         if request.query_params['type'] not in ['followers', 'followings']:
@@ -66,26 +71,39 @@ class FriendshipViewSet(viewsets.GenericViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+        try:
+            user_id = int(request.query_params['user_id'])
+        except ValueError:
+            return Response(
+                "Please check input. user_id need to be an integer",
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not User.objects.filter(id=user_id).exists():
+            return Response('User not exists', status=status.HTTP_404_NOT_FOUND)
+
         # query friendships
         query_type = request.query_params['type']
-        user_id = request.query_params['user_id']
         if query_type == 'followers':
+            if keyset:
+                paginator.total_results = FriendshipService.get_follower_count(user_id)
             if GateKeeper.is_switch_on('switch_friendship_to_hbase'):
                 page = paginator.paginate_hbase(HBaseFollower, (user_id,), request)
             else:
                 friendships = Friendship.objects.filter(to_user_id=user_id)
-                page = paginator.paginate_queryset(friendships)
+                page = paginator.paginate_queryset(friendships, request)
             serializer = FriendshipFollowerSerializer(
                 page,
                 many=True,
                 context={'request': request},
             )
         else:
+            if keyset:
+                paginator.total_results = FriendshipService.get_following_count(user_id)
             if GateKeeper.is_switch_on('switch_friendship_to_hbase'):
                 page = paginator.paginate_hbase(HBaseFollowing, (user_id,), request)
             else:
                 friendships = Friendship.objects.filter(from_user_id=user_id)
-                page = paginator.paginate_queryset(friendships)
+                page = paginator.paginate_queryset(friendships, request)
             serializer = FriendshipFollowingSerializer(
                 page,
                 many=True,
@@ -0,0 +1,4 @@
+from django.conf import settings
+
+# rows loaded per query when streaming the followers of a user
+FOLLOWER_IDS_BATCH_SIZE = 1000 if not settings.TESTING else 3
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.4 on 2026-10-18 21:30
+
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('friendships', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='friendship',
+            index_together={('to_user', 'created_at'), ('to_user', 'id'), ('from_user', 'created_at')},
+        ),
+    ]
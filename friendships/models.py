@@ -24,6 +24,8 @@ class Friendship(models.Model):
         index_together = [
             ['from_user', 'created_at'],
             ['to_user', 'created_at'],
+            # keyset pagination over the followers when fanning out
+            ['to_user', 'id'],
         ]
 
         unique_together = ['from_user', 'to_user']
@@ -1,8 +1,16 @@
+from accounts.models import UserProfile
+from accounts.services import UserService
 from django.conf import settings
 from django.core.cache import caches
+from django.db.models import F
+from friendships.constants import FOLLOWER_IDS_BATCH_SIZE
 from friendships.models import Friendship
 from utils.cache import FOLLOWING_PATTERN
+from utils.redis_helper import RedisHelper
 from gatekeeper.models import GateKeeper
+from newsfeeds.tasks import backfill_newsfeeds_on_follow_task
+from newsfeeds.tasks import remove_newsfeeds_on_unfollow_task
+from utils.time_constants import MAX_TIMESTAMP
 from utils.time_helper import ts_now_as_int
 from friendships.hbase_models import HBaseFollowing, HBaseFollower
 
@@ -38,8 +46,50 @@ class FriendshipService():
 
     @classmethod
     def get_follower_ids(cls, user_id):
-        friendships = Friendship.objects.filter(to_user_id=user_id)
-        return [f.from_user_id for f in friendships]
+        return list(cls.iterate_follower_ids(user_id))
+
+    @classmethod
+    def iterate_follower_ids(cls, user_id, batch_size=FOLLOWER_IDS_BATCH_SIZE):
+        """
+        Stream the follower ids of a user, one batch of rows is held in
+        memory at a time no matter how many followers the user has
+        """
+        if GateKeeper.is_switch_on('switch_friendship_to_hbase'):
+            yield from cls._iterate_hbase_follower_ids(user_id, batch_size)
+            return
+
+        # keyset pagination over (to_user_id, id), every batch is a range
+        # scan on the index instead of an OFFSET skipping the previous rows
+        last_id = 0
+        while True:
+            rows = list(
+                Friendship.objects.filter(to_user_id=user_id, id__gt=last_id)
+                .order_by('id')
+                .values_list('id', 'from_user_id')[:batch_size]
+            )
+            for _, from_user_id in rows:
+                yield from_user_id
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    @classmethod
+    def _iterate_hbase_follower_ids(cls, user_id, batch_size):
+        # the row keys are sorted by (to_user_id, created_at), each scan
+        # starts right after the last created_at of the previous one and
+        # stops at the end of the user, never reading into the next one
+        created_at = None
+        while True:
+            followers = HBaseFollower.filter(
+                start=(user_id, created_at),
+                stop=(user_id, MAX_TIMESTAMP),
+                limit=batch_size,
+            )
+            for follower in followers:
+                yield follower.from_user_id
+            if len(followers) < batch_size:
+                return
+            created_at = followers[-1].created_at + 1
 
     @classmethod
     def get_following_user_id_set(cls, from_user_id):
@@ -71,22 +121,26 @@ class FriendshipService():
             return None
 
         if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
-            return Friendship.objects.create(
+            friendship = Friendship.objects.create(
                 from_user_id=from_user_id,
                 to_user_id=to_user_id,
             )
-
-        now = ts_now_as_int()
-        HBaseFollower.create(
-            from_user_id=from_user_id,
-            created_at=now,
-            to_user_id=to_user_id,
-        )
-        return HBaseFollowing.create(
-            from_user_id=from_user_id,
-            created_at=now,
-            to_user_id=to_user_id,
-        )
+        else:
+            now = ts_now_as_int()
+            HBaseFollower.create(
+                from_user_id=from_user_id,
+                created_at=now,
+                to_user_id=to_user_id,
+            )
+            friendship = HBaseFollowing.create(
+                from_user_id=from_user_id,
+                created_at=now,
+                to_user_id=to_user_id,
+            )
+        cls.incr_friendship_counts(from_user_id, to_user_id, 1)
+        # pull the recent tweets of the new following into the newsfeeds
+        backfill_newsfeeds_on_follow_task.delay(from_user_id, to_user_id)
+        return friendship
 
     @classmethod
     def unfollow(cls, from_user_id, to_user_id):
@@ -98,8 +152,16 @@ class FriendshipService():
                 from_user_id=from_user_id,
                 to_user_id=to_user_id,
             ).delete()
-            return delete
+        else:
+            delete = cls._delete_hbase_friendship(from_user_id, to_user_id)
+        if delete:
+            cls.incr_friendship_counts(from_user_id, to_user_id, -1)
+            # drop the tweets of the unfollowed user from the newsfeeds
+            remove_newsfeeds_on_unfollow_task.delay(from_user_id, to_user_id)
+        return delete
 
+    @classmethod
+    def _delete_hbase_friendship(cls, from_user_id, to_user_id):
         following = cls.get_following_instance(from_user_id=from_user_id, to_user_id=to_user_id)
         # fs = HBaseFollowing.filter(prefix=(from_user_id, None))
         # for f in fs:
@@ -135,15 +197,56 @@ class FriendshipService():
 
     @classmethod
     def get_following_count(cls, from_user_id):
-        if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
-            return Friendship.objects.filter(from_user_id=from_user_id).count()
-        followings = HBaseFollowing.filter(prefix=(from_user_id, None))
-        return len(followings)
+        return cls._get_friendship_count(from_user_id, 'following_count')
 
     @classmethod
     def get_follower_count(cls, to_user_id):
+        return cls._get_friendship_count(to_user_id, 'follower_count')
+
+    @classmethod
+    def _count_friendships(cls, user_id, attr):
+        if attr == 'following_count':
+            if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
+                return Friendship.objects.filter(from_user_id=user_id).count()
+            return len(HBaseFollowing.filter(prefix=(user_id, None)))
         if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
-            return Friendship.objects.filter(to_user_id=to_user_id).count()
-        followers = HBaseFollower.filter(prefix=(to_user_id, None))
-        return len(followers)
+            return Friendship.objects.filter(to_user_id=user_id).count()
+        return len(HBaseFollower.filter(prefix=(user_id, None)))
+
+    @classmethod
+    def _init_friendship_count(cls, profile, attr):
+        # count once, the counter is maintained by follow / unfollow from now on
+        UserProfile.objects.filter(id=profile.id, **{attr + '__isnull': True}).update(
+            **{attr: cls._count_friendships(profile.user_id, attr)}
+        )
+        UserService.invalidate_profile_cache(profile.user_id)
+
+    @classmethod
+    def _get_friendship_count(cls, user_id, attr):
+        """
+        follower / following count from the profile counters cached in Redis
+        instead of a COUNT(*) over the friendships
+        """
+        profile = UserService.find_profile_through_cache(user_id)
+        # no profile to keep the counter on, a read doesn't create one
+        if profile is None:
+            return cls._count_friendships(user_id, attr)
+        if getattr(profile, attr) is None:
+            cls._init_friendship_count(profile, attr)
+        return RedisHelper.get_count(profile, attr)
+
+    @classmethod
+    def incr_friendship_counts(cls, from_user_id, to_user_id, delta):
+        for user_id, attr in [(from_user_id, 'following_count'), (to_user_id, 'follower_count')]:
+            profile = UserService.get_profile_through_cache(user_id)
+            if getattr(profile, attr) is None:
+                # counted from the friendships, the change is already included
+                cls._init_friendship_count(profile, attr)
+                continue
+            # atomic in db, same as the tweet counters
+            UserProfile.objects.filter(id=profile.id).update(**{attr: F(attr) + delta})
+            if delta > 0:
+                RedisHelper.incr_count(profile, attr)
+            else:
+                RedisHelper.decr_count(profile, attr)
 
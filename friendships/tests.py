@@ -54,12 +54,51 @@ class FriendShipServiceTest(TestCase):
         user_id_set_1 = FriendshipService.get_following_user_id_set(self.user1.id)
         self.assertEqual(user_id_set_1, {self.user3.id})
 
+    def test_iterate_follower_ids(self):
+        # more followers than one batch
+        followers = [
+            self.create_user(username='follower{}'.format(i))
+            for i in range(7)
+        ]
+        for follower in followers:
+            Friendship.objects.create(from_user=follower, to_user=self.user2)
+        follower_ids = FriendshipService.iterate_follower_ids(self.user2.id, batch_size=3)
+        self.assertEqual(
+            list(follower_ids),
+            [self.user1.id] + [follower.id for follower in followers],
+        )
+        self.assertEqual(
+            set(FriendshipService.get_follower_ids(self.user1.id)),
+            {self.user2.id, self.user3.id},
+        )
+        self.assertEqual(list(FriendshipService.iterate_follower_ids(followers[0].id)), [])
+
 
 class HBaseFriendshipTest(TestCase):
 
     def setUp(self) -> None:
         super(HBaseFriendshipTest, self).setUp()
 
+    def test_iterate_hbase_follower_ids(self):
+        GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', 100)
+        now = self.ts_now()
+        # a whole number of batches, the last scan ends at the next user
+        for to_user_id, from_user_ids in [(1, range(10, 16)), (2, range(20, 23))]:
+            for index, from_user_id in enumerate(from_user_ids):
+                HBaseFollower.create(
+                    from_user_id=from_user_id,
+                    created_at=now + index,
+                    to_user_id=to_user_id,
+                )
+        self.assertEqual(
+            list(FriendshipService.iterate_follower_ids(1, batch_size=3)),
+            list(range(10, 16)),
+        )
+        self.assertEqual(
+            list(FriendshipService.iterate_follower_ids(2, batch_size=3)),
+            list(range(20, 23)),
+        )
+
     def ts_now(self):
         return int(time.time() * 1000000)
 
@@ -1,11 +1,11 @@
-from utils.redis_client import RedisClient
+from utils.redis_client import RedisClient, RedisRole
 
 
 class GateKeeper:
 
     @classmethod
     def get(cls, gk_name):
-        conn = RedisClient.get_connection()
+        conn = RedisClient.get_connection(RedisRole.GATEKEEPER)
         name = f'gatekeeper:{gk_name}'
         if not conn.exists(name):
             return {'percent': 0, 'description': '',}
@@ -18,7 +18,7 @@ class GateKeeper:
 
     @classmethod
     def set_kv(cls, gk_name, key, value):
-        conn = RedisClient.get_connection()
+        conn = RedisClient.get_connection(RedisRole.GATEKEEPER)
         name = f'gatekeeper:{gk_name}'
         conn.hset(name, key, value)
 
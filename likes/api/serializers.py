@@ -5,6 +5,7 @@ from rest_framework.exceptions import ValidationError
 from django.contrib.contenttypes.fields import ContentType
 from comments.models import Comment
 from tweets.models import Tweet
+from tweets.services import TweetService
 
 
 class LikeSerializer(serializers.ModelSerializer):
@@ -37,6 +38,9 @@ class BaseLikeSerializerForCreateAndCancel(serializers.ModelSerializer):
         object_id = attrs['object_id']
         if not model_class.objects.filter(id=object_id).exists():
             raise ValidationError({'object_id': 'object_id doesn not exist'})
+        # deleted, waiting to be compacted
+        if model_class == Tweet and TweetService.is_tweet_deleted(object_id):
+            raise ValidationError({'object_id': 'object_id doesn not exist'})
 
         return attrs
 
@@ -1,9 +1,14 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from testing.testcases import TestCase
 from rest_framework.test import APIClient
 from likes.models import Like
 
 CREATE_URL = '/api/likes/'
 CANCEL_URL = '/api/likes/cancel/'
+TWEET_LIST_URL = '/api/tweets/'
+COMMENT_LIST_URL = '/api/comments/'
+NEWSFEED_LIST_URL = '/api/newsfeeds/'
 
 
 class LikeTest(TestCase):
@@ -164,3 +169,60 @@ class LikeTest(TestCase):
         self.assertEqual(self.comment1.like_set.count(), 1)
 
 
+class HasLikedQueryTest(TestCase):
+
+    def setUp(self) -> None:
+        self.clear_cache()
+        self.user1, self.user1_client = self.create_user_and_client(username='user1')
+
+    def _get_with_has_liked_queries(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.user1_client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        # the like_count of comments also reads the like table, without the user
+        has_liked_queries = [
+            query for query in queries.captured_queries
+            if '"likes_like"' in query['sql'] and '"user_id"' in query['sql']
+        ]
+        return response, len(has_liked_queries)
+
+    def test_has_liked_queries(self):
+        liked_tweet_ids, liked_comment_ids = set(), set()
+        for page_size in [2, 10]:
+            author = self.create_user(username='author{}'.format(page_size))
+            tweets = [self.create_tweet(user=author) for _ in range(page_size)]
+            # the follow pulls the tweets into the newsfeeds
+            self.create_friendship(from_user=self.user1, to_user=author)
+            tweet = tweets[0]
+            comments = [self.create_comment(user=author, tweet=tweet) for _ in range(page_size)]
+            for obj in tweets[::2] + comments[::2]:
+                self.create_like(user=self.user1, object=obj)
+            liked_tweet_ids.update(tweet.id for tweet in tweets[::2])
+            liked_comment_ids.update(comment.id for comment in comments[::2])
+
+            response, num_queries = self._get_with_has_liked_queries(TWEET_LIST_URL, {'user_id': author.id})
+            self.assertEqual(num_queries, 1)
+            self.assertEqual(len(response.data['results']), page_size)
+            for result in response.data['results']:
+                self.assertEqual(result['has_liked'], result['id'] in liked_tweet_ids)
+
+            response, num_queries = self._get_with_has_liked_queries(NEWSFEED_LIST_URL)
+            self.assertEqual(num_queries, 1)
+            self.assertGreaterEqual(len(response.data['results']), page_size)
+            for result in response.data['results']:
+                self.assertEqual(result['tweet']['has_liked'], result['tweet']['id'] in liked_tweet_ids)
+
+            response, num_queries = self._get_with_has_liked_queries(COMMENT_LIST_URL, {'tweet_id': tweet.id})
+            self.assertEqual(num_queries, 1)
+            self.assertEqual(len(response.data['comments']), page_size)
+            for result in response.data['comments']:
+                self.assertEqual(result['has_liked'], result['id'] in liked_comment_ids)
+
+            # the comments of a tweet detail, the tweet itself is a single like check
+            response, num_queries = self._get_with_has_liked_queries(TWEET_LIST_URL + '{}/'.format(tweet.id))
+            self.assertEqual(num_queries, 2)
+            self.assertEqual(response.data['has_liked'], True)
+            self.assertEqual(
+                [result['has_liked'] for result in response.data['comments']],
+                [comment.id in liked_comment_ids for comment in comments],
+            )
@@ -1,9 +1,7 @@
-from django.db.models import F
-from utils.redis_helper import RedisHelper
-
-
 def incr_like_count(sender, instance, created, **kwargs):
     from tweets.models import Tweet
+    from tweets.services import TweetService
+
     if not created:
          return
 
@@ -11,27 +9,15 @@ def incr_like_count(sender, instance, created, **kwargs):
     if model_class != Tweet:
         return
 
-    # atomic operations for concurrency safe
-    # django F translated SQL ensures concurrency safe in db level
-    Tweet.objects.filter(id=instance.object_id)\
-        .update(like_count=F('like_count') + 1)
-    # extra counter in cache
-    # the cached popular object should not be invalid frequently
-    RedisHelper.incr_count(instance.content_object, 'like_count')
+    TweetService.incr_count(instance.content_object, 'like_count', 1)
 
 
 def decr_like_count(sender, instance, **kwargs):
     from tweets.models import Tweet
+    from tweets.services import TweetService
 
     model_class = instance.content_type.model_class()
     if model_class != Tweet:
         return
 
-    # atomic operations for concurrency safe
-    # django F translated SQL ensures concurrency safe in db level
-    Tweet.objects.filter(id=instance.object_id)\
-        .update(like_count=F('like_count') - 1)
-    # extra counter in cache
-    # the cached popular object should not be invalid frequently
-    RedisHelper.decr_count(instance.content_object, 'like_count')
-
+    TweetService.incr_count(instance.content_object, 'like_count', -1)
@@ -12,4 +12,18 @@ class LikeService():
             user=user,
             object_id=obj.id,
             content_type=ContentType.objects.get_for_model(obj.__class__),
-        ).exists()
\ No newline at end of file
+        ).exists()
+
+    @classmethod
+    def get_liked_object_ids(cls, user, objects):
+        """
+        Ids of the objects liked by the user, a page of objects of one model
+        in a single query on the (user, content_type, object_id) index
+        """
+        if user.is_anonymous or not objects:
+            return set()
+        return set(Like.objects.filter(
+            user=user,
+            object_id__in=[obj.id for obj in objects],
+            content_type=ContentType.objects.get_for_model(objects[0].__class__),
+        ).values_list('object_id', flat=True))
@@ -0,0 +1,10 @@
+from utils.paginations import EndlessPagination
+
+
+class NewsFeedPagination(EndlessPagination):
+    """
+    The newsfeeds are sorted by (created_at, tweet_id) descending
+    the tweets pulled from the celebrities are merged in as unsaved newsfeeds
+    without an id, the tweet_id is unique in a newsfeed timeline either way
+    """
+    tie_breaker = 'tweet_id'
@@ -1,12 +1,36 @@
+from django.db.models import Manager
+from rest_framework.serializers import ListSerializer
+from rest_framework.serializers import IntegerField
 from rest_framework.serializers import ModelSerializer
+from rest_framework.serializers import Serializer
 from tweets.api.serializers import TweetSerializer
 from newsfeeds.models import NewsFeed
 
 
+class NewsFeedListSerializer(ListSerializer):
+
+    def to_representation(self, data):
+        newsfeeds = list(data.all() if isinstance(data, Manager) else data)
+        tweets = [newsfeed.cached_tweet for newsfeed in newsfeeds]
+        tweets = [tweet for tweet in tweets if tweet is not None]
+        TweetSerializer.preload_counts(self.context, tweets)
+        TweetSerializer.preload_has_liked(self.context, tweets)
+        return super(NewsFeedListSerializer, self).to_representation(newsfeeds)
+
+
 class NewsFeedSerializer(ModelSerializer):
     tweet = TweetSerializer(source='cached_tweet')
 
     class Meta:
         model = NewsFeed
         fields = ('id', 'created_at', 'tweet')
+        list_serializer_class = NewsFeedListSerializer
+
 
+class HBaseNewsFeedSerializer(Serializer):
+    # HBase newsfeeds have no id, created_at is the timestamp of the row key
+    created_at = IntegerField()
+    tweet = TweetSerializer(source='cached_tweet')
+
+    class Meta:
+        list_serializer_class = NewsFeedListSerializer
@@ -2,17 +2,21 @@ from django.db.models.signals import post_save
 from django.utils.decorators import method_decorator
 from ratelimit.decorators import ratelimit
 
+from gatekeeper.models import GateKeeper
+from newsfeeds.api.paginations import NewsFeedPagination
+from newsfeeds.api.serializers import HBaseNewsFeedSerializer
 from newsfeeds.api.serializers import NewsFeedSerializer
+from newsfeeds.hbase_models import HBaseNewsFeed
 from newsfeeds.listeners import push_newsfeed_to_cache
 from newsfeeds.models import NewsFeed
 from newsfeeds.services import NewsFeedService
 from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from utils.paginations import EndlessPagination
+from tweets.services import TweetService
 
 
 class NewsFeedViewSet(viewsets.GenericViewSet):
-    pagination_class = EndlessPagination
+    pagination_class = NewsFeedPagination
 
     def get_permissions(self):
         if self.action == 'list':
@@ -21,14 +25,27 @@ class NewsFeedViewSet(viewsets.GenericViewSet):
 
     @method_decorator(ratelimit(key='user', rate='5/s', method='GET', block=True))
     def list(self, request):
+        if GateKeeper.is_switch_on('switch_newsfeed_to_hbase'):
+            return self._list_from_hbase(request)
+
         cached_newsfeeds = NewsFeedService.load_newsfeeds_through_cache(
-            user_id=request.user.id
+            user_id=request.user.id,
+            **self.paginator.get_cached_list_window(request),
         )
         page = self.paginator.paginate_cached_list(cached_newsfeeds, request)
         # cache not enough, access the db directly for extra
         if not page:
-            newsfeeds = NewsFeed.objects.filter(user_id=request.user.id)
-            page = self.paginate_queryset(newsfeeds)
+            newsfeeds = NewsFeedService.load_merged_newsfeeds(
+                request.user.id,
+                **self.paginator.get_merged_window(request),
+            )
+            if newsfeeds is not None:
+                page = self.paginator.paginate_merged_list(newsfeeds, request)
+            else:
+                newsfeeds = NewsFeed.objects.filter(user_id=request.user.id)
+                page = self.paginate_queryset(newsfeeds)
+        # the deleted tweets are only purged from the newsfeeds later
+        page = TweetService.exclude_deleted_tweets(page, attr='tweet_id')
         serializer = NewsFeedSerializer(
             page,
             context={'request': request},
@@ -36,6 +53,25 @@ class NewsFeedViewSet(viewsets.GenericViewSet):
         )
         return self.get_paginated_response(serializer.data)
 
+    def _list_from_hbase(self, request):
+        newsfeeds = NewsFeedService.load_merged_newsfeeds(
+            request.user.id,
+            hbase=True,
+            **self.paginator.get_merged_window(request),
+        )
+        if newsfeeds is not None:
+            page = self.paginator.paginate_merged_list(newsfeeds, request)
+        else:
+            page = self.paginator.paginate_hbase(HBaseNewsFeed, (request.user.id,), request)
+            NewsFeedService.hydrate_newsfeeds(page)
+        page = TweetService.exclude_deleted_tweets(page, attr='tweet_id')
+        serializer = HBaseNewsFeedSerializer(
+            page,
+            context={'request': request},
+            many=True,
+        )
+        return self.get_paginated_response(serializer.data)
+
 
 # clear Redis cache in create()
 post_save.connect(push_newsfeed_to_cache, sender=NewsFeed)
@@ -1,3 +1,18 @@
 from django.conf import settings
+from utils.time_constants import ONE_DAY
 
 FANOUT_BATCH_SIZE = 1000 if not settings.TESTING else 3
+# rows per INSERT statement when a fanout batch creates the newsfeeds
+NEWSFEED_BULK_CREATE_BATCH_SIZE = 500
+# puts per HBase request when the newsfeeds are written to HBase
+HBASE_NEWSFEED_BATCH_SIZE = 500
+# authors with this many followers are not fanned out, their tweets are
+# merged into the newsfeeds of the followers at read time
+CELEBRITY_FOLLOWER_THRESHOLD = 10000 if not settings.TESTING else 5
+# followers not seen for this many seconds are skipped by the fanout, their
+# newsfeeds are rebuilt from the tweets of their followings when they return
+INACTIVE_USER_THRESHOLD = 30 * ONE_DAY
+# tweets pulled into the newsfeeds of a returning user
+NEWSFEED_REBUILD_LIMIT = 200 if not settings.TESTING else 20
+# tweets of a new following pulled into the newsfeeds of the follower
+FOLLOW_BACKFILL_LIMIT = 20
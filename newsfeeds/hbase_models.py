@@ -0,0 +1,30 @@
+from django_hbase.models import HBaseModel
+from django_hbase import models as hbase_models
+from tweets.models import Tweet
+from utils.memcached_helpers import MemcachedHelper
+
+
+class HBaseNewsFeed(HBaseModel):
+    """
+    Save the newsfeeds of user_id, sorted by 'user_id + created_at'
+
+    Enable queries:
+    1. user_id newsfeeds order by created_at
+    2. range query for user_id newsfeeds given before or after a timestamp
+    """
+    # row_key
+    user_id = hbase_models.IntegerField(reverse=True)
+    created_at = hbase_models.TimeStampField()
+    # column_key
+    tweet_id = hbase_models.IntegerField(column_family='cf')
+
+    class Meta:
+        table_name = 'twitter_newsfeeds'
+        row_keys = ('user_id', 'created_at',)
+
+    @property
+    def cached_tweet(self):
+        # tweet already hydrated in batch by NewsFeedService
+        if getattr(self, 'tweet', None) is not None:
+            return self.tweet
+        return MemcachedHelper.get_object_throught_cache(Tweet, self.tweet_id)
@@ -0,0 +1,84 @@
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Max, Min
+from django_hbase.client import HBaseClient
+from multiprocessing import Pool
+from newsfeeds.constants import HBASE_NEWSFEED_BATCH_SIZE
+from newsfeeds.hbase_models import HBaseNewsFeed
+from newsfeeds.models import NewsFeed
+from utils.time_helper import datetime_to_ts
+
+
+def _init_worker():
+    # happybase connections are not safe to share with the forked workers
+    HBaseClient.conn = None
+
+
+def copy_chunk(id_range):
+    """
+    Copy the newsfeeds with ids in [start, stop) to HBase, rows written
+    already are overwritten with the same values
+    """
+    start, stop = id_range
+    rows = NewsFeed.objects.filter(
+        id__gte=start,
+        id__lt=stop,
+        user_id__isnull=False,
+        tweet_id__isnull=False,
+    ).values_list('user_id', 'tweet_id', 'created_at')
+    HBaseNewsFeed.batch_create(
+        [
+            {
+                'user_id': user_id,
+                'created_at': datetime_to_ts(created_at),
+                'tweet_id': tweet_id,
+            }
+            for user_id, tweet_id, created_at in rows
+        ],
+        batch_size=HBASE_NEWSFEED_BATCH_SIZE,
+    )
+    return len(rows)
+
+
+class Command(BaseCommand):
+    help = 'Copy the MySQL newsfeeds to HBase in parallel chunks of ids'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument(
+            '--start-id',
+            type=int,
+            default=None,
+            help='resume a backfill from this newsfeed id',
+        )
+
+    def handle(self, *args, **options):
+        id_range = NewsFeed.objects.aggregate(min_id=Min('id'), max_id=Max('id'))
+        if id_range['min_id'] is None:
+            self.stdout.write('No newsfeeds to backfill')
+            return
+        start_id = options['start_id'] or id_range['min_id']
+        chunk_size = options['chunk_size']
+        chunks = [
+            (start, start + chunk_size)
+            for start in range(start_id, id_range['max_id'] + 1, chunk_size)
+        ]
+
+        copied = 0
+        for (start, stop), num_rows in zip(chunks, self._copy_chunks(chunks, options['workers'])):
+            copied += num_rows
+            self.stdout.write('{} newsfeeds copied, resume with --start-id {}'.format(copied, stop))
+        self.stdout.write(self.style.SUCCESS(
+            'Backfilled {} newsfeeds in {} chunks'.format(copied, len(chunks))
+        ))
+
+    def _copy_chunks(self, chunks, workers):
+        if workers <= 1:
+            yield from map(copy_chunk, chunks)
+            return
+        # the workers are forked, they open their own db connections
+        connections.close_all()
+        with Pool(workers, initializer=_init_worker) as pool:
+            # in order, every chunk before the resume id printed is copied
+            yield from pool.imap(copy_chunk, chunks)
@@ -0,0 +1,20 @@
+from newsfeeds.services import NewsFeedService
+
+
+class UserActivityMiddleware:
+    """
+    Keep the last seen time of the signed in users for the fanout, see
+    NewsFeedService.touch_user(), the only place the activity is recorded
+
+    Runs after the view, DRF only authenticates the user in the view
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            NewsFeedService.touch_user(user.id)
+        return response
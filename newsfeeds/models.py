@@ -22,6 +22,9 @@ class NewsFeed(models.Model):
 
     @property
     def cached_tweet(self):
+        # tweet already hydrated in batch by NewsFeedService
+        if NewsFeed.tweet.is_cached(self):
+            return self.tweet
         return MemcachedHelper.get_object_throught_cache(Tweet, self.tweet_id)
 
 
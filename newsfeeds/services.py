@@ -1,8 +1,40 @@
+import heapq
+import time
+from accounts.models import UserProfile
+from accounts.services import UserService
+from django.db.models import Case, DateTimeField, Value, When
+from friendships.services import FriendshipService
+from gatekeeper.models import GateKeeper
+from newsfeeds.constants import CELEBRITY_FOLLOWER_THRESHOLD
+from newsfeeds.constants import FOLLOW_BACKFILL_LIMIT
+from newsfeeds.constants import HBASE_NEWSFEED_BATCH_SIZE
+from newsfeeds.constants import INACTIVE_USER_THRESHOLD
+from newsfeeds.constants import NEWSFEED_BULK_CREATE_BATCH_SIZE
+from newsfeeds.constants import NEWSFEED_REBUILD_LIMIT
+from newsfeeds.hbase_models import HBaseNewsFeed
 from newsfeeds.models import NewsFeed
+from tweets.models import Tweet
+from tweets.services import TweetService
+from utils.cache import CELEBRITY_SET
+from utils.cache import FANOUT_PROGRESS_PATTERN
+from utils.cache import USER_LAST_SEEN_PATTERN
 from utils.cache import USER_NEWSFEED_PATTERN
+from utils.cache import USER_NEWSFEED_SORTED_SET_PATTERN
+from utils.memcached_helpers import MemcachedHelper
+from utils.redis_client import RedisClient, RedisRole
 from utils.redis_helper import RedisHelper
+from utils.redis_serializers import DjangoModelIdSerializer
+from utils.cursors import filter_after, filter_before
+from utils.time_constants import MAX_TIMESTAMP, ONE_DAY
+from utils.time_helper import datetime_to_ts
 from newsfeeds.tasks import fanout_to_followers_main_task
+from newsfeeds.tasks import rebuild_newsfeeds_task
 
+# newsfeed lists only save the ids, the tweets are hydrated from memcached
+NEWSFEED_ID_SERIALIZER = DjangoModelIdSerializer(
+    NewsFeed,
+    fields=('id', 'user_id', 'tweet_id', 'created_at'),
+)
 
 class NewsFeedService():
     @classmethod
@@ -28,15 +60,547 @@ class NewsFeedService():
         fanout_to_followers_main_task.delay(tweet.id, tweet.user_id)
 
     @classmethod
-    def load_newsfeeds_through_cache(cls, user_id):
+    def start_fanout_progress(cls, tweet_id, num_batches):
+        name = FANOUT_PROGRESS_PATTERN.format(tweet_id=tweet_id)
+        conn = RedisClient.get_connection(RedisRole.TIMELINE, name)
+        pipe = conn.pipeline(transaction=True)
+        pipe.delete(name)
+        pipe.hset(name, mapping={
+            'total': num_batches,
+            'done': 0,
+            'pushed': 0,
+            'skipped': 0,
+            'started_at': time.time(),
+        })
+        pipe.expire(name, ONE_DAY)
+        pipe.execute()
+
+    @classmethod
+    def record_fanout_batch(cls, tweet_id, num_pushed, num_skipped):
+        name = FANOUT_PROGRESS_PATTERN.format(tweet_id=tweet_id)
+        conn = RedisClient.get_connection(RedisRole.TIMELINE, name)
+        pipe = conn.pipeline(transaction=True)
+        pipe.hincrby(name, 'done', 1)
+        pipe.hincrby(name, 'pushed', num_pushed)
+        pipe.hincrby(name, 'skipped', num_skipped)
+        pipe.execute()
+
+    @classmethod
+    def finish_fanout_progress(cls, tweet_id):
+        name = FANOUT_PROGRESS_PATTERN.format(tweet_id=tweet_id)
+        conn = RedisClient.get_connection(RedisRole.TIMELINE, name)
+        conn.hset(name, 'finished_at', time.time())
+
+    @classmethod
+    def get_fanout_progress(cls, tweet_id):
+        """
+        Progress of the fanout of a tweet, None if it is unknown or expired
+
+        Output:
+        Dict of the batches done / total, the newsfeeds pushed to cache and
+        skipped, the seconds elapsed and whether the fanout is finished
+        """
+        name = FANOUT_PROGRESS_PATTERN.format(tweet_id=tweet_id)
+        conn = RedisClient.get_connection(RedisRole.TIMELINE, name)
+        progress = conn.hgetall(name)
+        if not progress:
+            return None
+        started_at = float(progress[b'started_at'])
+        finished_at = float(progress.get(b'finished_at', time.time()))
+        return {
+            'done': int(progress[b'done']),
+            'total': int(progress[b'total']),
+            'pushed': int(progress[b'pushed']),
+            'skipped': int(progress[b'skipped']),
+            'elapsed': finished_at - started_at,
+            'finished': b'finished_at' in progress,
+        }
+
+    @classmethod
+    def touch_user(cls, user_id):
+        """
+        Mark the user as active, the key expires once the user has been
+        inactive for INACTIVE_USER_THRESHOLD seconds
+
+        A returning user missed the fanouts in the meantime, the newsfeeds
+        are rebuilt in a task. Only the request whose GETSET finds no last
+        seen time queues it, the concurrent ones see the time it just set
+        """
+        name = USER_LAST_SEEN_PATTERN.format(user_id=user_id)
+        conn = RedisClient.get_connection(RedisRole.TIMELINE, name)
+        pipe = conn.pipeline(transaction=True)
+        pipe.getset(name, int(time.time()))
+        pipe.expire(name, INACTIVE_USER_THRESHOLD)
+        last_seen, _ = pipe.execute()
+        if last_seen is None and GateKeeper.is_switch_on('switch_newsfeed_skip_inactive'):
+            rebuild_newsfeeds_task.delay(user_id)
+
+    @classmethod
+    def get_active_user_ids(cls, user_ids):
+        # one MGET per shard for a whole fanout batch
+        names = [USER_LAST_SEEN_PATTERN.format(user_id=user_id) for user_id in user_ids]
+        active = [False] * len(user_ids)
+        for conn, indexes in RedisClient.group_by_shard(RedisRole.TIMELINE, names):
+            last_seens = conn.mget([names[index] for index in indexes])
+            for index, last_seen in zip(indexes, last_seens):
+                active[index] = last_seen is not None
+        return [user_id for user_id, is_active in zip(user_ids, active) if is_active]
+
+    @classmethod
+    def rebuild_newsfeeds(cls, user_id):
+        """
+        Pull the latest NEWSFEED_REBUILD_LIMIT tweets of the followings into
+        the newsfeeds of a returning user, the ones older than that from the
+        inactive period are not backfilled
+        """
+        following_ids = FriendshipService.get_following_user_id_set(user_id)
+        if not following_ids:
+            return
+        tweets = list(
+            Tweet.objects.filter(user_id__in=following_ids)
+            .order_by('-created_at')
+            .only('id', 'created_at')[:NEWSFEED_REBUILD_LIMIT]
+        )
+        if not cls._create_backdated_newsfeeds(user_id, tweets):
+            return
+        # the cached timelines miss the pulled newsfeeds, the next read
+        # rebuilds them from db
+        for name in [
+            USER_NEWSFEED_PATTERN.format(user_id=user_id),
+            USER_NEWSFEED_SORTED_SET_PATTERN.format(user_id=user_id),
+        ]:
+            RedisClient.get_connection(RedisRole.TIMELINE, name).delete(name)
+
+    @classmethod
+    def _create_backdated_newsfeeds(cls, user_id, tweets):
+        """
+        Create the missing newsfeeds of user_id for tweets pulled after the
+        fanout, stamped with the created_at of their tweets
+
+        Output:
+        List of the newsfeeds created
+        """
+        existing_tweet_ids = set(
+            NewsFeed.objects.filter(user_id=user_id, tweet_id__in=[tweet.id for tweet in tweets])
+            .values_list('tweet_id', flat=True)
+        )
+        tweets = [tweet for tweet in tweets if tweet.id not in existing_tweet_ids]
+        if not tweets:
+            return []
+        NewsFeed.objects.bulk_create(
+            [NewsFeed(user_id=user_id, tweet_id=tweet.id) for tweet in tweets],
+            batch_size=NEWSFEED_BULK_CREATE_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+        # auto_now_add stamps the pulled newsfeeds with now, the newsfeeds
+        # are ordered by created_at so they get the time of their tweets
+        queryset = NewsFeed.objects.filter(
+            user_id=user_id,
+            tweet_id__in=[tweet.id for tweet in tweets],
+        )
+        queryset.update(created_at=Case(
+            *[When(tweet_id=tweet.id, then=Value(tweet.created_at)) for tweet in tweets],
+            output_field=DateTimeField(),
+        ))
+        newsfeeds = list(queryset)
+        cls.write_newsfeeds_to_hbase(newsfeeds)
+        return newsfeeds
+
+    @classmethod
+    def _get_timeline_queryset(cls, user_id):
+        # the cached timelines are filled in the order of the newsfeed cursors
+        return NewsFeed.objects.filter(user_id=user_id).order_by('-created_at', '-tweet_id')
+
+    @classmethod
+    def _get_timeline_names(cls, user_id):
+        # the cached timeline of the active backend, and the one of the other
+        # backend that goes stale on a change
+        list_name = USER_NEWSFEED_PATTERN.format(user_id=user_id)
+        sorted_set_name = USER_NEWSFEED_SORTED_SET_PATTERN.format(user_id=user_id)
+        if GateKeeper.is_switch_on('switch_newsfeed_to_sorted_set'):
+            return sorted_set_name, list_name, True
+        return list_name, sorted_set_name, False
+
+    @classmethod
+    def backfill_followed_tweets(cls, user_id, followed_user_id):
+        """
+        Pull the latest FOLLOW_BACKFILL_LIMIT tweets of a new following into
+        the newsfeeds of user_id, merged into the cached timeline in
+        created_at order instead of dropping it
+
+        Output:
+        Number of newsfeeds created
+        """
+        if GateKeeper.is_switch_on('switch_newsfeed_to_hybrid'):
+            # the tweets of a celebrity are pulled at read time already
+            if cls.is_celebrity(followed_user_id):
+                return 0
+        tweets = list(
+            Tweet.objects.filter(user_id=followed_user_id)
+            .order_by('-created_at')
+            .only('id', 'created_at')[:FOLLOW_BACKFILL_LIMIT]
+        )
+        newsfeeds = cls._create_backdated_newsfeeds(user_id, tweets)
+        if not newsfeeds:
+            return 0
+        name, stale_name, sorted_set = cls._get_timeline_names(user_id)
+        RedisHelper.merge_objects_to_cache(name, newsfeeds, NEWSFEED_ID_SERIALIZER, sorted_set, 'tweet_id')
+        RedisClient.get_connection(RedisRole.TIMELINE, stale_name).delete(stale_name)
+        return len(newsfeeds)
+
+    @classmethod
+    def remove_unfollowed_tweets(cls, user_id, unfollowed_user_id):
+        """
+        Remove the tweets of an unfollowed user from the newsfeeds of user_id
+        in batches, from the db and from the cached timeline
+
+        Output:
+        Number of newsfeeds removed
+        """
+        queryset = cls._get_timeline_queryset(user_id)
+        name, stale_name, sorted_set = cls._get_timeline_names(user_id)
+        removed = 0
+        while True:
+            newsfeeds = list(
+                queryset.filter(tweet__user_id=unfollowed_user_id)
+                .order_by('id')[:NEWSFEED_BULK_CREATE_BATCH_SIZE]
+            )
+            if not newsfeeds:
+                break
+            NewsFeed.objects.filter(id__in=[newsfeed.id for newsfeed in newsfeeds]).delete()
+            cls.delete_newsfeeds_from_hbase(newsfeeds)
+            RedisHelper.remove_objects_from_cache(name, queryset, newsfeeds, NEWSFEED_ID_SERIALIZER, sorted_set)
+            removed += len(newsfeeds)
+        if removed:
+            RedisClient.get_connection(RedisRole.TIMELINE, stale_name).delete(stale_name)
+        return removed
+
+    @classmethod
+    def write_newsfeeds_to_hbase(cls, newsfeeds):
+        """
+        Dual write while the newsfeeds move to HBase, MySQL stays the source
+        of truth until the reads are switched over
+        the row key of a newsfeed is fixed by its created_at, writing it
+        again is a no-op, e.g. for a retried fanout batch
+        """
+        if not GateKeeper.is_switch_on('switch_newsfeed_dual_write_hbase'):
+            return
+        HBaseNewsFeed.batch_create(
+            [
+                {
+                    'user_id': newsfeed.user_id,
+                    'created_at': datetime_to_ts(newsfeed.created_at),
+                    'tweet_id': newsfeed.tweet_id,
+                }
+                for newsfeed in newsfeeds
+                if newsfeed.user_id and newsfeed.tweet_id
+            ],
+            batch_size=HBASE_NEWSFEED_BATCH_SIZE,
+        )
+
+    @classmethod
+    def purge_tweet_newsfeeds(cls, tweet_ids):
+        """
+        Remove the newsfeeds of deleted tweets in batches, from the db, HBase
+        and the cached timelines of both backends
+
+        Output:
+        Number of newsfeeds removed
+        """
+        removed = 0
+        while True:
+            newsfeeds = list(
+                NewsFeed.objects.filter(tweet_id__in=tweet_ids)
+                .order_by('id')[:NEWSFEED_BULK_CREATE_BATCH_SIZE]
+            )
+            if not newsfeeds:
+                break
+            NewsFeed.objects.filter(id__in=[newsfeed.id for newsfeed in newsfeeds]).delete()
+            cls.delete_newsfeeds_from_hbase(newsfeeds)
+            for pattern, sorted_set in [
+                (USER_NEWSFEED_PATTERN, False),
+                (USER_NEWSFEED_SORTED_SET_PATTERN, True),
+            ]:
+                RedisHelper.remove_objects_from_timelines(
+                    [(pattern.format(user_id=newsfeed.user_id), newsfeed) for newsfeed in newsfeeds],
+                    NEWSFEED_ID_SERIALIZER,
+                    sorted_set=sorted_set,
+                )
+            removed += len(newsfeeds)
+        return removed
+
+    @classmethod
+    def delete_newsfeeds_from_hbase(cls, newsfeeds):
+        if not GateKeeper.is_switch_on('switch_newsfeed_dual_write_hbase'):
+            return
+        HBaseNewsFeed.batch_delete(
+            [
+                {'user_id': newsfeed.user_id, 'created_at': datetime_to_ts(newsfeed.created_at)}
+                for newsfeed in newsfeeds
+                if newsfeed.user_id
+            ],
+            batch_size=HBASE_NEWSFEED_BATCH_SIZE,
+        )
+
+    @classmethod
+    def load_newsfeeds_through_cache(cls, user_id, limit=None, created_at__lt=None, created_at__gt=None):
         # queryset lazy loading
-        queryset = NewsFeed.objects.filter(user_id=user_id)
-        name = USER_NEWSFEED_PATTERN.format(user_id=user_id)
-        return RedisHelper.load_objects(name, queryset)
+        queryset = cls._get_timeline_queryset(user_id)
+        if GateKeeper.is_switch_on('switch_newsfeed_to_sorted_set'):
+            name = USER_NEWSFEED_SORTED_SET_PATTERN.format(user_id=user_id)
+            newsfeeds = RedisHelper.load_sorted_set_objects(
+                name,
+                queryset,
+                NEWSFEED_ID_SERIALIZER,
+                limit,
+                created_at__lt,
+                created_at__gt,
+            )
+        else:
+            name = USER_NEWSFEED_PATTERN.format(user_id=user_id)
+            newsfeeds = RedisHelper.load_objects(
+                name,
+                queryset,
+                NEWSFEED_ID_SERIALIZER,
+                limit,
+                created_at__lt,
+                created_at__gt,
+            )
+        if GateKeeper.is_switch_on('switch_newsfeed_to_hybrid'):
+            newsfeeds = cls.merge_celebrity_tweets(
+                user_id,
+                newsfeeds,
+                limit,
+                created_at__lt,
+                created_at__gt,
+            )
+        # the window is cut by the cache limit
+        if newsfeeds is None:
+            return None
+        return cls.hydrate_newsfeeds(newsfeeds)
+
+    @classmethod
+    def is_celebrity(cls, user_id):
+        """
+        Authors with CELEBRITY_FOLLOWER_THRESHOLD followers are pulled at read time
+        an author stays a celebrity once marked, the tweets posted since then
+        are in no newsfeed and would vanish if the author was fanned out again,
+        the flag is kept on the profile, Redis only caches the set of them
+        """
+        if UserService.get_profile_through_cache(user_id).is_celebrity:
+            return True
+        if FriendshipService.get_follower_count(user_id) < CELEBRITY_FOLLOWER_THRESHOLD:
+            return False
+        UserProfile.objects.filter(user_id=user_id).update(is_celebrity=True)
+        UserService.invalidate_profile_cache(user_id)
+        RedisHelper.add_set_members(CELEBRITY_SET, user_id)
+        return True
+
+    @classmethod
+    def get_followed_celebrity_ids(cls, user_id):
+        """
+        The followings of user_id checked against the cached celebrity set,
+        the whole set is never read, it is loaded again from the profiles
+        once evicted
+        """
+        celebrity_ids = RedisHelper.find_set_members(
+            CELEBRITY_SET,
+            FriendshipService.get_following_user_id_set(user_id),
+            lambda: UserProfile.objects.filter(is_celebrity=True).values_list('user_id', flat=True),
+        )
+        return sorted(celebrity_ids)
+
+    @classmethod
+    def load_merged_newsfeeds(cls, user_id, limit, before=None, after=None, hbase=False):
+        """
+        Db or HBase fallback of the hybrid timeline, for the pages the cached
+        window can't serve. The pushed newsfeeds and the tweets of the followed
+        celebrities are cut at the same (created_at, tweet_id) cursor bounds
+        and merged like merge_celebrity_tweets does
+
+        Output:
+        List of at most limit hydrated newsfeeds, HBaseNewsFeed rows if hbase,
+        None if the timeline has nothing to pull, the plain fallbacks serve it
+        """
+        if not GateKeeper.is_switch_on('switch_newsfeed_to_hybrid'):
+            return None
+        celebrity_ids = cls.get_followed_celebrity_ids(user_id)
+        if not celebrity_ids:
+            return None
+
+        window = {'limit': limit, 'before': before, 'after': after}
+        if hbase:
+            sources = [cls._load_keyset_window_from_hbase(user_id, **window)]
+        else:
+            sources = [cls._load_keyset_window_from_db(cls._get_timeline_queryset(user_id), 'tweet_id', **window)]
+        for celebrity_id in celebrity_ids:
+            tweets = cls._load_keyset_window_from_db(
+                Tweet.objects.filter(user_id=celebrity_id).order_by('-created_at', '-id'),
+                'id',
+                **window,
+            )
+            # HBase rows keep created_at as a timestamp, the merge compares it
+            if hbase:
+                sources.append([
+                    HBaseNewsFeed(user_id=user_id, created_at=datetime_to_ts(tweet.created_at), tweet_id=tweet.id)
+                    for tweet in tweets
+                ])
+            else:
+                sources.append([
+                    NewsFeed(user_id=user_id, tweet_id=tweet.id, created_at=tweet.created_at)
+                    for tweet in tweets
+                ])
+        return cls.hydrate_newsfeeds(cls._merge_newsfeed_sources(sources, limit))
+
+    @classmethod
+    def _load_keyset_window_from_db(cls, queryset, tie_breaker, limit, before=None, after=None):
+        # newest first on both sides of the cursor, a refresh keeps the newest page
+        if after is not None:
+            queryset = filter_after(queryset, after, tie_breaker)
+        elif before is not None:
+            queryset = filter_before(queryset, before, tie_breaker)
+        return list(queryset[:limit])
+
+    @classmethod
+    def _load_keyset_window_from_hbase(cls, user_id, limit, before=None, after=None):
+        # the row key only holds created_at, the rows created at the cursor
+        # are scanned too and cut by tweet_id, so one more row is read
+        if after is not None:
+            created_at = datetime_to_ts(after.created_at)
+            bound = (created_at, float('inf') if after.id is None else after.id)
+            rows = HBaseNewsFeed.filter(
+                start=(user_id, MAX_TIMESTAMP),
+                stop=(user_id, created_at - 1),
+                limit=limit + 1,
+                reverse=True,
+            )
+            rows = [row for row in rows if (row.created_at, row.tweet_id) > bound]
+        elif before is not None:
+            created_at = datetime_to_ts(before.created_at)
+            bound = (created_at, float('-inf') if before.id is None else before.id)
+            rows = HBaseNewsFeed.filter(
+                start=(user_id, created_at),
+                stop=(user_id, None),
+                limit=limit + 1,
+                reverse=True,
+            )
+            rows = [row for row in rows if (row.created_at, row.tweet_id) < bound]
+        else:
+            rows = HBaseNewsFeed.filter(prefix=(user_id, None), limit=limit, reverse=True)
+        return rows[:limit]
+
+    @classmethod
+    def _load_window_from_db(cls, queryset, limit=None, created_at__lt=None, created_at__gt=None):
+        if created_at__gt is not None:
+            return list(queryset.filter(created_at__gt=created_at__gt))
+        if created_at__lt is not None:
+            queryset = queryset.filter(created_at__lt=created_at__lt)
+        return list(queryset[:limit] if limit else queryset)
+
+    @classmethod
+    def merge_celebrity_tweets(cls, user_id, newsfeeds, limit=None, created_at__lt=None, created_at__gt=None):
+        """
+        Push/pull hybrid, the tweets of the followed celebrities are pulled
+        from their user tweet timelines and k-way merged with the pushed
+        newsfeeds by (created_at, tweet_id). Every source is cut at the same cursor window,
+        a source cut by the cache limit is read from the db, so the merged
+        window is complete and the cursors keep working across the sources.
+
+        Output:
+        List of newsfeeds, the pulled ones are unsaved NewsFeed with the
+        created_at of the tweet and no id, the newsfeed cursors break the
+        created_at ties by tweet_id
+        """
+        celebrity_ids = cls.get_followed_celebrity_ids(user_id)
+        if not celebrity_ids:
+            return newsfeeds
+
+        window = {
+            'limit': limit,
+            'created_at__lt': created_at__lt,
+            'created_at__gt': created_at__gt,
+        }
+        if newsfeeds is None:
+            newsfeeds = cls._load_window_from_db(cls._get_timeline_queryset(user_id), **window)
+        sources = [newsfeeds]
+        for celebrity_id in celebrity_ids:
+            tweets = TweetService.load_tweet_ids_through_cache(celebrity_id, **window)
+            if tweets is None:
+                tweets = cls._load_window_from_db(
+                    Tweet.objects.filter(user_id=celebrity_id).order_by('-created_at', '-id'),
+                    **window,
+                )
+            sources.append([
+                NewsFeed(user_id=user_id, tweet_id=tweet.id, created_at=tweet.created_at)
+                for tweet in tweets
+            ])
+
+        return cls._merge_newsfeed_sources(sources, limit)
+
+    @classmethod
+    def _merge_newsfeed_sources(cls, sources, limit=None):
+        merged_newsfeeds = []
+        # tweets fanned out before the author became a celebrity are in both sources
+        tweet_ids = set()
+        # same (created_at, tweet_id) order as the newsfeed cursors
+        for newsfeed in heapq.merge(
+            *sources,
+            key=lambda newsfeed: (newsfeed.created_at, newsfeed.tweet_id),
+            reverse=True,
+        ):
+            if newsfeed.tweet_id in tweet_ids:
+                continue
+            tweet_ids.add(newsfeed.tweet_id)
+            merged_newsfeeds.append(newsfeed)
+            if limit and len(merged_newsfeeds) == limit:
+                break
+        return merged_newsfeeds
+
+    @classmethod
+    def hydrate_newsfeeds(cls, newsfeeds):
+        # fetch all the tweets in one multi-get instead of one get per newsfeed
+        tweets = MemcachedHelper.get_objects_through_cache(
+            Tweet,
+            [newsfeed.tweet_id for newsfeed in newsfeeds if newsfeed.tweet_id],
+        )
+        tweet_map = {tweet.id: tweet for tweet in tweets}
+        for newsfeed in newsfeeds:
+            if newsfeed.tweet_id in tweet_map:
+                newsfeed.tweet = tweet_map[newsfeed.tweet_id]
+        return newsfeeds
 
     @classmethod
     def push_newsfeed_to_cache(cls, newsfeed):
-        # queryset lazy loading
-        queryset = NewsFeed.objects.filter(user_id=newsfeed.user_id)
-        name = USER_NEWSFEED_PATTERN.format(user_id=newsfeed.user_id)
-        return RedisHelper.push_object_to_cache(name, queryset, newsfeed)
+        return cls.push_newsfeeds_to_cache([newsfeed])
+
+    @classmethod
+    def push_newsfeeds_to_cache(cls, newsfeeds, rebuild=True):
+        """
+        Push newsfeeds of different users to their cached timelines
+        a whole fanout batch goes to Redis in one call per shard
+
+        Output:
+        List of booleans, False for the users without a cached timeline
+        """
+        sorted_set = GateKeeper.is_switch_on('switch_newsfeed_to_sorted_set')
+        items, stale_names = [], []
+        for newsfeed in newsfeeds:
+            # queryset lazy loading
+            queryset = cls._get_timeline_queryset(newsfeed.user_id)
+            list_name = USER_NEWSFEED_PATTERN.format(user_id=newsfeed.user_id)
+            sorted_set_name = USER_NEWSFEED_SORTED_SET_PATTERN.format(user_id=newsfeed.user_id)
+            # drop the timeline of the other backend, it misses the new newsfeed
+            # and would be served stale if the switch is turned back
+            if sorted_set:
+                items.append((sorted_set_name, queryset, newsfeed))
+                stale_names.append(list_name)
+            else:
+                items.append((list_name, queryset, newsfeed))
+                stale_names.append(sorted_set_name)
+        return RedisHelper.push_objects_to_cache(
+            items,
+            NEWSFEED_ID_SERIALIZER,
+            sorted_set=sorted_set,
+            stale_names=stale_names,
+            rebuild=rebuild,
+        )
@@ -1,55 +1,153 @@
-from celery import shared_task
-from newsfeeds.constants import FANOUT_BATCH_SIZE
+from celery import chord, shared_task
+from django.db import OperationalError
+from itertools import islice
+from gatekeeper.models import GateKeeper
+from newsfeeds.constants import FANOUT_BATCH_SIZE, NEWSFEED_BULK_CREATE_BATCH_SIZE
 from newsfeeds.models import NewsFeed
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import TimeoutError as RedisTimeoutError
 from utils.time_constants import ONE_HOUR
 
+# transient failures of the db or Redis, the batch is run again from scratch
+FANOUT_RETRY_ERRORS = (OperationalError, RedisConnectionError, RedisTimeoutError)
 
-@shared_task(routing_key='newsfeeds', time_limit=ONE_HOUR)
+
+@shared_task(
+    routing_key='newsfeeds',
+    time_limit=ONE_HOUR,
+    autoretry_for=FANOUT_RETRY_ERRORS,
+    retry_backoff=True,
+    retry_jitter=True,
+    max_retries=5,
+)
 def fanout_to_followers_batch_task(tweet_id, follower_ids):
     from newsfeeds.services import NewsFeedService
+    from tweets.services import TweetService
 
+    # the tweet was deleted meanwhile, its newsfeeds would only be purged again
+    if TweetService.get_deleted_tweet_ids([tweet_id]):
+        return "tweet {} has been deleted".format(tweet_id)
+    # the batch is idempotent, a retried or duplicated batch creates and
+    # pushes nothing twice
+    follower_ids = list(dict.fromkeys(follower_ids))
+    # inactive followers are skipped, their newsfeeds are rebuilt when they return
+    if GateKeeper.is_switch_on('switch_newsfeed_skip_inactive'):
+        follower_ids = NewsFeedService.get_active_user_ids(follower_ids)
     # create newsfeed for all followers
     newsfeeds = [
         NewsFeed(user_id=follower_id, tweet_id=tweet_id)
         for follower_id in follower_ids
     ]
     # create objects by batch, more efficiency
-    NewsFeed.objects.bulk_create(newsfeeds)
+    # the newsfeeds already created by a previous run hit unique (user, tweet)
+    # and are skipped
+    NewsFeed.objects.bulk_create(
+        newsfeeds,
+        batch_size=NEWSFEED_BULK_CREATE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    # bulk_create() doesn't set the ids in MySQL, the cached lists need them
+    newsfeeds = list(NewsFeed.objects.filter(tweet_id=tweet_id, user_id__in=follower_ids))
+    NewsFeedService.write_newsfeeds_to_hbase(newsfeeds)
 
     # bulk_create() doesn't trigger post_save signal
-    # trigger the post_save manually in iteration
-    for newsfeed in newsfeeds:
-        NewsFeedService.push_newsfeed_to_cache(newsfeed)
+    # push the whole batch to the cached newsfeeds at once, the newsfeeds
+    # already in a cached list are not pushed again
+    # followers without a cached newsfeed list are skipped, their next read
+    # rebuilds it from db, rebuilding here costs one query per follower
+    pushed = NewsFeedService.push_newsfeeds_to_cache(newsfeeds, rebuild=False)
+    NewsFeedService.record_fanout_batch(tweet_id, sum(pushed), len(pushed) - sum(pushed))
+
+    return "{} newsfeeds have been created, " \
+           "{} pushed to cache, " \
+           "{} skipped".format(
+        len(newsfeeds),
+        sum(pushed),
+        len(pushed) - sum(pushed),
+    )
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def fanout_to_followers_done_task(results, tweet_id):
+    from newsfeeds.services import NewsFeedService
 
-    return "{} newsfeeds have been created".format(len(newsfeeds))
+    # chord callback, runs once all the batches of the tweet are done
+    NewsFeedService.finish_fanout_progress(tweet_id)
+    return "{} batches of tweet {} are done".format(len(results), tweet_id)
 
 
 @shared_task(routing_key='default', time_limit=ONE_HOUR)
 def fanout_to_followers_main_task(tweet_id, tweet_user_id):
     from friendships.services import FriendshipService
+    from newsfeeds.services import NewsFeedService
     # create the newsfeed for the poster firstly
     # ensure the poster get response asap
-    NewsFeed.objects.create(user_id=tweet_user_id, tweet_id=tweet_id)
+    # get_or_create() keeps the task safe to run again
+    newsfeed, _ = NewsFeed.objects.get_or_create(user_id=tweet_user_id, tweet_id=tweet_id)
+    NewsFeedService.write_newsfeeds_to_hbase([newsfeed])
+
+    # push/pull hybrid, the followers pull the tweets of a celebrity at read time
+    if GateKeeper.is_switch_on('switch_newsfeed_to_hybrid'):
+        if NewsFeedService.is_celebrity(tweet_user_id):
+            return "celebrity tweet, pulled by the followers at read time"
 
     # fanout to followers in asychronous tasks
-    follower_ids = FriendshipService.get_follower_ids(tweet_user_id)
-    index = 0
     # batchify all asychronous tasks to reduce the size of a single task
     # ensure robust in asychronous tasks and parallelly processing batches
-    while index < len(follower_ids):
-        batch_ids = follower_ids[index : index+FANOUT_BATCH_SIZE]
-        fanout_to_followers_batch_task(tweet_id, batch_ids)
-        index += FANOUT_BATCH_SIZE
-
-    if len(follower_ids) % FANOUT_BATCH_SIZE == 0:
-        num_batches = len(follower_ids) // FANOUT_BATCH_SIZE
+    # the follower ids are streamed from the db, only the ids end up in the
+    # batches, never the rows of all the followers at once
+    batches = []
+    num_followers = 0
+    follower_ids = FriendshipService.iterate_follower_ids(
+        tweet_user_id,
+        batch_size=FANOUT_BATCH_SIZE,
+    )
+    while True:
+        batch_ids = list(islice(follower_ids, FANOUT_BATCH_SIZE))
+        if not batch_ids:
+            break
+        num_followers += len(batch_ids)
+        batches.append(
+            fanout_to_followers_batch_task.s(tweet_id, batch_ids).set(queue='newsfeeds')
+        )
+    num_batches = len(batches)
+    NewsFeedService.start_fanout_progress(tweet_id, num_batches)
+    if batches:
+        # the batches run in parallel on the workers of the newsfeeds queue
+        # the callback records the end of the fanout once all of them are done
+        chord(batches)(fanout_to_followers_done_task.s(tweet_id).set(queue='default'))
     else:
-        num_batches = len(follower_ids) // FANOUT_BATCH_SIZE + 1
+        NewsFeedService.finish_fanout_progress(tweet_id)
 
     return "{} newsfeeds are going to be fanout, " \
            "{} batches created, " \
            "batch size {}".format(
-        len(follower_ids),
+        num_followers,
         num_batches,
         FANOUT_BATCH_SIZE,
     )
+
+
+@shared_task(routing_key='newsfeeds', time_limit=ONE_HOUR)
+def backfill_newsfeeds_on_follow_task(from_user_id, to_user_id):
+    from newsfeeds.services import NewsFeedService
+
+    created = NewsFeedService.backfill_followed_tweets(from_user_id, to_user_id)
+    return "{} newsfeeds of user {} backfilled".format(created, to_user_id)
+
+
+@shared_task(routing_key='newsfeeds', time_limit=ONE_HOUR)
+def remove_newsfeeds_on_unfollow_task(from_user_id, to_user_id):
+    from newsfeeds.services import NewsFeedService
+
+    removed = NewsFeedService.remove_unfollowed_tweets(from_user_id, to_user_id)
+    return "{} newsfeeds of user {} removed".format(removed, to_user_id)
+
+
+@shared_task(routing_key='newsfeeds', time_limit=ONE_HOUR)
+def rebuild_newsfeeds_task(user_id):
+    from newsfeeds.services import NewsFeedService
+
+    # the newsfeeds of a returning user, queued by NewsFeedService.touch_user()
+    NewsFeedService.rebuild_newsfeeds(user_id)
+    return "newsfeeds of user {} rebuilt".format(user_id)
@@ -1,9 +1,25 @@
 from  newsfeeds.services import NewsFeedService
+from accounts.models import UserProfile
+from datetime import timedelta
+from django.core.management import call_command
+from django.test import override_settings
+from io import StringIO
 from friendships.models import Friendship
+from friendships.services import FriendshipService
+from gatekeeper.models import GateKeeper
+from newsfeeds.api.paginations import NewsFeedPagination
+from newsfeeds.constants import CELEBRITY_FOLLOWER_THRESHOLD
+from newsfeeds.hbase_models import HBaseNewsFeed
 from newsfeeds.models import NewsFeed
+from newsfeeds.tasks import fanout_to_followers_batch_task
 from newsfeeds.tasks import fanout_to_followers_main_task
 from testing.testcases import TestCase
+from tweets.models import Tweet
+from tweets.services import TweetService
+from types import SimpleNamespace
 from utils.cache import USER_NEWSFEED_PATTERN
+from utils.cache import USER_NEWSFEED_SORTED_SET_PATTERN
+from utils.cursors import Cursor, encode_cursor
 from utils.redis_client import RedisClient
 
 LIST_NEWSFEED_URL = '/api/newsfeeds/'
@@ -84,6 +100,71 @@ class NewsFeedCacheTest(TestCase):
             [feed2.id, feed1.id]
         )
 
+    def test_newsfeed_tweets_hydrated_in_batch(self):
+        tweets = [self.create_tweet(user=self.user1) for _ in range(3)]
+        for tweet in tweets:
+            self.create_newsfeed(user=self.user2, tweet=tweet)
+        # warm up the tweet object cache
+        NewsFeedService.load_newsfeeds_through_cache(self.user2.id)
+
+        with self.assertNumQueries(0):
+            feeds = NewsFeedService.load_newsfeeds_through_cache(self.user2.id)
+            self.assertEqual(
+                [f.cached_tweet.id for f in feeds],
+                [t.id for t in tweets[::-1]],
+            )
+            self.assertEqual(feeds[0].cached_tweet.content, tweets[-1].content)
+
+    def test_sorted_set_timeline(self):
+        GateKeeper.set_kv('switch_newsfeed_to_sorted_set', 'percent', 100)
+        newsfeeds = []
+        for i in range(45):
+            tweet = self.create_tweet(user=self.user1)
+            newsfeeds.append(self.create_newsfeed(user=self.user2, tweet=tweet))
+        newsfeeds = newsfeeds[::-1]
+
+        conn = RedisClient.get_connection()
+        name = USER_NEWSFEED_SORTED_SET_PATTERN.format(user_id=self.user2.id)
+        self.assertEqual(conn.type(name), b'zset')
+        self.assertFalse(conn.exists(USER_NEWSFEED_PATTERN.format(user_id=self.user2.id)))
+
+        # the cursor windows are read from the sorted set
+        feeds = NewsFeedService.load_newsfeeds_through_cache(
+            self.user2.id,
+            limit=3,
+            created_at__lt=newsfeeds[9].created_at,
+        )
+        self.assertEqual([f.id for f in feeds], [f.id for f in newsfeeds[10:13]])
+        feeds = NewsFeedService.load_newsfeeds_through_cache(
+            self.user2.id,
+            created_at__gt=newsfeeds[3].created_at,
+        )
+        self.assertEqual([f.id for f in feeds], [f.id for f in newsfeeds[:3]])
+
+        # the window beyond the cache limit falls back to the db
+        self.assertIsNone(NewsFeedService.load_newsfeeds_through_cache(
+            self.user2.id,
+            limit=21,
+            created_at__lt=newsfeeds[29].created_at,
+        ))
+        response = self.user2_client.get(LIST_NEWSFEED_URL, {
+            'created_at__lt': newsfeeds[39].created_at,
+        })
+        self.assertEqual(
+            [result['id'] for result in response.data['results']],
+            [f.id for f in newsfeeds[40:]],
+        )
+
+        # cache miss, the window is cut from the rebuilt sorted set
+        conn.delete(name)
+        feeds = NewsFeedService.load_newsfeeds_through_cache(
+            self.user2.id,
+            limit=3,
+            created_at__lt=newsfeeds[0].created_at,
+        )
+        self.assertEqual([f.id for f in feeds], [f.id for f in newsfeeds[1:4]])
+        self.assertEqual(conn.zcard(name), 40)
+
 
 class NewsFeedTaskTests(TestCase):
 
@@ -123,7 +204,8 @@ class NewsFeedTaskTests(TestCase):
             "4 batches created, " \
             "batch size 3"
         )
-        self.assertEqual(2+12, NewsFeed.objects.count())
+        # following user1 pulled tweet1 into the newsfeeds of the 10 users
+        self.assertEqual(2+12+10, NewsFeed.objects.count())
         cached_list = NewsFeedService.load_newsfeeds_through_cache(user_id=self.user2.id)
         self.assertEqual(2, len(cached_list))
 
@@ -142,8 +224,400 @@ class NewsFeedTaskTests(TestCase):
             "4 batches created, " \
             "batch size 3"
         )
-        self.assertEqual(3+24, NewsFeed.objects.count())
+        # and tweet1, tweet2 into the newsfeeds of extrauser
+        self.assertEqual(3+24+10+2, NewsFeed.objects.count())
         cached_list = NewsFeedService.load_newsfeeds_through_cache(user_id=self.user2.id)
         self.assertEqual(3, len(cached_list))
 
+    def test_fanout_batch_task(self):
+        users = [self.create_user(username='follower{}'.format(i)) for i in range(3)]
+        # only user2 and the first follower have a cached newsfeed list
+        for user in [self.user2, users[0]]:
+            self.create_newsfeed(user=user, tweet=self.create_tweet(user=self.user1))
+        tweet = self.create_tweet(user=self.user1)
+        conn = RedisClient.get_connection()
+        # the deleted tweet filter is loaded from the db once
+        TweetService.get_deleted_tweet_ids([tweet.id])
+
+        with self.assertNumQueries(2):
+            msg = fanout_to_followers_batch_task(
+                tweet.id,
+                [self.user2.id] + [user.id for user in users],
+            )
+        self.assertEqual(
+            msg,
+            "4 newsfeeds have been created, " \
+            "2 pushed to cache, " \
+            "2 skipped"
+        )
+        for user in [self.user2, users[0]]:
+            name = USER_NEWSFEED_PATTERN.format(user_id=user.id)
+            self.assertEqual(conn.llen(name), 2)
+        for user in users[1:]:
+            name = USER_NEWSFEED_PATTERN.format(user_id=user.id)
+            self.assertFalse(conn.exists(name))
+            # rebuilt on the next read
+            feeds = NewsFeedService.load_newsfeeds_through_cache(user.id)
+            self.assertEqual([f.tweet_id for f in feeds], [tweet.id])
+
+    def test_fanout_batch_task_replay(self):
+        users = [self.create_user(username='follower{}'.format(i)) for i in range(3)]
+        follower_ids = [user.id for user in users]
+        for sorted_set in [False, True]:
+            GateKeeper.set_kv('switch_newsfeed_to_sorted_set', 'percent', 100 if sorted_set else 0)
+            # every follower has a cached newsfeed list
+            for user in users:
+                self.create_newsfeed(user=user, tweet=self.create_tweet(user=self.user1))
+            tweet = self.create_tweet(user=self.user1)
+
+            # a retried batch, a duplicated batch, a follower twice in a batch
+            for _ in range(3):
+                fanout_to_followers_batch_task(tweet.id, follower_ids)
+            fanout_to_followers_batch_task(tweet.id, follower_ids + follower_ids[:1])
+
+            for user in users:
+                self.assertEqual(NewsFeed.objects.filter(user=user, tweet=tweet).count(), 1)
+                feeds = NewsFeedService.load_newsfeeds_through_cache(user.id)
+                tweet_ids = [feed.tweet_id for feed in feeds]
+                self.assertEqual(tweet_ids.count(tweet.id), 1)
+                self.assertEqual(tweet_ids[0], tweet.id)
+                self.assertEqual(len(tweet_ids), NewsFeed.objects.filter(user=user).count())
+
+    def test_fanout_progress(self):
+        for i in range(4):
+            self.create_friendship(self.create_user(username='follower{}'.format(i)), self.user1)
+        # only user2 has a cached newsfeed list
+        self.create_friendship(self.user2, self.user1)
+        self.create_newsfeed(user=self.user2, tweet=self.create_tweet(user=self.user1))
+        tweet = self.create_tweet(user=self.user1)
+        self.assertIsNone(NewsFeedService.get_fanout_progress(tweet.id))
+
+        fanout_to_followers_main_task(tweet_id=tweet.id, tweet_user_id=self.user1.id)
+        progress = NewsFeedService.get_fanout_progress(tweet.id)
+        self.assertEqual(progress['done'], 2)
+        self.assertEqual(progress['total'], 2)
+        self.assertEqual(progress['pushed'], 1)
+        self.assertEqual(progress['skipped'], 4)
+        self.assertTrue(progress['finished'])
+        self.assertGreaterEqual(progress['elapsed'], 0)
+
+
+class NewsFeedHybridTest(TestCase):
+
+    def setUp(self) -> None:
+        super(NewsFeedHybridTest, self).setUp()
+        GateKeeper.set_kv('switch_newsfeed_to_hybrid', 'percent', 100)
+
+        self.user1, self.user1_client = self.create_user_and_client(username='user1')
+        self.user2, self.user2_client = self.create_user_and_client(username='user2')
+        self.user3 = self.create_user(username='user3')
+        # user1 is a celebrity, user3 is not
+        for i in range(CELEBRITY_FOLLOWER_THRESHOLD - 1):
+            self.create_friendship(self.create_user(username='fan{}'.format(i)), self.user1)
+        self.create_friendship(self.user2, self.user1)
+        self.create_friendship(self.user2, self.user3)
+
+    def test_merge_celebrity_tweets(self):
+        tweets = []
+        for i in range(6):
+            for user in [self.user1, self.user3]:
+                tweet = self.create_tweet(user=user)
+                fanout_to_followers_main_task(tweet_id=tweet.id, tweet_user_id=user.id)
+                tweets.append(tweet)
+        tweets = tweets[::-1]
+        # the celebrity tweets are not fanned out
+        self.assertTrue(NewsFeedService.is_celebrity(self.user1.id))
+        self.assertFalse(NewsFeedService.is_celebrity(self.user3.id))
+        self.assertEqual(NewsFeed.objects.filter(user=self.user2).count(), 6)
+
+        response = self.user2_client.get(LIST_NEWSFEED_URL)
+        self.assertEqual(
+            [result['tweet']['id'] for result in response.data['results']],
+            [tweet.id for tweet in tweets],
+        )
+
+        # the cursors cut every source at the same point
+        feeds = NewsFeedService.load_newsfeeds_through_cache(self.user2.id, limit=12)
+        window = NewsFeedService.load_newsfeeds_through_cache(
+            self.user2.id,
+            limit=4,
+            created_at__lt=feeds[4].created_at,
+        )
+        self.assertEqual([f.tweet_id for f in window], [t.id for t in tweets[5:9]])
+        window = NewsFeedService.load_newsfeeds_through_cache(
+            self.user2.id,
+            created_at__gt=feeds[3].created_at,
+        )
+        self.assertEqual([f.tweet_id for f in window], [t.id for t in tweets[:3]])
+
+    def test_cursor_tie_breaker(self):
+        tweets = []
+        for user in [self.user1, self.user3, self.user1, self.user3]:
+            tweet = self.create_tweet(user=user)
+            fanout_to_followers_main_task(tweet_id=tweet.id, tweet_user_id=user.id)
+            tweets.append(tweet)
+        # a pulled and a pushed newsfeed created at the same time, cut by the pages
+        now = tweets[-1].created_at
+        created_ats = [now - timedelta(seconds=2), now - timedelta(seconds=1), now - timedelta(seconds=1), now]
+        for tweet, created_at in zip(tweets, created_ats):
+            Tweet.objects.filter(id=tweet.id).update(created_at=created_at)
+            NewsFeed.objects.filter(tweet_id=tweet.id).update(created_at=created_at)
+        self.clear_cache()
+        GateKeeper.set_kv('switch_newsfeed_to_hybrid', 'percent', 100)
+
+        # the pulled newsfeeds have no id, the cursors break the ties by tweet_id
+        page_tweet_ids, query_params = [], {}
+        while True:
+            paginator = NewsFeedPagination()
+            paginator.page_size = 2
+            request = SimpleNamespace(query_params=query_params)
+            page = paginator.paginate_cached_list(
+                NewsFeedService.load_newsfeeds_through_cache(
+                    self.user2.id,
+                    **paginator.get_cached_list_window(request),
+                ),
+                request,
+            )
+            page_tweet_ids.append([newsfeed.tweet_id for newsfeed in page])
+            next_cursor = paginator.get_paginated_response([]).data['next_cursor']
+            if next_cursor is None:
+                break
+            query_params = {'before': next_cursor}
+        self.assertEqual(page_tweet_ids, [
+            [tweets[3].id, tweets[2].id],
+            [tweets[1].id, tweets[0].id],
+        ])
+
+        # the db is seeked on the same key
+        paginator = NewsFeedPagination()
+        request = SimpleNamespace(query_params={'before': encode_cursor(Cursor(created_ats[2], tweets[2].id))})
+        page = paginator.paginate_queryset(NewsFeed.objects.filter(user=self.user2), request)
+        self.assertEqual([newsfeed.tweet_id for newsfeed in page], [tweets[1].id])
+
+    def _list_all_pages(self):
+        page_tweet_ids, query_params = [], {}
+        while True:
+            response = self.user2_client.get(LIST_NEWSFEED_URL, query_params)
+            page_tweet_ids.append([result['tweet']['id'] for result in response.data['results']])
+            if response.data['next_cursor'] is None:
+                return page_tweet_ids
+            query_params = {'before': response.data['next_cursor']}
+
+    @override_settings(REDIS_LIST_LENGTH_LIMIT=5)
+    def test_merge_celebrity_tweets_past_cache_limit(self):
+        GateKeeper.set_kv('switch_newsfeed_dual_write_hbase', 'percent', 100)
+        tweets = []
+        for i in range(15):
+            for user in [self.user1, self.user3]:
+                tweet = self.create_tweet(user=user)
+                fanout_to_followers_main_task(tweet_id=tweet.id, tweet_user_id=user.id)
+                tweets.append(tweet)
+        tweets = tweets[::-1]
+        page_size = NewsFeedPagination.page_size
+        expected = [
+            [tweet.id for tweet in tweets[:page_size]],
+            [tweet.id for tweet in tweets[page_size:]],
+        ]
+        # the pages past the cached window are read from the db
+        self.assertEqual(self._list_all_pages(), expected)
+
+        # and from HBase, the pushed rows only hold the non celebrity tweets
+        GateKeeper.set_kv('switch_newsfeed_to_hbase', 'percent', 100)
+        self.assertEqual(len(HBaseNewsFeed.filter(prefix=(self.user2.id, None))), 15)
+        self.assertEqual(self._list_all_pages(), expected)
+
+        # a refresh from a pulled tweet gets the newest ones, from HBase and the db
+        self.assertEqual(tweets[5].user_id, self.user1.id)
+        cursor = encode_cursor(Cursor(tweets[5].created_at, tweets[5].id))
+        response = self.user2_client.get(LIST_NEWSFEED_URL, {'after': cursor})
+        self.assertEqual([result['tweet']['id'] for result in response.data['results']], expected[0][:5])
+        GateKeeper.set_kv('switch_newsfeed_to_hbase', 'percent', 0)
+        response = self.user2_client.get(LIST_NEWSFEED_URL, {'after': cursor})
+        self.assertEqual([result['tweet']['id'] for result in response.data['results']], expected[0][:5])
+
+    def test_celebrity_survives_cache_loss(self):
+        self.assertTrue(NewsFeedService.is_celebrity(self.user1.id))
+        self.assertTrue(UserProfile.objects.get(user=self.user1).is_celebrity)
+        # marked for good, unfollows don't bring the author back to fanout
+        FriendshipService.unfollow(self.user2.id, self.user1.id)
+        self.create_friendship(self.user2, self.user1)
+        self.clear_cache()
+        self.assertTrue(NewsFeedService.is_celebrity(self.user1.id))
+
+        # the cached set is loaded again from the profiles
+        RedisClient.clear()
+        self.assertEqual(NewsFeedService.get_followed_celebrity_ids(self.user2.id), [self.user1.id])
+        self.assertEqual(NewsFeedService.get_followed_celebrity_ids(self.user2.id), [self.user1.id])
+        self.assertEqual(NewsFeedService.get_followed_celebrity_ids(self.user3.id), [])
+
+
+class NewsFeedFollowTest(TestCase):
+
+    def setUp(self) -> None:
+        self.clear_cache()
+
+        self.user1 = self.create_user(username='user1')
+        self.user2, self.user2_client = self.create_user_and_client(username='user2')
+        self.user3 = self.create_user(username='user3')
+        self.create_friendship(self.user2, self.user3)
+
+    def _post_tweets(self):
+        # tweets of user1 and user3 interleaved, user2 only follows user3
+        tweets = []
+        for i in range(3):
+            for user in [self.user1, self.user3]:
+                tweet = self.create_tweet(user=user)
+                fanout_to_followers_main_task(tweet_id=tweet.id, tweet_user_id=user.id)
+                tweets.append(tweet)
+        return tweets[::-1]
+
+    def _get_cached_tweet_ids(self):
+        conn = RedisClient.get_connection()
+        if GateKeeper.is_switch_on('switch_newsfeed_to_sorted_set'):
+            name = USER_NEWSFEED_SORTED_SET_PATTERN.format(user_id=self.user2.id)
+            values = conn.zrevrange(name, 0, -1)
+        else:
+            name = USER_NEWSFEED_PATTERN.format(user_id=self.user2.id)
+            values = conn.lrange(name, 0, -1)
+        return [int(value.split(b':')[2]) for value in values]
+
+    def test_follow_and_unfollow(self):
+        self._test_follow_and_unfollow()
+
+    def test_follow_and_unfollow_sorted_set(self):
+        GateKeeper.set_kv('switch_newsfeed_to_sorted_set', 'percent', 100)
+        self._test_follow_and_unfollow()
+
+    def _test_follow_and_unfollow(self):
+        tweets = self._post_tweets()
+        user3_tweet_ids = [tweet.id for tweet in tweets if tweet.user_id == self.user3.id]
+        NewsFeedService.load_newsfeeds_through_cache(self.user2.id)
+        self.assertEqual(self._get_cached_tweet_ids(), user3_tweet_ids)
+
+        # the tweets of user1 are merged into the cached timeline in order
+        self.create_friendship(self.user2, self.user1)
+        self.assertEqual(self._get_cached_tweet_ids(), [tweet.id for tweet in tweets])
+        newsfeeds = NewsFeed.objects.filter(user=self.user2)
+        self.assertEqual([newsfeed.tweet_id for newsfeed in newsfeeds], [tweet.id for tweet in tweets])
+        newsfeeds = newsfeeds.filter(tweet__user=self.user1)
+        self.assertEqual(
+            [newsfeed.created_at for newsfeed in newsfeeds],
+            [tweet.created_at for tweet in tweets if tweet.user_id == self.user1.id],
+        )
+
+        # and removed on unfollow
+        FriendshipService.unfollow(self.user2.id, self.user1.id)
+        self.assertEqual(self._get_cached_tweet_ids(), user3_tweet_ids)
+        self.assertEqual(
+            [newsfeed.tweet_id for newsfeed in NewsFeed.objects.filter(user=self.user2)],
+            user3_tweet_ids,
+        )
+
+    @override_settings(REDIS_LIST_LENGTH_LIMIT=4)
+    def test_full_timeline(self):
+        tweets = self._post_tweets()
+        user3_tweet_ids = [tweet.id for tweet in tweets if tweet.user_id == self.user3.id]
+        NewsFeedService.load_newsfeeds_through_cache(self.user2.id)
+        self.assertEqual(self._get_cached_tweet_ids(), user3_tweet_ids)
+
+        # the tweets older than the tail of a full timeline are left in the db
+        self.create_friendship(self.user2, self.user1)
+        self.assertEqual(self._get_cached_tweet_ids(), [tweet.id for tweet in tweets[:4]])
+
+        # a full timeline is refilled from the db
+        FriendshipService.unfollow(self.user2.id, self.user1.id)
+        self.assertEqual(self._get_cached_tweet_ids(), user3_tweet_ids)
+
+
+class NewsFeedInactiveTest(TestCase):
+
+    def setUp(self) -> None:
+        self.clear_cache()
+        GateKeeper.set_kv('switch_newsfeed_skip_inactive', 'percent', 100)
+
+        self.user1 = self.create_user(username='user1')
+        self.user2, self.user2_client = self.create_user_and_client(username='user2')
+        self.user3, self.user3_client = self.create_user_and_client(username='user3')
+        self.create_friendship(self.user2, self.user1)
+        self.create_friendship(self.user3, self.user1)
+
+    def test_skip_inactive_followers(self):
+        # user2 has been seen lately, user3 has not
+        self.user2_client.get(LIST_NEWSFEED_URL)
+        self.assertEqual(NewsFeedService.get_active_user_ids([self.user2.id, self.user3.id]), [self.user2.id])
+
+        tweets = []
+        for i in range(3):
+            tweet = self.create_tweet(user=self.user1)
+            fanout_to_followers_main_task(tweet_id=tweet.id, tweet_user_id=self.user1.id)
+            tweets.append(tweet)
+        tweets = tweets[::-1]
+        self.assertEqual(NewsFeed.objects.filter(user=self.user2).count(), 3)
+        self.assertEqual(NewsFeed.objects.filter(user=self.user3).count(), 0)
+
+        # the newsfeeds of user3 are rebuilt in a task queued on return,
+        # ordered by the tweets
+        self.user3_client.get(LIST_NEWSFEED_URL)
+        response = self.user3_client.get(LIST_NEWSFEED_URL)
+        self.assertEqual(
+            [result['tweet']['id'] for result in response.data['results']],
+            [tweet.id for tweet in tweets],
+        )
+        newsfeeds = NewsFeed.objects.filter(user=self.user3)
+        self.assertEqual(
+            [(newsfeed.tweet_id, newsfeed.created_at) for newsfeed in newsfeeds],
+            [(tweet.id, tweet.created_at) for tweet in tweets],
+        )
+
+        # user3 is active again and fanned out to
+        tweet = self.create_tweet(user=self.user1)
+        fanout_to_followers_main_task(tweet_id=tweet.id, tweet_user_id=self.user1.id)
+        response = self.user3_client.get(LIST_NEWSFEED_URL)
+        self.assertEqual(
+            [result['tweet']['id'] for result in response.data['results']],
+            [tweet.id] + [tweet.id for tweet in tweets],
+        )
+
+
+class HBaseNewsFeedTest(TestCase):
+
+    def setUp(self) -> None:
+        super(HBaseNewsFeedTest, self).setUp()
+        GateKeeper.set_kv('switch_newsfeed_dual_write_hbase', 'percent', 100)
+
+        self.user1 = self.create_user(username='user1')
+        self.user2, self.user2_client = self.create_user_and_client(username='user2')
+        self.create_friendship(self.user2, self.user1)
+
+    def test_dual_write_and_read(self):
+        tweets = []
+        for i in range(3):
+            tweet = self.create_tweet(user=self.user1)
+            fanout_to_followers_main_task(tweet_id=tweet.id, tweet_user_id=self.user1.id)
+            tweets.append(tweet)
+        tweets = tweets[::-1]
+        newsfeeds = HBaseNewsFeed.filter(prefix=(self.user2.id, None), reverse=True)
+        self.assertEqual([newsfeed.tweet_id for newsfeed in newsfeeds], [tweet.id for tweet in tweets])
+        self.assertEqual(len(HBaseNewsFeed.filter(prefix=(self.user1.id, None))), 3)
+
+        GateKeeper.set_kv('switch_newsfeed_to_hbase', 'percent', 100)
+        response = self.user2_client.get(LIST_NEWSFEED_URL)
+        self.assertEqual(
+            [result['tweet']['id'] for result in response.data['results']],
+            [tweet.id for tweet in tweets],
+        )
+        self.assertEqual(response.data['has_next_page'], False)
+
+    def test_backfill(self):
+        GateKeeper.set_kv('switch_newsfeed_dual_write_hbase', 'percent', 0)
+        tweets = [self.create_tweet(user=self.user1) for _ in range(5)]
+        for tweet in tweets:
+            self.create_newsfeed(user=self.user2, tweet=tweet)
+        self.assertEqual(HBaseNewsFeed.filter(prefix=(self.user2.id, None)), [])
 
+        call_command('backfill_hbase_newsfeeds', chunk_size=2, workers=1, stdout=StringIO())
+        newsfeeds = HBaseNewsFeed.filter(prefix=(self.user2.id, None))
+        self.assertEqual([newsfeed.tweet_id for newsfeed in newsfeeds], [tweet.id for tweet in tweets])
+        # copying again changes nothing
+        call_command('backfill_hbase_newsfeeds', chunk_size=2, workers=1, stdout=StringIO())
+        self.assertEqual(len(HBaseNewsFeed.filter(prefix=(self.user2.id, None))), 5)
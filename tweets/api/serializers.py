@@ -1,4 +1,5 @@
 from accounts.api.serializers import UserSerializerForTweet
+from django.db.models import Manager
 from comments.api.serializers import CommentSerializerForTweet
 from likes.services import LikeService
 from rest_framework import serializers
@@ -9,6 +10,15 @@ from tweets.services import TweetService
 from utils.redis_helper import RedisHelper
 
 
+class TweetListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        tweets = list(data.all() if isinstance(data, Manager) else data)
+        TweetSerializer.preload_counts(self.context, tweets)
+        TweetSerializer.preload_has_liked(self.context, tweets)
+        return super(TweetListSerializer, self).to_representation(tweets)
+
+
 class TweetSerializer(serializers.ModelSerializer):
     user = UserSerializerForTweet(source='cached_user')
     comment_count = serializers.SerializerMethodField()
@@ -28,16 +38,36 @@ class TweetSerializer(serializers.ModelSerializer):
             'has_liked',
             'photo_urls',
         )
+        list_serializer_class = TweetListSerializer
+
+    @classmethod
+    def preload_counts(cls, context, tweets):
+        # read the counters of the whole page at once instead of one GET per field
+        context['tweet_counts'] = RedisHelper.get_counts(tweets, ('like_count', 'comment_count'))
+
+    @classmethod
+    def preload_has_liked(cls, context, tweets):
+        # one query for the whole page instead of one per tweet
+        context['liked_tweet_ids'] = LikeService.get_liked_object_ids(context['request'].user, tweets)
+
+    def _get_count(self, obj, attr):
+        counts = self.context.get('tweet_counts', {})
+        if (obj.id, attr) in counts:
+            return counts[(obj.id, attr)]
+        return RedisHelper.get_count(obj, attr)
 
     def get_like_count(self, obj):
         # get count from cached and denormalized counter
-        return RedisHelper.get_count(obj, 'like_count')
+        return self._get_count(obj, 'like_count')
 
     def get_comment_count(self, obj):
         # get count from cached and denormalized counter
-        return RedisHelper.get_count(obj, 'comment_count')
+        return self._get_count(obj, 'comment_count')
 
     def get_has_liked(self, obj):
+        liked_tweet_ids = self.context.get('liked_tweet_ids')
+        if liked_tweet_ids is not None:
+            return obj.id in liked_tweet_ids
         user = self.context['request'].user
         return LikeService.get_has_liked(user, obj)
 
@@ -1,11 +1,18 @@
 from comments.models import Comment
 from django.conf import settings
+from django.core import signing
 from django.core.files.uploadedfile import SimpleUploadedFile
+from gatekeeper.models import GateKeeper
+from newsfeeds.models import NewsFeed
+from newsfeeds.services import NewsFeedService
+from newsfeeds.tasks import fanout_to_followers_main_task
 from rest_framework.test import APIClient
 from testing.testcases import TestCase
 from tweets.models import Tweet
 from tweets.models import TweetPhoto
 from tweets.services import TweetService
+from tweets.tasks import compact_deleted_tweets_task
+from utils.cursors import CURSOR_SALT
 from utils.redis_client import RedisClient
 
 LIST_URL = '/api/tweets/'
@@ -15,6 +22,7 @@ TWEET_RETRIEVE_URL = '/api/tweets/{}/'
 TWEET_LIST_URL = '/api/tweets/'
 COMMENT_LIST_URL = '/api/comments/'
 NEWSFEED_LIST_URL = '/api/newsfeeds/'
+LIKE_BASE_URL = '/api/likes/'
 
 
 class TweetTest(TestCase):
@@ -440,3 +448,138 @@ class TweetCacheLimitTest(TestCase):
 
 
 
+
+
+class TweetDeleteTest(TestCase):
+
+    def setUp(self) -> None:
+        self.clear_cache()
+
+        self.user1, self.user1_client = self.create_user_and_client(username='user1')
+        self.user2, self.user2_client = self.create_user_and_client(username='user2')
+        self.create_friendship(from_user=self.user2, to_user=self.user1)
+        self.tweets = []
+        for i in range(3):
+            tweet = self.create_tweet(user=self.user1)
+            fanout_to_followers_main_task(tweet_id=tweet.id, tweet_user_id=self.user1.id)
+            self.tweets.append(tweet)
+        self.tweets = self.tweets[::-1]
+
+    def test_delete(self):
+        tweet = self.tweets[1]
+        url = RETRIEVE_URL.format(tweet.id)
+        # cached timelines of both users
+        self.user2_client.get(NEWSFEED_LIST_URL)
+        self.user2_client.get(TWEET_LIST_URL, {'user_id': self.user1.id})
+
+        response = self.anonymous_client.delete(url)
+        self.assertEqual(response.status_code, 403)
+        response = self.user2_client.delete(url)
+        self.assertEqual(response.status_code, 403)
+        response = self.user1_client.delete(url)
+        self.assertEqual(response.status_code, 204)
+        response = self.user1_client.delete(url)
+        self.assertEqual(response.status_code, 404)
+
+        # tombstoned, filtered at read time
+        expected_ids = [self.tweets[0].id, self.tweets[2].id]
+        response = self.user2_client.get(url)
+        self.assertEqual(response.status_code, 404)
+        response = self.user2_client.get(TWEET_LIST_URL, {'user_id': self.user1.id})
+        self.assertEqual([result['id'] for result in response.data['results']], expected_ids)
+        for client in [self.user1_client, self.user2_client]:
+            response = client.get(NEWSFEED_LIST_URL)
+            self.assertEqual([result['tweet']['id'] for result in response.data['results']], expected_ids)
+        self.assertEqual(NewsFeed.objects.filter(tweet=tweet).count(), 2)
+
+        # the tombstone is kept in the db, losing the cached filter loses no deletion
+        RedisClient.clear()
+        response = self.user2_client.get(url)
+        self.assertEqual(response.status_code, 404)
+        response = self.user2_client.get(TWEET_LIST_URL, {'user_id': self.user1.id})
+        self.assertEqual([result['id'] for result in response.data['results']], expected_ids)
+        # no like or comment on a deleted tweet
+        response = self.user2_client.post(LIKE_BASE_URL, {'content_type': 'tweet', 'object_id': tweet.id})
+        self.assertEqual(response.status_code, 400)
+        response = self.user2_client.post(COMMENT_LIST_URL, {'tweet_id': tweet.id, 'content': 'comment'})
+        self.assertEqual(response.status_code, 400)
+
+        # purged in bulk by the compaction
+        msg = compact_deleted_tweets_task()
+        self.assertEqual(msg, "1 deleted tweets have been compacted, 2 newsfeeds removed")
+        self.assertFalse(Tweet.objects.filter(id=tweet.id).exists())
+        self.assertEqual(NewsFeed.objects.filter(tweet_id=tweet.id).count(), 0)
+        self.assertEqual(TweetService.get_tombstoned_tweet_ids(10), [])
+        for user in [self.user1, self.user2]:
+            newsfeeds = NewsFeedService.load_newsfeeds_through_cache(user.id)
+            self.assertEqual([newsfeed.tweet_id for newsfeed in newsfeeds], expected_ids)
+        tweets = TweetService.load_tweets_through_cache(self.user1.id)
+        self.assertEqual([tweet.id for tweet in tweets], expected_ids)
+        response = self.user2_client.get(NEWSFEED_LIST_URL)
+        self.assertEqual([result['tweet']['id'] for result in response.data['results']], expected_ids)
+        msg = compact_deleted_tweets_task()
+        self.assertEqual(msg, "0 deleted tweets have been compacted")
+
+
+class TweetCursorPaginationTest(TestCase):
+
+    def setUp(self) -> None:
+        self.clear_cache()
+        self.user1, self.user1_client = self.create_user_and_client(username='user1')
+        tweets = [self.create_tweet(user=self.user1) for i in range(45)]
+        # 25 tweets created at the very same time, across the page boundaries
+        Tweet.objects.filter(id__in=[tweet.id for tweet in tweets[10:35]]).update(
+            created_at=tweets[10].created_at,
+        )
+        self.tweet_ids = [
+            tweet.id
+            for tweet in Tweet.objects.filter(user=self.user1).order_by('-created_at', '-id')
+        ]
+
+    def _paginate_tweet_ids(self):
+        response = self.user1_client.get(LIST_URL, {'user_id': self.user1.id})
+        tweet_ids = [tweet['id'] for tweet in response.data['results']]
+        while response.data['has_next_page']:
+            response = self.user1_client.get(LIST_URL, {
+                'user_id': self.user1.id,
+                'before': response.data['next_cursor'],
+            })
+            tweet_ids.extend(tweet['id'] for tweet in response.data['results'])
+        self.assertIsNone(response.data['next_cursor'])
+        return tweet_ids
+
+    def _test_cursor_pagination(self):
+        # cache miss, cached and db pages
+        self.assertEqual(self._paginate_tweet_ids(), self.tweet_ids)
+        self.assertEqual(self._paginate_tweet_ids(), self.tweet_ids)
+        with self.settings(REDIS_LIST_LENGTH_LIMIT=25):
+            self.clear_cache()
+            self.assertEqual(self._paginate_tweet_ids(), self.tweet_ids)
+
+        response = self.user1_client.get(LIST_URL, {'user_id': self.user1.id})
+        refresh_cursor = response.data['refresh_cursor']
+        response = self.user1_client.get(LIST_URL, {'user_id': self.user1.id, 'after': refresh_cursor})
+        self.assertEqual(response.data['results'], [])
+        self.assertIsNone(response.data['refresh_cursor'])
+        new_tweet = self.create_tweet(user=self.user1)
+        response = self.user1_client.get(LIST_URL, {'user_id': self.user1.id, 'after': refresh_cursor})
+        self.assertEqual([tweet['id'] for tweet in response.data['results']], [new_tweet.id])
+        self.assertIsNotNone(response.data['refresh_cursor'])
+
+    def test_list_cursor_pagination(self):
+        self._test_cursor_pagination()
+
+    def test_sorted_set_cursor_pagination(self):
+        GateKeeper.set_kv('switch_tweet_to_sorted_set', 'percent', 100)
+        self._test_cursor_pagination()
+
+    def test_invalid_cursor(self):
+        response = self.user1_client.get(LIST_URL, {'user_id': self.user1.id})
+        cursor = response.data['refresh_cursor']
+        # correctly signed, but out of the range of datetime
+        huge_cursor = signing.Signer(salt=CURSOR_SALT).sign(
+            signing.b64_encode('{}:1'.format(10 ** 20).encode()).decode()
+        )
+        for invalid_cursor in ['', 'abc', cursor[:-1], 'x' + cursor, huge_cursor]:
+            response = self.user1_client.get(LIST_URL, {'user_id': self.user1.id, 'before': invalid_cursor})
+            self.assertEqual(response.status_code, 400)
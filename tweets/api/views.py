@@ -10,9 +10,11 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import AllowAny
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import NotFound
 from newsfeeds.services import NewsFeedService
 from utils.decorators import require_params
 from utils.paginations import EndlessPagination
+from utils.permissions import IsObjectOwner
 from tweets.services import TweetService
 
 
@@ -24,14 +26,24 @@ class TweetViewSet(viewsets.GenericViewSet):
     def get_permissions(self):
         if self.action == 'list':
             return [AllowAny(),]
+        if self.action == 'destroy':
+            return [IsAuthenticated(), IsObjectOwner(),]
         return [IsAuthenticated(),]
 
+    def get_object(self):
+        tweet = super(TweetViewSet, self).get_object()
+        # deleted, waiting to be compacted
+        if TweetService.get_deleted_tweet_ids([tweet.id]):
+            raise NotFound()
+        return tweet
+
     @require_params(require_attrs='query_params', params=['user_id'])
     @method_decorator(ratelimit(key='user', rate='3/s', method='GET', block=True))
     def list(self, request):
         # select out all tweets of a specific user
         cached_tweets = TweetService.load_tweets_through_cache(
-            user_id=request.query_params['user_id']
+            user_id=request.query_params['user_id'],
+            **self.paginator.get_cached_list_window(request),
         )
         page = self.paginator.paginate_cached_list(cached_tweets, request)
         # cache not enough
@@ -40,6 +52,7 @@ class TweetViewSet(viewsets.GenericViewSet):
                 user_id=request.query_params['user_id']
             )
             page = self.paginate_queryset(tweets)
+        page = TweetService.exclude_deleted_tweets(page)
         serializer = TweetSerializer(
             page,
             context={'request': request},
@@ -83,4 +96,12 @@ class TweetViewSet(viewsets.GenericViewSet):
         return Response(
             serializer.data,
             status=status.HTTP_200_OK
-        )
\ No newline at end of file
+        )
+
+    @method_decorator(ratelimit(key='user', rate='5/s', method='DELETE', block=True))
+    def destroy(self, request, *args, **kwargs):
+        tweet = self.get_object()
+        TweetService.delete_tweet(tweet)
+        return Response({
+            'success': True,
+        }, status=status.HTTP_204_NO_CONTENT)
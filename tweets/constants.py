@@ -11,3 +11,9 @@ TWEET_PHOTO_STAUS_CHOICES = (
 )
 
 TWEET_PHOTOS_UPLOAD_LIMIT = 9
+
+# tweets updated by one grouped UPDATE when flushing the counter deltas
+COUNTER_FLUSH_BATCH_SIZE = 500
+
+# deleted tweets purged from the db and the timelines per compaction run
+TOMBSTONE_COMPACTION_BATCH_SIZE = 100
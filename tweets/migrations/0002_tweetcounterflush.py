@@ -0,0 +1,24 @@
+# Generated by Django 3.2.4 on 2026-10-18 20:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TweetCounterFlush',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_name', models.CharField(max_length=255, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'index_together': {('created_at',)},
+            },
+        ),
+    ]
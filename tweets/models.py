@@ -7,6 +7,7 @@ from tweets.constants import TWEET_PHOTO_STAUS_CHOICES, TweetPhotoStatus
 from utils.listeners import invalidate_object_cache
 from utils.time_helper import utc_now
 from utils.memcached_helpers import MemcachedHelper
+from utils.redis_helper import RedisHelper
 from tweets.listeners import push_tweet_to_cache
 
 
@@ -80,7 +81,35 @@ class TweetPhoto(models.Model):
         return f'{self.user_id} {self.tweet_id} : {self.file}'
 
 
+class TweetCounterFlush(models.Model):
+    # ledger of the counter delta batches applied to the tweets
+    # replaying a batch after a crashed flush is a no-op
+    batch_name = models.CharField(max_length=255, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        index_together = (
+            ('created_at',),
+        )
+
+    def __str__(self):
+        return f'{self.created_at} {self.batch_name}'
+
+
+class TweetTombstone(models.Model):
+    # durable record of a deleted tweet until the compaction purges it, the
+    # Redis set of the deleted tweets is only a read-side filter loaded from it
+    # no foreign key, the tweet row is deleted before its tombstone
+    tweet_id = models.IntegerField(unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.created_at} {self.tweet_id}'
+
+
 # clear cache in create()
 post_save.connect(invalidate_object_cache, sender=Tweet)
 # clear redis cache in create()
 post_save.connect(push_tweet_to_cache, sender=Tweet)
+# write-behind counter batches applied to the tweets
+RedisHelper.register_count_delta_ledger(Tweet, TweetCounterFlush)
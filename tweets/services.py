@@ -1,7 +1,24 @@
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from gatekeeper.models import GateKeeper
+from tweets.constants import COUNTER_FLUSH_BATCH_SIZE
+from tweets.models import TweetCounterFlush
 from tweets.models import TweetPhoto
+from tweets.models import TweetTombstone
 from tweets.models import Tweet
+from utils.cache import DELETED_TWEET_SET
 from utils.cache import USER_TWEET_PATTERN
+from utils.cache import USER_TWEET_SORTED_SET_PATTERN
+from utils.memcached_helpers import MemcachedHelper
+from utils.redis_client import RedisClient, RedisRole
 from utils.redis_helper import RedisHelper
+from utils.redis_serializers import DjangoModelIdSerializer
+from utils.time_constants import ONE_DAY
+from utils.time_helper import utc_now
+
+# user tweet lists only save (id, created_at), the tweets are hydrated from memcached
+TWEET_ID_SERIALIZER = DjangoModelIdSerializer(Tweet, fields=('id', 'created_at'))
 
 
 class TweetService:
@@ -19,17 +36,204 @@ class TweetService:
         TweetPhoto.objects.bulk_create(photos)
 
     @classmethod
-    def load_tweets_through_cache(cls, user_id):
+    def load_tweets_through_cache(cls, user_id, limit=None, created_at__lt=None, created_at__gt=None):
+        tweets = cls.load_tweet_ids_through_cache(user_id, limit, created_at__lt, created_at__gt)
+        # the window is cut by the cache limit
+        if tweets is None:
+            return None
+        return cls.hydrate_tweets(tweets)
+
+    @classmethod
+    def load_tweet_ids_through_cache(cls, user_id, limit=None, created_at__lt=None, created_at__gt=None):
+        """
+        Tweets of a user with only (id, created_at) loaded, see hydrate_tweets
+        None if the window is cut by the cache limit
+        """
         # Django query is lazy loading
         # it is triggered by iterations inside the load_object()
-        queryset = Tweet.objects.filter(user_id=user_id).order_by('-created_at')
+        queryset = Tweet.objects.filter(user_id=user_id).order_by('-created_at', '-id')
+        if GateKeeper.is_switch_on('switch_tweet_to_sorted_set'):
+            name = USER_TWEET_SORTED_SET_PATTERN.format(user_id=user_id)
+            return RedisHelper.load_sorted_set_objects(
+                name,
+                queryset,
+                TWEET_ID_SERIALIZER,
+                limit,
+                created_at__lt,
+                created_at__gt,
+            )
         name = USER_TWEET_PATTERN.format(user_id=user_id)
-        return RedisHelper.load_objects(name, queryset)
+        return RedisHelper.load_objects(
+            name,
+            queryset,
+            TWEET_ID_SERIALIZER,
+            limit,
+            created_at__lt,
+            created_at__gt,
+        )
+
+    @classmethod
+    def hydrate_tweets(cls, tweets):
+        # tweets loaded from db are complete already
+        if not any(tweet.get_deferred_fields() for tweet in tweets):
+            return tweets
+        return MemcachedHelper.get_objects_through_cache(
+            Tweet,
+            [tweet.id for tweet in tweets],
+        )
+
+    @classmethod
+    def delete_tweet(cls, tweet):
+        """
+        Tombstone the tweet instead of deleting a newsfeed per follower, the
+        readers filter it out and compact_deleted_tweets_task purges the
+        newsfeeds, the cached entries and the tweet later in bulk
+        the tombstone row is the record of the deletion, the Redis set only
+        filters the reads and is loaded again from the tombstones if lost
+        """
+        TweetTombstone.objects.get_or_create(tweet_id=tweet.id)
+        RedisHelper.add_set_members(DELETED_TWEET_SET, tweet.id)
+
+    @classmethod
+    def is_tweet_deleted(cls, tweet_id):
+        # the writes on a tweet, e.g. likes and comments, check the tombstones in db
+        return TweetTombstone.objects.filter(tweet_id=tweet_id).exists()
+
+    @classmethod
+    def get_deleted_tweet_ids(cls, tweet_ids):
+        return RedisHelper.find_set_members(
+            DELETED_TWEET_SET,
+            tweet_ids,
+            lambda: TweetTombstone.objects.values_list('tweet_id', flat=True),
+        )
+
+    @classmethod
+    def exclude_deleted_tweets(cls, objects, attr='id'):
+        """
+        Filter the tombstoned tweets out of a page at read time
+
+        Input:
+        @attr(str): the attribute of the objects holding the tweet id, e.g.
+            tweet_id for newsfeeds
+        """
+        objects = list(objects)
+        deleted_ids = cls.get_deleted_tweet_ids(
+            getattr(object, attr) for object in objects
+        )
+        if not deleted_ids:
+            return objects
+        return [object for object in objects if getattr(object, attr) not in deleted_ids]
+
+    @classmethod
+    def get_tombstoned_tweet_ids(cls, count):
+        return list(
+            TweetTombstone.objects.order_by('id').values_list('tweet_id', flat=True)[:count]
+        )
+
+    @classmethod
+    def purge_tweets(cls, tweet_ids):
+        """
+        Delete tombstoned tweets once their newsfeeds are purged, the rows go
+        first so a timeline rebuilt meanwhile doesn't bring them back
+        """
+        tweets = list(Tweet.objects.filter(id__in=tweet_ids).only('id', 'user_id', 'created_at'))
+        Tweet.objects.filter(id__in=tweet_ids).delete()
+        for pattern, sorted_set in [
+            (USER_TWEET_PATTERN, False),
+            (USER_TWEET_SORTED_SET_PATTERN, True),
+        ]:
+            RedisHelper.remove_objects_from_timelines(
+                [(pattern.format(user_id=tweet.user_id), tweet) for tweet in tweets],
+                TWEET_ID_SERIALIZER,
+                sorted_set=sorted_set,
+            )
+        for tweet_id in tweet_ids:
+            MemcachedHelper.invalidate_object_cache(Tweet, tweet_id)
+        TweetTombstone.objects.filter(tweet_id__in=tweet_ids).delete()
+        conn = RedisClient.get_connection(RedisRole.TIMELINE, DELETED_TWEET_SET)
+        conn.srem(DELETED_TWEET_SET, *tweet_ids)
 
     @classmethod
     def push_tweet_to_cache(cls, tweet):
         queryset = Tweet.objects.filter(
             user_id=tweet.user_id
-        ).order_by('-created_at')
-        name = USER_TWEET_PATTERN.format(user_id=tweet.user_id)
-        return RedisHelper.push_object_to_cache(name, queryset, tweet)
+        ).order_by('-created_at', '-id')
+        list_name = USER_TWEET_PATTERN.format(user_id=tweet.user_id)
+        sorted_set_name = USER_TWEET_SORTED_SET_PATTERN.format(user_id=tweet.user_id)
+        # drop the timeline of the other backend, it misses the new tweet
+        # and would be served stale if the switch is turned back
+        if GateKeeper.is_switch_on('switch_tweet_to_sorted_set'):
+            return RedisHelper.push_object_to_sorted_set(
+                sorted_set_name,
+                queryset,
+                tweet,
+                TWEET_ID_SERIALIZER,
+                stale_names=[list_name],
+            )
+        return RedisHelper.push_object_to_cache(
+            list_name,
+            queryset,
+            tweet,
+            TWEET_ID_SERIALIZER,
+            stale_names=[sorted_set_name],
+        )
+
+    @classmethod
+    def incr_count(cls, tweet, attr, delta):
+        """
+        Update a like_count / comment_count by delta
+        in write-behind mode only Redis is updated and the db catches up
+        when flush_count_deltas runs, the hot tweet row is not locked per like
+        """
+        if GateKeeper.is_switch_on('switch_counter_to_write_behind'):
+            return RedisHelper.log_count_delta(tweet, attr, delta)
+        # atomic operations for concurrency safe
+        # django F translated SQL ensures concurrency safe in db level
+        Tweet.objects.filter(id=tweet.id).update(**{attr: F(attr) + delta})
+        # extra counter in cache
+        # the cached popular object should not be invalid frequently
+        if delta > 0:
+            return RedisHelper.incr_count(tweet, attr)
+        return RedisHelper.decr_count(tweet, attr)
+
+    @classmethod
+    def flush_count_deltas(cls):
+        """
+        Apply the counter deltas logged in Redis to the db
+        the batches left over by a crashed flush are replayed first
+
+        Output:
+        Number of tweets updated
+        """
+        RedisHelper.take_count_deltas(Tweet)
+        num_updated = 0
+        for batch_name, deltas in RedisHelper.load_count_delta_batches(Tweet):
+            with transaction.atomic():
+                # the ledger row commits together with the counters
+                _, created = TweetCounterFlush.objects.get_or_create(batch_name=batch_name)
+                if created:
+                    num_updated += cls._apply_count_deltas(deltas)
+            RedisHelper.remove_count_delta_batch(Tweet, batch_name)
+        # a replay only follows a crash shortly before
+        TweetCounterFlush.objects.filter(created_at__lt=utc_now() - timedelta(seconds=ONE_DAY)).delete()
+        return num_updated
+
+    @classmethod
+    def _apply_count_deltas(cls, deltas):
+        tweet_ids = sorted({tweet_id for tweet_id, _ in deltas})
+        num_updated = 0
+        for index in range(0, len(tweet_ids), COUNTER_FLUSH_BATCH_SIZE):
+            batch_ids = tweet_ids[index:index + COUNTER_FLUSH_BATCH_SIZE]
+            whens = {}
+            for tweet_id in batch_ids:
+                for attr in ('like_count', 'comment_count'):
+                    if (tweet_id, attr) in deltas:
+                        whens.setdefault(attr, []).append(
+                            When(id=tweet_id, then=Value(deltas[(tweet_id, attr)]))
+                        )
+            # one UPDATE ... SET x = x + CASE id WHEN ... END for the whole batch
+            num_updated += Tweet.objects.filter(id__in=batch_ids).update(**{
+                attr: F(attr) + Case(*attr_whens, default=Value(0), output_field=IntegerField())
+                for attr, attr_whens in whens.items()
+            })
+        return num_updated
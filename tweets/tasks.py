@@ -0,0 +1,27 @@
+from celery import shared_task
+from tweets.constants import TOMBSTONE_COMPACTION_BATCH_SIZE
+from utils.time_constants import ONE_HOUR
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def flush_count_deltas_task():
+    from tweets.services import TweetService
+
+    # write-behind like_count / comment_count, apply the deltas logged in Redis
+    num_updated = TweetService.flush_count_deltas()
+    return "{} tweets have been updated".format(num_updated)
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def compact_deleted_tweets_task():
+    from newsfeeds.services import NewsFeedService
+    from tweets.services import TweetService
+
+    # purge the tombstoned tweets with their newsfeeds and cached entries
+    tweet_ids = TweetService.get_tombstoned_tweet_ids(TOMBSTONE_COMPACTION_BATCH_SIZE)
+    if not tweet_ids:
+        return "0 deleted tweets have been compacted"
+    num_newsfeeds = NewsFeedService.purge_tweet_newsfeeds(tweet_ids)
+    TweetService.purge_tweets(tweet_ids)
+    return "{} deleted tweets have been compacted, " \
+           "{} newsfeeds removed".format(len(tweet_ids), num_newsfeeds)
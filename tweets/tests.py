@@ -1,13 +1,16 @@
 from datetime import timedelta
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
+from gatekeeper.models import GateKeeper
 from testing.testcases import TestCase
 from tweets.constants import TweetPhotoStatus
 from tweets.models import Tweet
+from tweets.models import TweetCounterFlush
 from tweets.models import TweetPhoto
 from tweets.services import TweetService
 from utils.cache import USER_TWEET_PATTERN
-from utils.redis_client import RedisClient
+from utils.redis_client import RedisClient, RedisRole
+from utils.redis_helper import RedisHelper
 from utils.time_helper import utc_now
 
 LIST_TWEET_URL = '/api/tweets/'
@@ -142,3 +145,108 @@ class TweetCacheTest(TestCase):
             [t.id for t in tweets],
             [tweet2.id, tweet1.id]
         )
+
+    def test_cached_list_saves_ids_only(self):
+        tweet = self.create_tweet(user=self.user1, content='content not in the list')
+        conn = RedisClient.get_connection()
+        name = USER_TWEET_PATTERN.format(user_id=self.user1.id)
+        serialized_tweets = conn.lrange(name, 0, -1)
+        self.assertEqual(len(serialized_tweets), 1)
+        self.assertNotIn(b'content not in the list', serialized_tweets[0])
+
+        # tweets hydrated from the object cache
+        tweets = TweetService.load_tweets_through_cache(user_id=self.user1.id)
+        self.assertEqual(tweets[0].id, tweet.id)
+        self.assertEqual(tweets[0].content, 'content not in the list')
+        self.assertEqual(tweets[0].created_at, tweet.created_at)
+        with self.assertNumQueries(0):
+            tweets = TweetService.load_tweets_through_cache(user_id=self.user1.id)
+            self.assertEqual(tweets[0].content, 'content not in the list')
+
+
+    def test_load_first_tweets_only(self):
+        tweet_ids = [self.create_tweet(user=self.user1).id for _ in range(5)][::-1]
+        # cache hit
+        tweets = TweetService.load_tweets_through_cache(user_id=self.user1.id, limit=3)
+        self.assertEqual([t.id for t in tweets], tweet_ids[:3])
+        # cache miss
+        RedisClient.clear()
+        tweets = TweetService.load_tweets_through_cache(user_id=self.user1.id, limit=3)
+        self.assertEqual([t.id for t in tweets], tweet_ids[:3])
+        tweets = TweetService.load_tweets_through_cache(user_id=self.user1.id)
+        self.assertEqual([t.id for t in tweets], tweet_ids)
+
+
+class TweetCounterTest(TestCase):
+
+    def setUp(self) -> None:
+        self.clear_cache()
+        self.user1 = self.create_user(username='user1')
+        self.tweet = self.create_tweet(user=self.user1)
+        GateKeeper.set_kv('switch_counter_to_write_behind', 'percent', 100)
+
+    def test_write_behind_counters(self):
+        users = [self.create_user(username='liker{}'.format(i)) for i in range(3)]
+        for user in users:
+            self.create_like(user, self.tweet)
+        self.create_comment(self.user1, self.tweet)
+        self.create_like(users[0], self.tweet).delete()
+
+        # the db is not touched until the deltas are flushed
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 0)
+        self.assertEqual(RedisHelper.get_count(self.tweet, 'like_count'), 2)
+        # cache miss, the pending deltas are added to the db count
+        conn = RedisClient.get_connection(RedisRole.COUNTER)
+        conn.delete(RedisHelper.get_count_name(self.tweet, 'comment_count'))
+        self.assertEqual(RedisHelper.get_count(self.tweet, 'comment_count'), 1)
+
+        self.assertEqual(TweetService.flush_count_deltas(), 1)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 2)
+        self.assertEqual(self.tweet.comment_count, 1)
+        self.assertEqual(TweetService.flush_count_deltas(), 0)
+
+    def test_replay_count_deltas(self):
+        self.create_like(self.create_user(username='liker'), self.tweet)
+        RedisHelper.take_count_deltas(Tweet)
+        # crashed after the batch was applied, before it was removed
+        batch_name, deltas = RedisHelper.load_count_delta_batches(Tweet)[0]
+        TweetCounterFlush.objects.create(batch_name=batch_name)
+        TweetService._apply_count_deltas(deltas)
+        # crashed before the next batch was applied
+        self.create_comment(self.user1, self.tweet)
+        RedisHelper.take_count_deltas(Tweet)
+
+        self.assertEqual(TweetService.flush_count_deltas(), 1)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 1)
+        self.assertEqual(self.tweet.comment_count, 1)
+        self.assertEqual(RedisHelper.load_count_delta_batches(Tweet), [])
+
+    def test_seed_count_during_flush(self):
+        self.create_like(self.create_user(username='liker1'), self.tweet)
+        RedisHelper.take_count_deltas(Tweet)
+        self.create_like(self.create_user(username='liker2'), self.tweet)
+        # a flush applied the batch but didn't remove it yet
+        batch_name, deltas = RedisHelper.load_count_delta_batches(Tweet)[0]
+        TweetCounterFlush.objects.create(batch_name=batch_name)
+        TweetService._apply_count_deltas(deltas)
+
+        conn = RedisClient.get_connection(RedisRole.COUNTER)
+        conn.delete(RedisHelper.get_count_name(self.tweet, 'like_count'))
+        self.assertEqual(RedisHelper.get_count(self.tweet, 'like_count'), 2)
+        conn.delete(RedisHelper.get_count_name(self.tweet, 'like_count'))
+        counts = RedisHelper.get_counts([self.tweet], ('like_count',))
+        self.assertEqual(counts[(self.tweet.id, 'like_count')], 2)
+
+    def test_log_delta_to_expired_counter(self):
+        self.create_like(self.create_user(username='liker1'), self.tweet)
+        # the counter expired, the delta alone is not cached as the count
+        conn = RedisClient.get_connection(RedisRole.COUNTER)
+        name = RedisHelper.get_count_name(self.tweet, 'like_count')
+        conn.delete(name)
+        self.assertIsNone(RedisHelper._incr_cached_count(self.tweet, 'like_count', 1))
+        self.assertFalse(conn.exists(name))
+        self.assertEqual(RedisHelper.log_count_delta(self.tweet, 'like_count', 1), 2)
+        self.assertEqual(RedisHelper.log_count_delta(self.tweet, 'like_count', 1), 3)
@@ -59,6 +59,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'newsfeeds.middlewares.UserActivityMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -193,8 +194,32 @@ REDIS_HOST = '127.0.0.1'
 # seperate toolkits on different ports to avoid chain effect if port fails
 REDIS_PORT = 6379 # default port
 REDIS_DB = 0 if TESTING else 1
+# connection pool per role, a role may override host, port and db
+# to move to its own redis-server, or list 'shards' to spread its keys
+# over several redis-servers by consistent hashing, e.g.
+#   'timeline': {'max_connections': 50, 'shards': [{'port': 6379}, {'port': 6380}]},
+# 'retry_on_timeout' overrides REDIS_RETRY_ON_TIMEOUT for a role, counter commands
+# (INCR, HINCRBY, the delta log scripts) are not idempotent, a retry after a
+# timeout the server already applied would count twice
+REDIS_POOLS = {
+    'timeline': {'max_connections': 50},
+    'counter': {'max_connections': 50, 'retry_on_timeout': False},
+    'gatekeeper': {'max_connections': 10},
+}
+# seconds to wait for a free connection when the pool of a role is exhausted
+REDIS_POOL_TIMEOUT = 1
+REDIS_SOCKET_TIMEOUT = 1
+REDIS_SOCKET_CONNECT_TIMEOUT = 1
+# retry a command once after a socket timeout, only safe for idempotent commands
+REDIS_RETRY_ON_TIMEOUT = True
+# ping an idle connection before reusing it after this many seconds
+REDIS_HEALTH_CHECK_INTERVAL = 30
 REDIS_KEY_EXPIRE_TIME = 7 * 86400
 REDIS_LIST_LENGTH_LIMIT = 200 if not TESTING else 40
+# single-flight rebuild of expired cached lists, only the lock owner reads the db
+# and fills the list, the others wait for it and then read the db without writing
+REDIS_REBUILD_LOCK_EXPIRE_TIME = 10
+REDIS_REBUILD_WAIT_TIME = 0.2 if not TESTING else 0.05
 
 
 # Celery configuration for asynchronous tasks
@@ -203,12 +228,29 @@ REDIS_LIST_LENGTH_LIMIT = 200 if not TESTING else 40
 # the threads of asynchronous tasks can be run on different machines individually
 #   $ celery -A twitter worker -l INFO
 CELERY_BROKER_URL = 'redis://127.0.0.1:6379/2' if not TESTING else 'redis://127.0.0.1:6379/0'
+# chords need a result backend to know when all the tasks of the header are done
+CELERY_RESULT_BACKEND = CELERY_BROKER_URL
+CELERY_RESULT_EXPIRES = 86400
 CELERY_TIMEZONE = "UTC"
 CELERY_TASK_ALWAYS_EAGER = TESTING
 CELERY_QUEUES = (
     Queue('default', routing_key='default'),
     Queue('newsfeeds', routing_key='newsfeeds'),
 )
+# periodic tasks, run the scheduler with
+#   $ celery -A twitter beat -l INFO
+CELERY_BEAT_SCHEDULE = {
+    # flush the write-behind like_count / comment_count deltas to the db
+    'flush-count-deltas': {
+        'task': 'tweets.tasks.flush_count_deltas_task',
+        'schedule': 10.0,
+    },
+    # purge the newsfeeds and cached entries of the deleted tweets
+    'compact-deleted-tweets': {
+        'task': 'tweets.tasks.compact_deleted_tweets_task',
+        'schedule': 60.0,
+    },
+}
 
 
 # django ratelimiter configuration
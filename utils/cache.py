@@ -3,3 +3,9 @@ USER_PATTERN = 'user:{user_id}'
 USER_PROFILE_PATTERN = 'userprofile:{user_id}'
 USER_TWEET_PATTERN = 'usertweet:{user_id}'
 USER_NEWSFEED_PATTERN = 'usernewsfeed:{user_id}'
+USER_TWEET_SORTED_SET_PATTERN = 'usertweetzset:{user_id}'
+USER_NEWSFEED_SORTED_SET_PATTERN = 'usernewsfeedzset:{user_id}'
+CELEBRITY_SET = 'celebrities'
+FANOUT_PROGRESS_PATTERN = 'fanoutprogress:{tweet_id}'
+USER_LAST_SEEN_PATTERN = 'userlastseen:{user_id}'
+DELETED_TWEET_SET = 'deletedtweets'
@@ -0,0 +1,108 @@
+from collections import namedtuple
+from datetime import timedelta
+from django.core import signing
+from django.db.models import BooleanField, DateTimeField, Expression, F, IntegerField, Value
+from rest_framework.exceptions import ValidationError
+from utils.time_helper import datetime_to_ts, ts_to_datetime
+
+CURSOR_SALT = 'utils.cursors'
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+# position of an object in a timeline sorted by (created_at, id) descending
+# id is the tie breaker of the timeline, the primary key unless the paginator
+# says otherwise, e.g. the tweet_id of the newsfeeds. It is None for the objects
+# without one, e.g. HBase rows, and for the legacy created_at__lt /
+# created_at__gt cursors, the created_at alone is the bound then
+Cursor = namedtuple('Cursor', ['created_at', 'id'])
+
+
+def encode_cursor(cursor):
+    """
+    Opaque signed token of the cursor, clients can only send back what they got
+    """
+    value = '{}:{}'.format(
+        datetime_to_ts(cursor.created_at),
+        '' if cursor.id is None else cursor.id,
+    )
+    return signing.Signer(salt=CURSOR_SALT).sign(signing.b64_encode(value.encode()).decode())
+
+
+def decode_cursor(token):
+    try:
+        value = signing.b64_decode(signing.Signer(salt=CURSOR_SALT).unsign(token).encode()).decode()
+        ts, id = value.split(':')
+        return Cursor(ts_to_datetime(int(ts)), int(id) if id else None)
+    # a huge timestamp overflows the datetime
+    except (signing.BadSignature, ValueError, OverflowError, OSError):
+        raise ValidationError({'cursor': 'Invalid cursor.'})
+
+
+def get_object_cursor(obj, tie_breaker='id'):
+    created_at = obj.created_at
+    # HBase rows keep created_at as the timestamp of the row key
+    if isinstance(created_at, int):
+        created_at = ts_to_datetime(created_at)
+    return Cursor(created_at, getattr(obj, tie_breaker, None))
+
+
+def widen_created_at__lt(cursor):
+    """
+    created_at__lt bound of a window containing every object before the cursor
+    the objects created at the same time as the cursor are kept for the id to cut
+    """
+    if cursor.id is None:
+        return cursor.created_at
+    return cursor.created_at + ONE_MICROSECOND
+
+
+def widen_created_at__gt(cursor):
+    if cursor.id is None:
+        return cursor.created_at
+    return cursor.created_at - ONE_MICROSECOND
+
+
+class KeysetCompare(Expression):
+    """
+    (created_at, id) < (%s, %s) row comparison, filter with queryset.filter(KeysetCompare(...))
+    id is the tie breaker field of the timeline
+    """
+    output_field = BooleanField()
+
+    def __init__(self, operator, cursor, tie_breaker='id'):
+        super(KeysetCompare, self).__init__()
+        self.operator = operator
+        self.expressions = [
+            F('created_at'),
+            F(tie_breaker),
+            Value(cursor.created_at, output_field=DateTimeField()),
+            Value(cursor.id, output_field=IntegerField()),
+        ]
+
+    def get_source_expressions(self):
+        return self.expressions
+
+    def set_source_expressions(self, expressions):
+        self.expressions = expressions
+
+    def as_sql(self, compiler, connection):
+        sqls, params = [], []
+        for expression in self.expressions:
+            sql, expression_params = compiler.compile(expression)
+            sqls.append(sql)
+            params.extend(expression_params)
+        return '({}, {}) {} ({}, {})'.format(sqls[0], sqls[1], self.operator, sqls[2], sqls[3]), params
+
+
+def filter_before(queryset, cursor, tie_breaker='id'):
+    if cursor.id is None:
+        return queryset.filter(created_at__lt=cursor.created_at)
+    # the plain created_at bound keeps a range scan on the (user, created_at)
+    # indexes for optimizers not using row comparisons, innodb secondary
+    # indexes end with the primary key so the id order comes for free
+    return queryset.filter(created_at__lte=cursor.created_at).filter(KeysetCompare('<', cursor, tie_breaker))
+
+
+def filter_after(queryset, cursor, tie_breaker='id'):
+    if cursor.id is None:
+        return queryset.filter(created_at__gt=cursor.created_at)
+    return queryset.filter(created_at__gte=cursor.created_at).filter(KeysetCompare('>', cursor, tie_breaker))
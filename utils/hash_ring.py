@@ -0,0 +1,38 @@
+import bisect
+import hashlib
+
+
+class HashRing:
+    """
+    Consistent hashing over a set of nodes
+    every node is placed on the ring as many virtual nodes to even out the
+    load, adding or removing one of N nodes only remaps about 1/N of the keys
+    """
+
+    def __init__(self, nodes=(), replicas=160):
+        self.replicas = replicas
+        self.hashes = []
+        self.ring = {}
+        for node in nodes:
+            self.add_node(node)
+
+    @classmethod
+    def _hash(cls, key):
+        return int(hashlib.md5(key.encode()).hexdigest()[:16], 16)
+
+    def add_node(self, node):
+        for replica in range(self.replicas):
+            node_hash = self._hash('{}#{}'.format(node, replica))
+            self.ring[node_hash] = node
+            bisect.insort(self.hashes, node_hash)
+
+    def remove_node(self, node):
+        for replica in range(self.replicas):
+            node_hash = self._hash('{}#{}'.format(node, replica))
+            del self.ring[node_hash]
+            self.hashes.remove(node_hash)
+
+    def get_node(self, key):
+        # the first virtual node clockwise from the key
+        index = bisect.bisect(self.hashes, self._hash(key)) % len(self.hashes)
+        return self.ring[self.hashes[index]]
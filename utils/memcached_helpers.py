@@ -20,6 +20,37 @@ class MemcachedHelper:
         cache.set(key, object)
         return object
 
+    @classmethod
+    def get_objects_through_cache(cls, model_class, object_ids):
+        """
+        Multi-get version of get_object_throught_cache
+        one memcached get_many, one batched db query for the misses
+
+        Output:
+        List of objects in the order of object_ids, objects not in db are skipped
+        """
+        keys = [cls._get_key(model_class, object_id) for object_id in object_ids]
+        cached_objects = cache.get_many(keys)
+        missed_ids = [
+            object_id
+            for object_id, key in zip(object_ids, keys)
+            if key not in cached_objects
+        ]
+        if missed_ids:
+            # cache miss read from db
+            db_objects = model_class.objects.in_bulk(missed_ids)
+            missed_objects = {
+                cls._get_key(model_class, object_id): object
+                for object_id, object in db_objects.items()
+            }
+            cache.set_many(missed_objects)
+            cached_objects.update(missed_objects)
+        return [
+            cached_objects[key]
+            for key in keys
+            if key in cached_objects
+        ]
+
     @classmethod
     def invalidate_object_cache(cls, model_class, object_id):
         key = cls._get_key(model_class, object_id)
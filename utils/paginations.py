@@ -1,96 +1,225 @@
 from rest_framework import pagination
 from rest_framework import status
 from rest_framework.response import Response
-from dateutil import parser
 from django.conf import settings
+from utils.cursors import (
+    Cursor,
+    decode_cursor,
+    encode_cursor,
+    filter_after,
+    filter_before,
+    get_object_cursor,
+    widen_created_at__gt,
+    widen_created_at__lt,
+)
 from utils.time_constants import MAX_TIMESTAMP
+from utils.time_helper import (
+    count_newer,
+    datetime_to_ts,
+    index_older,
+    parse_iso_datetime,
+    ts_to_datetime,
+)
 
 
 class EndlessPagination(pagination.BasePagination):
+    """
+    Keyset pagination of timelines sorted by (created_at, id) descending
+
+    Scroll down with ?before=<next_cursor> and refresh with ?after=<refresh_cursor>,
+    the opaque cursors come with every page. The legacy created_at__lt /
+    created_at__gt timestamps are still accepted.
+    A refresh of a HBase timeline returns the newest page only, has_gap tells
+    that older new objects are left between the page and the cursor.
+    id stands for tie_breaker, the field breaking the created_at ties in the
+    cursors, the cached timelines and the db alike.
+    """
     page_size = 20
+    tie_breaker = 'id'
 
     def __init__(self):
         super(EndlessPagination, self).__init__()
         self.has_next_page = False
+        # more new objects than a page on refresh
+        self.has_gap = False
+        self._cursors = None
+        self.page_cursors = (None, None)
+
+    def get_cursors(self, request):
+        """
+        {'before': Cursor, 'after': Cursor} of the request, parsed once per request
+        """
+        if self._cursors is None or self._cursors[0] is not request:
+            cursors = {}
+            for key, legacy_key in [('after', 'created_at__gt'), ('before', 'created_at__lt')]:
+                if key in request.query_params:
+                    cursors[key] = decode_cursor(request.query_params[key])
+                elif legacy_key in request.query_params:
+                    value = request.query_params[legacy_key]
+                    # HBase timelines render created_at as a timestamp
+                    if value.isdigit():
+                        created_at = ts_to_datetime(int(value))
+                    else:
+                        created_at = parse_iso_datetime(value)
+                    cursors[key] = Cursor(created_at, None)
+            self._cursors = (request, cursors)
+        return self._cursors[1]
+
+    def _set_page(self, objects):
+        self.page_cursors = (
+            get_object_cursor(objects[0], self.tie_breaker) if objects else None,
+            get_object_cursor(objects[-1], self.tie_breaker) if objects else None,
+        )
+        return objects
+
+    def _sort_ties(self, objects, created_at):
+        """
+        Sort the objects created at created_at by the tie breaker, in place
+        the cache writes keep (created_at, id) order mostly, but a sorted set
+        orders the equal scores by member, only this run is sorted
+        """
+        start = count_newer(objects, created_at, tie_breaker=self.tie_breaker)
+        end = index_older(objects, created_at, tie_breaker=self.tie_breaker)
+        if end - start > 1:
+            objects[start:end] = sorted(
+                objects[start:end],
+                key=lambda obj: getattr(obj, self.tie_breaker) or 0,
+                reverse=True,
+            )
 
     def _paginate_ordered_list(self, reversed_list, request):
-        if 'created_at__gt' in request.query_params:
-            created_at__gt = parser.isoparse(request.query_params['created_at__gt'])
-            objects = []
-            for index, obj in enumerate(reversed_list):
-                if obj.created_at > created_at__gt:
-                    objects.append(obj)
-                else:
-                    break
+        # reversed_list is sorted by created_at, the ties at the cursor and
+        # at both ends of the page are sorted by id before cutting it
+        if reversed_list:
+            self._sort_ties(reversed_list, reversed_list[0].created_at)
+        cursors = self.get_cursors(request)
+        if 'after' in cursors:
+            self._sort_ties(reversed_list, cursors['after'].created_at)
             self.has_next_page = False
-            return objects
+            return reversed_list[:count_newer(reversed_list, *cursors['after'], self.tie_breaker)]
 
         index = 0
-        if 'created_at__lt' in request.query_params:
-            created_at__lt = parser.isoparse(request.query_params['created_at__lt'])
-            for index, obj in enumerate(reversed_list):
-                if obj.created_at < created_at__lt:
-                    break
-            else:
-                reversed_list = []
+        if 'before' in cursors:
+            self._sort_ties(reversed_list, cursors['before'].created_at)
+            index = index_older(reversed_list, *cursors['before'], self.tie_breaker)
+        last = min(index + self.page_size, len(reversed_list)) - 1
+        if last >= index:
+            self._sort_ties(reversed_list, reversed_list[last].created_at)
         self.has_next_page = len(reversed_list) > index + self.page_size
         return reversed_list[index:(index+self.page_size)]
 
     def paginate_queryset(self, queryset, request, view=None):
+        # keyset on (created_at, id), deep pages cost the same as the first one
+        queryset = queryset.order_by('-created_at', '-' + self.tie_breaker)
+        cursors = self.get_cursors(request)
         # refresh most updated
-        if 'created_at__gt' in request.query_params:
-            created_at__gt = request.query_params['created_at__gt']
-            queryset = queryset.filter(created_at__gt=created_at__gt)
+        if 'after' in cursors:
             self.has_next_page = False
-            return queryset
+            return self._set_page(list(filter_after(queryset, cursors['after'], self.tie_breaker)))
 
         # scrolling down
-        if 'created_at__lt' in request.query_params:
-            created_at__lt = request.query_params['created_at__lt']
-            queryset = queryset.filter(created_at__lt=created_at__lt)
+        if 'before' in cursors:
+            queryset = filter_before(queryset, cursors['before'], self.tie_breaker)
 
-        queryset = queryset[:self.page_size+1]
-        self.has_next_page = len(queryset) > self.page_size
-        return queryset[:self.page_size]
+        objects = list(queryset[:self.page_size+1])
+        self.has_next_page = len(objects) > self.page_size
+        return self._set_page(objects[:self.page_size])
+
+    def get_cached_list_window(self, request):
+        """
+        Window of the cached timeline needed by this request
+        The first page and scrolling down only need page_size + 1 objects to
+        tell has_next_page, refreshing needs every object newer than the cursor.
+        Lists are bisected on the created_at of their entries and sorted sets
+        seek by score, only the window is read. The objects created at the same
+        time as the cursor are in the window, the page is cut by id afterwards.
+        """
+        cursors = self.get_cursors(request)
+        if 'after' in cursors:
+            return {
+                'limit': None,
+                'created_at__gt': widen_created_at__gt(cursors['after']),
+            }
+        if 'before' in cursors:
+            # the object of the cursor is in the window too
+            return {
+                'limit': self.page_size + 2,
+                'created_at__lt': widen_created_at__lt(cursors['before']),
+            }
+        return {'limit': self.page_size + 1}
 
     def paginate_cached_list(self, cached_list, request, view=None):
+        # the cached window is cut by the cache limit
+        if cached_list is None:
+            return None
         paginated_list = self._paginate_ordered_list(cached_list, request)
         # if paginate upward, return all fresh posts
-        if 'created_at__gt' in request.query_params:
-            return paginated_list
+        if 'after' in self.get_cursors(request):
+            return self._set_page(paginated_list)
         # if there is next page, cache is still enough
         if self.has_next_page:
-            return paginated_list
+            return self._set_page(paginated_list)
+        # the window is full but the page is not, objects created at the same
+        # time as the cursor took the room of older ones
+        if len(cached_list) >= self.get_cached_list_window(request)['limit']:
+            return None
         # # of cached objects smaller than the cache limit, cache is enough
         if len(cached_list) < settings.REDIS_LIST_LENGTH_LIMIT:
-            return paginated_list
+            return self._set_page(paginated_list)
         # cache not enough
         return None
 
     def get_paginated_response(self, data):
+        first_cursor, last_cursor = self.page_cursors
         return Response({
             'has_next_page': self.has_next_page,
+            'has_gap': self.has_gap,
+            'next_cursor': encode_cursor(last_cursor) if self.has_next_page else None,
+            'refresh_cursor': encode_cursor(first_cursor) if first_cursor else None,
             'results': data,
         }, status=status.HTTP_200_OK)
 
     def to_html(self):
         pass
 
+    def get_merged_window(self, request):
+        """
+        Cursor bounds of the sources of a timeline merged by the caller, every
+        source is cut at the cursor and at page_size + 1 objects, the extra one
+        tells if there is a next page
+        """
+        cursors = self.get_cursors(request)
+        if 'after' in cursors:
+            return {'limit': self.page_size+1, 'after': cursors['after']}
+        return {'limit': self.page_size+1, 'before': cursors.get('before')}
+
+    def paginate_merged_list(self, merged_list, request):
+        # a refresh gets the newest page, same as paginate_hbase
+        self.has_next_page = len(merged_list) > self.page_size
+        if 'after' in self.get_cursors(request):
+            self.has_gap = self.has_next_page
+        return self._set_page(merged_list[:self.page_size])
+
     def paginate_hbase(self, hbase_model_class, row_prefix, request):
-        if 'created_at__gt' in request.query_params:
-            created_at__gt = request.query_params['created_at__gt']
-            start = (*row_prefix, created_at__gt)
-            stop = (*row_prefix, MAX_TIMESTAMP)
-            objects = hbase_model_class.filter(start=start, stop=stop)
-            if len(objects) and objects[0].created_at == created_at__gt:
-                objects = objects[:0:-1]
-            else:
-                objects = objects[::-1]
-            self.has_next_page = False
-            return objects
+        # created_at is unique in a row prefix, the row key alone is the cursor
+        cursors = self.get_cursors(request)
+        if 'after' in cursors:
+            # newest first down to the cursor, at most one page however long
+            # the client was away. More new rows than a page leave a gap
+            # between the page and the cursor, filled by scrolling down.
+            created_at__gt = datetime_to_ts(cursors['after'].created_at)
+            objects = hbase_model_class.filter(
+                start=(*row_prefix, MAX_TIMESTAMP),
+                stop=(*row_prefix, created_at__gt),
+                limit=self.page_size+1,
+                reverse=True,
+            )
+            self.has_gap = len(objects) > self.page_size
+            self.has_next_page = self.has_gap
+            return self._set_page(objects[:self.page_size])
 
-        if 'created_at__lt' in request.query_params:
-            created_at__lt = request.query_params['created_at__lt']
+        if 'before' in cursors:
+            created_at__lt = datetime_to_ts(cursors['before'].created_at)
             start = (*row_prefix, created_at__lt)
             stop = (*row_prefix, None)
             objects = hbase_model_class.filter(
@@ -101,22 +230,9 @@ class EndlessPagination(pagination.BasePagination):
             )
             if len(objects) and objects[0].created_at == created_at__lt:
                 objects = objects[1:]
-            else:
-                objects = objects[1:]
-            if len(objects) > self.page_size:
-                self.has_next_page = True
-                objects = objects[:-1]
-            else:
-                self.has_next_page = False
-            return objects
-
-        # no time params in request
-        prefix = (*row_prefix, None)
-        objects = hbase_model_class.filter(prefix=prefix, limit=self.page_size+1, reverse=True)
-        if len(objects) > self.page_size:
-            self.has_next_page = True
-            objects = objects[:-1]
         else:
-            self.has_next_page = False
-        return objects
-
+            # no time params in request
+            prefix = (*row_prefix, None)
+            objects = hbase_model_class.filter(prefix=prefix, limit=self.page_size+1, reverse=True)
+        self.has_next_page = len(objects) > self.page_size
+        return self._set_page(objects[:self.page_size])
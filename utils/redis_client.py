@@ -1,25 +1,110 @@
 import redis
-from twitter import settings
+import threading
+from django.conf import settings
+from utils.hash_ring import HashRing
+
+
+class RedisRole:
+    """
+    Every role has its own connection pool
+    slow timeline reads never hold the connections the counters need
+    """
+    TIMELINE = 'timeline'
+    COUNTER = 'counter'
+    GATEKEEPER = 'gatekeeper'
 
 
 class RedisClient:
     """
     Build connection between Redis and Django
+    a role may be sharded over several Redis nodes, the keys are spread by
+    consistent hashing of the id embedded in the key
     """
-    conn = None
+    shards = {}
+    lock = threading.Lock()
 
     @classmethod
-    def get_connection(cls):
-        # Singleton alike connection initialization
-        # assure Django calls one single global connection for Redis
-        if cls.conn is not None:
-            return cls.conn
-        cls.conn = redis.Redis(
-            host=settings.REDIS_HOST,
-            port=settings.REDIS_PORT,
-            db=settings.REDIS_DB,
-        )
-        return cls.conn
+    def _get_nodes(cls, role):
+        options = settings.REDIS_POOLS[role]
+        nodes = []
+        for shard in options.get('shards') or [{}]:
+            nodes.append({
+                'host': shard.get('host', options.get('host', settings.REDIS_HOST)),
+                'port': shard.get('port', options.get('port', settings.REDIS_PORT)),
+                'db': shard.get('db', options.get('db', settings.REDIS_DB)),
+            })
+        return nodes
+
+    @classmethod
+    def _get_pool_kwargs(cls, role, node):
+        options = settings.REDIS_POOLS[role]
+        return {
+            'host': node['host'],
+            'port': node['port'],
+            'db': node['db'],
+            'max_connections': options['max_connections'],
+            'timeout': settings.REDIS_POOL_TIMEOUT,
+            'socket_timeout': settings.REDIS_SOCKET_TIMEOUT,
+            'socket_connect_timeout': settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+            'retry_on_timeout': options.get('retry_on_timeout', settings.REDIS_RETRY_ON_TIMEOUT),
+            'health_check_interval': settings.REDIS_HEALTH_CHECK_INTERVAL,
+        }
+
+    @classmethod
+    def _create_connection(cls, role, node):
+        # blocking pool is thread safe and bounded, a request waits up to
+        # REDIS_POOL_TIMEOUT for a free connection instead of opening new ones
+        pool = redis.BlockingConnectionPool(**cls._get_pool_kwargs(role, node))
+        return redis.Redis(connection_pool=pool)
+
+    @classmethod
+    def _get_shards(cls, role):
+        shards = cls.shards.get(role)
+        if shards is not None:
+            return shards
+        with cls.lock:
+            if role not in cls.shards:
+                conns = {}
+                for node in cls._get_nodes(role):
+                    node_name = '{host}:{port}/{db}'.format(**node)
+                    conns[node_name] = cls._create_connection(role, node)
+                cls.shards[role] = (HashRing(conns), conns)
+            return cls.shards[role]
+
+    @classmethod
+    def get_shard_key(cls, name):
+        """
+        The first id in the key, e.g. 'usertweet:1' and 'usertweet:1:rebuild_lock'
+        both go to the shard of '1'. Keys without an id are hashed as a whole
+        """
+        for part in name.split(':'):
+            if part.isdigit():
+                return part
+        return name
+
+    @classmethod
+    def get_connection(cls, role=RedisRole.TIMELINE, name=None):
+        # one client per role and shard shared by all threads, the pool hands
+        # out a connection per command so the client itself is thread safe
+        ring, conns = cls._get_shards(role)
+        if name is None or len(conns) == 1:
+            # keys not owned by an object live on the first node
+            return next(iter(conns.values()))
+        return conns[ring.get_node(cls.get_shard_key(name))]
+
+    @classmethod
+    def group_by_shard(cls, role, names):
+        """
+        Group the keys of a multi-key operation by shard
+
+        Output:
+        List of (connection, indexes of the names on that shard)
+        """
+        groups = {}
+        for index, name in enumerate(names):
+            conn = cls.get_connection(role, name)
+            groups.setdefault(id(conn), (conn, []))[1].append(index)
+        return list(groups.values())
 
     @classmethod
     def clear(cls):
@@ -27,5 +112,12 @@ class RedisClient:
             raise Exception(
                 'You can not flush Redis in a production environment.'
             )
-        conn = cls.get_connection()
-        conn.flushdb()
+        # nodes shared by several roles are flushed once
+        flushed = set()
+        for role in settings.REDIS_POOLS:
+            _, conns = cls._get_shards(role)
+            for node_name, conn in conns.items():
+                if node_name in flushed:
+                    continue
+                conn.flushdb()
+                flushed.add(node_name)
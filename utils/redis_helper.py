@@ -1,54 +1,785 @@
-from utils.redis_client import RedisClient
+from utils.redis_client import RedisClient, RedisRole
 from utils.redis_serializers import DjangoModelSerializer
+from utils.time_helper import count_newer, datetime_to_ts, index_older
 from django.conf import settings
+from django.db import transaction
+import heapq
+import time
+import uuid
+
+REBUILD_LOCK_PATTERN = '{name}:rebuild_lock'
+# a full timeline that lost members, the freed tail is refilled from the db
+# on the next read
+TRUNCATED_PATTERN = '{name}:truncated'
+REBUILD_POLL_INTERVAL = 0.01
+
+# delete the lock only if it is still ours, it may have expired and been
+# taken by another rebuilder in the meantime
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# push values to the head of existing timelines, trim them and refresh the ttl
+# KEYS[1..ARGV[3]] the timelines, the other KEYS are stale timelines to delete
+# ARGV[1] size limit, ARGV[2] ttl, ARGV[3 + i] the value of KEYS[i]
+# missing timelines are left to the caller to rebuild from db
+# a value already in the timeline is not pushed twice, e.g. a retried fanout
+# batch, the timelines are short enough to be scanned (no LPOS in Redis 4)
+PUSH_TO_LIST_SCRIPT = """
+local pushed = {}
+for i = 1, tonumber(ARGV[3]) do
+    pushed[i] = redis.call('EXISTS', KEYS[i])
+    if pushed[i] == 1 then
+        local found = false
+        for _, value in ipairs(redis.call('LRANGE', KEYS[i], 0, -1)) do
+            if value == ARGV[i + 3] then
+                found = true
+                break
+            end
+        end
+        if not found then
+            redis.call('LPUSH', KEYS[i], ARGV[i + 3])
+            redis.call('LTRIM', KEYS[i], 0, tonumber(ARGV[1]) - 1)
+        end
+        redis.call('EXPIRE', KEYS[i], ARGV[2])
+    end
+end
+for i = tonumber(ARGV[3]) + 1, #KEYS do
+    redis.call('DEL', KEYS[i])
+end
+return pushed
+"""
+
+# same as PUSH_TO_LIST_SCRIPT, ARGV[2 + 2i] and ARGV[3 + 2i] the score and value of KEYS[i]
+# ZADD of a member already in the timeline only rewrites the same score
+PUSH_TO_SORTED_SET_SCRIPT = """
+local pushed = {}
+for i = 1, tonumber(ARGV[3]) do
+    pushed[i] = redis.call('EXISTS', KEYS[i])
+    if pushed[i] == 1 then
+        redis.call('ZADD', KEYS[i], ARGV[2 * i + 2], ARGV[2 * i + 3])
+        redis.call('ZREMRANGEBYRANK', KEYS[i], 0, -tonumber(ARGV[1]) - 1)
+        redis.call('EXPIRE', KEYS[i], ARGV[2])
+    end
+end
+for i = tonumber(ARGV[3]) + 1, #KEYS do
+    redis.call('DEL', KEYS[i])
+end
+return pushed
+"""
+
+# remove values from timelines, KEYS[2i - 1] the timeline of the value
+# ARGV[3 + i], KEYS[2i] its truncated marker
+# ARGV[1] size limit, ARGV[2] ttl, ARGV[3] '1' for sorted sets
+# a full timeline is cut, once shorter it would look complete to the readers
+# and hide the objects in the db past its end, it is marked truncated for the
+# next read to refill it instead of being deleted and rebuilt as a whole
+REMOVE_FROM_TIMELINES_SCRIPT = """
+local sorted_set = ARGV[3] == '1'
+for i = 1, #KEYS / 2 do
+    local name = KEYS[2 * i - 1]
+    local size, removed
+    if sorted_set then
+        size = redis.call('ZCARD', name)
+        removed = redis.call('ZREM', name, ARGV[i + 3])
+    else
+        size = redis.call('LLEN', name)
+        removed = redis.call('LREM', name, 0, ARGV[i + 3])
+    end
+    if removed > 0 and size >= tonumber(ARGV[1]) then
+        redis.call('SET', KEYS[2 * i], 1, 'EX', ARGV[2])
+    end
+end
+return #KEYS / 2
+"""
+
+# read the cursor window of a timeline list, the list is newest first so the
+# window is bisected on the created_at of the entries with LINDEX
+# KEYS[1] the list, KEYS[2] its truncated marker
+# ARGV[1] position of created_at in the entries,
+# ARGV[2] 'lt' or 'gt', ARGV[3] the cursor timestamp, ARGV[4] limit, 0 for none
+# returns {0} for a missing or truncated list, {length, 0} if an entry is not
+# id-encoded (e.g. full objects of the older codecs), {length, 1, entries...}
+# otherwise
+LOAD_LIST_WINDOW_SCRIPT = """
+local size = redis.call('LLEN', KEYS[1])
+if size == 0 or redis.call('EXISTS', KEYS[2]) == 1 then
+    return {0}
+end
+local position = tonumber(ARGV[1])
+local cursor = tonumber(ARGV[3])
+local function created_at(index)
+    local value = redis.call('LINDEX', KEYS[1], index)
+    if not string.find(value, '^%d') then
+        return nil
+    end
+    local field = 0
+    for part in string.gmatch(value .. ':', '([^:]*):') do
+        if field == position then
+            return tonumber(part)
+        end
+        field = field + 1
+    end
+    return nil
+end
+-- first entry out of the window
+local low, high = 0, size
+while low < high do
+    local middle = math.floor((low + high) / 2)
+    local ts = created_at(middle)
+    if ts == nil then
+        return {size, 0}
+    end
+    local out
+    if ARGV[2] == 'gt' then
+        out = ts <= cursor
+    else
+        out = ts < cursor
+    end
+    if out then
+        high = middle
+    else
+        low = middle + 1
+    end
+end
+local result = {size, 1}
+local entries
+if ARGV[2] == 'gt' then
+    if low == 0 then
+        return result
+    end
+    entries = redis.call('LRANGE', KEYS[1], 0, low - 1)
+else
+    local limit = tonumber(ARGV[4])
+    local stop = -1
+    if limit > 0 then
+        stop = low + limit - 1
+    end
+    entries = redis.call('LRANGE', KEYS[1], low, stop)
+end
+for _, entry in ipairs(entries) do
+    result[#result + 1] = entry
+end
+return result
+"""
+
+# sets cached from the db, e.g. the celebrities or the deleted tweets, carry
+# a marker member once loaded, no object has the id 0
+LOADED_SET_MARKER = 0
+
+# the values found in a cached set, false if the set has no loaded marker,
+# the members added to it before the load are kept by the load
+# KEYS[1] the set, ARGV[1] the loaded marker, ARGV[2..] the values
+FIND_SET_MEMBERS_SCRIPT = """
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 0 then
+    return false
+end
+local found = {}
+for i = 2, #ARGV do
+    if redis.call('SISMEMBER', KEYS[1], ARGV[i]) == 1 then
+        found[#found + 1] = ARGV[i]
+    end
+end
+return found
+"""
+
+# write-behind counters, deltas are logged in a hash per model and flushed
+# to the db in batches, a batch is kept until it is applied to survive crashes
+COUNT_DELTAS_PATTERN = '{class_name}:count_deltas'
+COUNT_DELTA_BATCHES_PATTERN = '{class_name}:count_delta_batches'
+COUNT_DELTA_BATCH_PATTERN = '{class_name}:count_deltas:{batch_id}'
+
+# move the delta log into a new batch, increments after this go to a fresh log
+TAKE_COUNT_DELTAS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('RENAME', KEYS[1], KEYS[2])
+redis.call('SADD', KEYS[3], KEYS[2])
+return 1
+"""
+
+
+# increment a cached counter only if it is still cached, an INCRBY on a key
+# expired since the EXISTS would cache the delta alone as the count
+# KEYS[1] the counter, ARGV[1] the delta, returns false on a miss
+INCR_CACHED_COUNT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+return redis.call('INCRBY', KEYS[1], ARGV[1])
+"""
+
+# pending deltas of some counters per batch, read in one go so a batch
+# taken or removed by a concurrent flush is seen exactly once
+# KEYS[1] the delta log, KEYS[2] the set of pending batches, ARGV the fields
+# returns {{'', log deltas}, {batch name, batch deltas}, ...}
+READ_COUNT_DELTAS_SCRIPT = """
+local function read(name)
+    local deltas = {}
+    for i, field in ipairs(ARGV) do
+        deltas[i] = redis.call('HGET', name, field)
+    end
+    return deltas
+end
+local result = {{'', read(KEYS[1])}}
+for _, name in ipairs(redis.call('SMEMBERS', KEYS[2])) do
+    result[#result + 1] = {name, read(name)}
+end
+return result
+"""
 
 
 class RedisHelper:
+    scripts = {}
+    # model class => ledger model of the delta batches applied to it
+    count_delta_ledgers = {}
 
     @classmethod
-    def _load_objects_to_cache(cls, name, objects):
-        conn = RedisClient.get_connection()
+    def _get_script(cls, conn, source):
+        # EVALSHA, the script is only sent again if the server doesn't know it
+        if source not in cls.scripts:
+            cls.scripts[source] = conn.register_script(source)
+        return cls.scripts[source]
+
+    @classmethod
+    def _load_objects_to_cache(cls, name, objects, serializer=DjangoModelSerializer):
+        conn = RedisClient.get_connection(RedisRole.TIMELINE, name)
         serialized_objects = []
         # limit the cache list size
         for object in objects:
-            serialized_obj = DjangoModelSerializer.serialize(object)
+            serialized_obj = serializer.serialize(object)
             serialized_objects.append(serialized_obj)
 
         if serialized_objects:
-            conn.rpush(name, *serialized_objects)
-            conn.expire(name, settings.REDIS_KEY_EXPIRE_TIME)
+            # replace the whole list in one MULTI/EXEC transaction
+            # the list is never seen half-filled, nor filled twice by two rebuilders
+            pipe = conn.pipeline(transaction=True)
+            pipe.delete(name, TRUNCATED_PATTERN.format(name=name))
+            pipe.rpush(name, *serialized_objects)
+            pipe.expire(name, settings.REDIS_KEY_EXPIRE_TIME)
+            pipe.execute()
 
     @classmethod
-    def load_objects(cls, name, queryset):
-        queryset = queryset[: settings.REDIS_LIST_LENGTH_LIMIT]
-        conn = RedisClient.get_connection()
+    def _load_objects_to_sorted_set(cls, name, objects, serializer=DjangoModelSerializer):
+        conn = RedisClient.get_connection(RedisRole.TIMELINE, name)
+        # score by created_at in microseconds, exact in a double until year 2255
+        mapping = {
+            serializer.serialize(object): datetime_to_ts(object.created_at)
+            for object in objects
+        }
+        if mapping:
+            pipe = conn.pipeline(transaction=True)
+            pipe.delete(name, TRUNCATED_PATTERN.format(name=name))
+            pipe.zadd(name, mapping)
+            pipe.expire(name, settings.REDIS_KEY_EXPIRE_TIME)
+            pipe.execute()
 
-        if conn.exists(name):
-            objects = []
-            serialized_tweets = conn.lrange(name, 0, -1)
-            for serialized_tweet in serialized_tweets:
-                object = DjangoModelSerializer.deserialize(serialized_tweet)
-                objects.append(object)
-            return objects
+    @classmethod
+    def _acquire_rebuild_lock(cls, name):
+        conn = RedisClient.get_connection(RedisRole.TIMELINE, name)
+        token = uuid.uuid4().hex
+        acquired = conn.set(
+            REBUILD_LOCK_PATTERN.format(name=name),
+            token,
+            nx=True,
+            ex=settings.REDIS_REBUILD_LOCK_EXPIRE_TIME,
+        )
+        return token if acquired else None
+
+    @classmethod
+    def _release_rebuild_lock(cls, name, token):
+        conn = RedisClient.get_connection(RedisRole.TIMELINE, name)
+        conn.eval(RELEASE_LOCK_SCRIPT, 1, REBUILD_LOCK_PATTERN.format(name=name), token)
 
-        # cache miss
-        cls._load_objects_to_cache(name, queryset)
-        # format output as list, Redis output is List
-        return list(queryset)
+    @classmethod
+    def _wait_for_rebuild(cls, name, serializer, sorted_set=False):
+        """
+        Poll the list being rebuilt by another process
+        return None if it doesn't show up in REDIS_REBUILD_WAIT_TIME
+        """
+        conn = RedisClient.get_connection(RedisRole.TIMELINE, name)
+        lock_name = REBUILD_LOCK_PATTERN.format(name=name)
+        deadline = time.time() + settings.REDIS_REBUILD_WAIT_TIME
+        while time.time() < deadline:
+            time.sleep(REBUILD_POLL_INTERVAL)
+            pipe = conn.pipeline(transaction=False)
+            if sorted_set:
+                pipe.zrevrange(name, 0, -1)
+            else:
+                pipe.lrange(name, 0, -1)
+            pipe.exists(lock_name)
+            serialized_objects, locked = pipe.execute()
+            if serialized_objects:
+                return cls._deserialize_objects(serialized_objects, serializer)
+            # rebuild finished without a list, nothing to cache
+            if not locked:
+                return None
+        return None
 
     @classmethod
-    def push_object_to_cache(cls, name, queryset, object):
+    def _rebuild_cache(cls, name, queryset, serializer=DjangoModelSerializer, sorted_set=False):
+        """
+        Single-flight rebuild of an expired list to avoid the cache stampede
+        only the lock owner runs the queryset and fills the list, concurrent
+        requests wait for it and then read the db without writing the cache
+        """
         queryset = queryset[: settings.REDIS_LIST_LENGTH_LIMIT]
-        conn = RedisClient.get_connection()
-        # cache miss, load all tweets from db
-        if not conn.exists(name):
-            cls._load_objects_to_cache(name, queryset)
-            return 
-
-        serialized_object = DjangoModelSerializer.serialize(object)
-        conn.lpush(name, serialized_object)
-        # limit the cache list size
-        conn.ltrim(name, 0, settings.REDIS_LIST_LENGTH_LIMIT-1)
+        token = cls._acquire_rebuild_lock(name)
+        if token is None:
+            objects = cls._wait_for_rebuild(name, serializer, sorted_set)
+            if objects is not None:
+                return objects
+            # format output as list, Redis output is List
+            return list(queryset)
+
+        try:
+            objects = list(queryset)
+            if sorted_set:
+                cls._load_objects_to_sorted_set(name, objects, serializer)
+            else:
+                cls._load_objects_to_cache(name, objects, serializer)
+        finally:
+            cls._release_rebuild_lock(name, token)
+        return objects
+
+    @classmethod
+    def _deserialize_objects(cls, serialized_objects, serializer=DjangoModelSerializer):
+        return [
+            serializer.deserialize(serialized_object)
+            for serialized_object in serialized_objects
+        ]
+
+    @classmethod
+    def load_objects(
+        cls,
+        name,
+        queryset,
+        serializer=DjangoModelSerializer,
+        limit=None,
+        created_at__lt=None,
+        created_at__gt=None,
+    ):
+        """
+        Output:
+        List of objects in the cursor window, ordered by created_at descending
+        None if the window runs past the end of a full list, older objects are
+        only in the db then
+        """
+        if created_at__lt is None and created_at__gt is None:
+            return cls.load_objects_batch([(name, queryset, serializer)], limit)[0]
+        if getattr(serializer, 'created_at_position', None) is not None:
+            loaded, objects = cls._load_list_window(name, serializer, limit, created_at__lt, created_at__gt)
+            if loaded:
+                return objects
+        # full objects can't be bisected in Redis, load the whole list
+        objects = cls.load_objects_batch([(name, queryset, serializer)])[0]
+        return cls._cut_window(objects, limit, created_at__lt, created_at__gt)
+
+    @classmethod
+    def _load_list_window(cls, name, serializer, limit=None, created_at__lt=None, created_at__gt=None):
+        """
+        Read only the cursor window of a list of id-encoded entries, bisected
+        in one script call instead of a LRANGE of the whole list
+
+        Output:
+        (loaded, objects), loaded is False if the list is missing, truncated or
+        can't be bisected, objects is None if the window runs past the end of a full list
+        """
+        conn = RedisClient.get_connection(RedisRole.TIMELINE, name)
+        if created_at__gt is not None:
+            args = ['gt', datetime_to_ts(created_at__gt), 0]
+        else:
+            args = ['lt', datetime_to_ts(created_at__lt), limit or 0]
+        result = cls._get_script(conn, LOAD_LIST_WINDOW_SCRIPT)(
+            keys=[name, TRUNCATED_PATTERN.format(name=name)],
+            args=[serializer.created_at_position] + args,
+            client=conn,
+        )
+        if len(result) < 2 or not result[1]:
+            return False, None
+        size, serialized_objects = result[0], result[2:]
+        objects = cls._deserialize_objects(serialized_objects, serializer)
+        if created_at__gt is None and limit and len(objects) < limit:
+            if size >= settings.REDIS_LIST_LENGTH_LIMIT:
+                return True, None
+        return True, objects
+
+    @classmethod
+    def _cut_window(cls, objects, limit=None, created_at__lt=None, created_at__gt=None):
+        """
+        Cut the cursor window out of a whole cached timeline
+        None if the window runs past the end of a full timeline
+        """
+        if created_at__gt is not None:
+            return objects[:count_newer(objects, created_at__gt)]
+        window = objects
+        if created_at__lt is not None:
+            window = objects[index_older(objects, created_at__lt):]
+        if limit:
+            window = window[:limit]
+            if len(window) < limit and len(objects) >= settings.REDIS_LIST_LENGTH_LIMIT:
+                return None
+        return window
+
+    @classmethod
+    def load_objects_batch(cls, lists, limit=None):
+        """
+        Load several cached lists at once, e.g. user tweets and newsfeeds
+
+        Input:
+        @lists(list): [(name, queryset, serializer), ...] the queryset rebuilds
+            the cached list on cache miss
+        @limit(int): only load the first objects of the lists, None for whole lists
+
+        Output:
+        List of object lists, in the same order as the input
+        """
+        stop = limit - 1 if limit else -1
+        # EXISTS + LRANGE of all the lists in one single round trip per shard
+        results = [None] * (3 * len(lists))
+        for conn, indexes in RedisClient.group_by_shard(
+            RedisRole.TIMELINE,
+            [name for name, _, _ in lists],
+        ):
+            pipe = conn.pipeline(transaction=False)
+            for index in indexes:
+                pipe.exists(lists[index][0])
+                pipe.lrange(lists[index][0], 0, stop)
+                pipe.exists(TRUNCATED_PATTERN.format(name=lists[index][0]))
+            shard_results = pipe.execute()
+            for position, index in enumerate(indexes):
+                results[3 * index:3 * index + 3] = shard_results[3 * position:3 * position + 3]
+
+        objects_list = []
+        for index, (name, queryset, serializer) in enumerate(lists):
+            exists, serialized_objects, truncated = results[3 * index:3 * index + 3]
+            if exists and truncated:
+                objects = cls._refill_timeline(name, queryset, serializer)
+                objects_list.append(objects[:limit] if limit else objects)
+                continue
+            if exists:
+                objects_list.append(
+                    cls._deserialize_objects(serialized_objects, serializer)
+                )
+                continue
+            # cache miss
+            objects = cls._rebuild_cache(name, queryset, serializer)
+            objects_list.append(objects[:limit] if limit else objects)
+        return objects_list
+
+    @classmethod
+    def push_objects_to_cache(
+        cls,
+        items,
+        serializer=DjangoModelSerializer,
+        sorted_set=False,
+        stale_names=(),
+        rebuild=True,
+    ):
+        """
+        Push objects to the head of their cached timelines, e.g. a fanout batch
+        the existence check, push, trim and ttl refresh run atomically in one
+        script call per shard
+
+        Input:
+        @items(list): [(name, queryset, object), ...] the queryset rebuilds a
+            missing timeline, the object is saved already so it is included
+        @stale_names(list): timelines deleted in the same call, e.g. the ones
+            of the inactive backend
+        @rebuild(bool): rebuild the missing timelines from db, otherwise skip
+            them and leave it to the next read
+
+        Output:
+        List of booleans, False for the missing timelines
+        """
+        names = [name for name, _, _ in items]
+        stale_names = list(stale_names)
+        source = PUSH_TO_SORTED_SET_SCRIPT if sorted_set else PUSH_TO_LIST_SCRIPT
+        pushed = [False] * len(items)
+        for conn, indexes in RedisClient.group_by_shard(RedisRole.TIMELINE, names + stale_names):
+            item_indexes = [index for index in indexes if index < len(items)]
+            keys = [names[index] for index in item_indexes]
+            keys += [stale_names[index - len(items)] for index in indexes if index >= len(items)]
+            args = [settings.REDIS_LIST_LENGTH_LIMIT, settings.REDIS_KEY_EXPIRE_TIME, len(item_indexes)]
+            for index in item_indexes:
+                object = items[index][2]
+                if sorted_set:
+                    args.append(datetime_to_ts(object.created_at))
+                args.append(serializer.serialize(object))
+            results = cls._get_script(conn, source)(keys=keys, args=args, client=conn)
+            for index, result in zip(item_indexes, results):
+                pushed[index] = bool(result)
+
+        if not rebuild:
+            return pushed
+        for index, (name, queryset, _) in enumerate(items):
+            if not pushed[index]:
+                cls._rebuild_cache(name, queryset, serializer, sorted_set)
+        return pushed
+
+    @classmethod
+    def _rewrite_cached_timeline(cls, name, serializer, sorted_set, rewrite, stale_names=()):
+        """
+        Rewrite an existing cached timeline in a WATCH/MULTI transaction, it is
+        retried if a push lands in between, a missing timeline is left to be
+        rebuilt on read
+
+        Input:
+        @rewrite(func): [(value, object), ...] newest first => the new items,
+            None to leave the timeline as it is
+        """
+        conn = RedisClient.get_connection(RedisRole.TIMELINE, name)
+
+        def transaction(pipe):
+            values = pipe.zrevrange(name, 0, -1) if sorted_set else pipe.lrange(name, 0, -1)
+            if not values:
+                return
+            items = rewrite([(value, serializer.deserialize(value)) for value in values])
+            if items is None:
+                return
+            pipe.multi()
+            pipe.delete(name, *stale_names)
+            if not items:
+                return
+            if sorted_set:
+                pipe.zadd(name, {
+                    value: datetime_to_ts(object.created_at)
+                    for value, object in items
+                })
+            else:
+                pipe.rpush(name, *[value for value, _ in items])
+            pipe.expire(name, settings.REDIS_KEY_EXPIRE_TIME)
+
+        conn.transaction(transaction, name)
+
+    @classmethod
+    def merge_objects_to_cache(
+        cls,
+        name,
+        objects,
+        serializer=DjangoModelSerializer,
+        sorted_set=False,
+        tie_breaker='id',
+    ):
+        """
+        Merge objects into a cached timeline in (created_at, tie_breaker)
+        order, e.g. the older tweets of a new following, instead of dropping
+        the timeline
+        """
+        limit = settings.REDIS_LIST_LENGTH_LIMIT
+
+        def get_key(item):
+            return item[1].created_at, getattr(item[1], tie_breaker) or 0
+
+        def rewrite(items):
+            merging = objects
+            # a full timeline is cut, the objects older than its tail would
+            # hide the ones in the db between them
+            if len(items) >= limit:
+                tail = items[-1][1].created_at
+                merging = [object for object in objects if object.created_at > tail]
+            cached_values = {value for value, _ in items}
+            new_items = [(serializer.serialize(object), object) for object in merging]
+            new_items = sorted(
+                [item for item in new_items if item[0] not in cached_values],
+                key=get_key,
+                reverse=True,
+            )
+            if not new_items:
+                return None
+            merged = heapq.merge(items, new_items, key=get_key, reverse=True)
+            return list(merged)[:limit]
+
+        cls._rewrite_cached_timeline(name, serializer, sorted_set, rewrite)
+
+    @classmethod
+    def remove_objects_from_cache(cls, name, queryset, objects, serializer=DjangoModelSerializer, sorted_set=False):
+        """
+        Remove objects from a cached timeline, the objects must be gone from
+        the queryset already, a full timeline is refilled from it to stay full
+        """
+        limit = settings.REDIS_LIST_LENGTH_LIMIT
+        removing = {serializer.serialize(object) for object in objects}
+
+        def rewrite(items):
+            kept = [item for item in items if item[0] not in removing]
+            if len(kept) == len(items):
+                return None
+            if len(items) >= limit:
+                tail = items[-1][1].created_at
+                kept += [
+                    (serializer.serialize(object), object)
+                    for object in queryset.filter(created_at__lt=tail)[:limit - len(kept)]
+                ]
+            return kept
+
+        cls._rewrite_cached_timeline(name, serializer, sorted_set, rewrite)
+
+    @classmethod
+    def _refill_timeline(cls, name, queryset, serializer=DjangoModelSerializer, sorted_set=False):
+        """
+        Refill the tail of a truncated timeline from the queryset, same as
+        remove_objects_from_cache does for a single timeline
+
+        Output:
+        List of the objects of the refilled timeline
+        """
+        limit = settings.REDIS_LIST_LENGTH_LIMIT
+        refilled = []
+
+        def rewrite(items):
+            tail = items[-1][1].created_at
+            refilled[:] = items + [
+                (serializer.serialize(object), object)
+                for object in queryset.filter(created_at__lt=tail)[:limit - len(items)]
+            ]
+            return refilled
+
+        cls._rewrite_cached_timeline(
+            name,
+            serializer,
+            sorted_set,
+            rewrite,
+            stale_names=[TRUNCATED_PATTERN.format(name=name)],
+        )
+        # the timeline expired in the meantime
+        if not refilled:
+            return cls._rebuild_cache(name, queryset, serializer, sorted_set)
+        return [object for _, object in refilled]
+
+    @classmethod
+    def remove_objects_from_timelines(cls, items, serializer=DjangoModelSerializer, sorted_set=False):
+        """
+        Remove objects from many cached timelines, e.g. the newsfeeds of a
+        deleted tweet, in one script call per shard
+
+        Input:
+        @items(list): [(name, object), ...]
+        """
+        names = [name for name, _ in items]
+        for conn, indexes in RedisClient.group_by_shard(RedisRole.TIMELINE, names):
+            args = [
+                settings.REDIS_LIST_LENGTH_LIMIT,
+                settings.REDIS_KEY_EXPIRE_TIME,
+                '1' if sorted_set else '0',
+            ]
+            args += [serializer.serialize(items[index][1]) for index in indexes]
+            keys = []
+            for index in indexes:
+                keys += [names[index], TRUNCATED_PATTERN.format(name=names[index])]
+            cls._get_script(conn, REMOVE_FROM_TIMELINES_SCRIPT)(
+                keys=keys,
+                args=args,
+                client=conn,
+            )
+
+    @classmethod
+    def find_set_members(cls, name, values, load_members):
+        """
+        Integer values found in a set cached from the db, only the values are
+        checked, the whole set is never read. A missing or evicted set is
+        loaded again, losing it costs one load, never a member
+
+        Input:
+        @load_members(func): all the members of the set from the db
+
+        Output:
+        Set of the values in the set
+        """
+        values = list(values)
+        if not values:
+            return set()
+        conn = RedisClient.get_connection(RedisRole.TIMELINE, name)
+        found = cls._get_script(conn, FIND_SET_MEMBERS_SCRIPT)(
+            keys=[name],
+            args=[LOADED_SET_MARKER] + values,
+            client=conn,
+        )
+        if found is not None:
+            return {int(value) for value in found}
+        members = set(load_members())
+        pipe = conn.pipeline(transaction=True)
+        pipe.sadd(name, LOADED_SET_MARKER, *members)
+        pipe.expire(name, settings.REDIS_KEY_EXPIRE_TIME)
+        pipe.execute()
+        return members & set(values)
+
+    @classmethod
+    def add_set_members(cls, name, *values):
+        # call once the members are in the db, a load running meanwhile may
+        # have missed them, they are added anyway and kept by the load
+        conn = RedisClient.get_connection(RedisRole.TIMELINE, name)
+        conn.sadd(name, *values)
+
+    @classmethod
+    def push_object_to_cache(cls, name, queryset, object, serializer=DjangoModelSerializer, stale_names=()):
+        cls.push_objects_to_cache([(name, queryset, object)], serializer, stale_names=stale_names)
+
+    @classmethod
+    def load_sorted_set_objects(
+        cls,
+        name,
+        queryset,
+        serializer=DjangoModelSerializer,
+        limit=None,
+        created_at__lt=None,
+        created_at__gt=None,
+    ):
+        """
+        Load a timeline cached in a sorted set scored by created_at
+        cursor windows are read with ZREVRANGEBYSCORE ... LIMIT in O(log(n) + limit)
+        instead of scanning the whole list
+
+        Output:
+        List of objects in the window, ordered by created_at descending
+        None if the window is cut by the size limit of the sorted set, older
+        objects are only in the db then
+        """
+        conn = RedisClient.get_connection(RedisRole.TIMELINE, name)
+        pipe = conn.pipeline(transaction=False)
+        pipe.zcard(name)
+        pipe.exists(TRUNCATED_PATTERN.format(name=name))
+        if created_at__gt is not None:
+            pipe.zrevrangebyscore(name, '+inf', '({}'.format(datetime_to_ts(created_at__gt)))
+        elif created_at__lt is not None:
+            pipe.zrevrangebyscore(
+                name,
+                '({}'.format(datetime_to_ts(created_at__lt)),
+                '-inf',
+                start=0 if limit else None,
+                num=limit,
+            )
+        else:
+            pipe.zrevrange(name, 0, limit - 1 if limit else -1)
+        count, truncated, serialized_objects = pipe.execute()
+
+        if count and truncated:
+            objects = cls._refill_timeline(name, queryset, serializer, sorted_set=True)
+            return cls._cut_window(objects, limit, created_at__lt, created_at__gt)
+        if count:
+            objects = cls._deserialize_objects(serialized_objects, serializer)
+        else:
+            # cache miss, cut the window out of the rebuilt timeline
+            objects = cls._rebuild_cache(name, queryset, serializer, sorted_set=True)
+            return cls._cut_window(objects, limit, created_at__lt, created_at__gt)
+
+        if created_at__gt is None and limit and len(objects) < limit:
+            if count >= settings.REDIS_LIST_LENGTH_LIMIT:
+                return None
+        return objects
+
+    @classmethod
+    def push_object_to_sorted_set(cls, name, queryset, object, serializer=DjangoModelSerializer, stale_names=()):
+        cls.push_objects_to_cache(
+            [(name, queryset, object)],
+            serializer,
+            sorted_set=True,
+            stale_names=stale_names,
+        )
 
     @classmethod
     def get_count_name(cls, obj, attr):
@@ -59,57 +790,260 @@ class RedisHelper:
         )
 
     @classmethod
-    def incr_count(cls, obj, attr):
-        conn = RedisClient.get_connection()
+    def get_count_delta_field(cls, obj, attr):
+        return "{object_id}:{attr}".format(object_id=obj.id, attr=attr)
+
+    @classmethod
+    def _get_count_deltas_connection(cls, model_class):
+        # the delta log and its batches of a model stay on one shard
+        return RedisClient.get_connection(
+            RedisRole.COUNTER,
+            COUNT_DELTAS_PATTERN.format(class_name=model_class.__name__),
+        )
+
+    @classmethod
+    def register_count_delta_ledger(cls, model_class, ledger_class):
+        """
+        The ledger rows (batch_name) commit together with the deltas applied
+        by a flush, they tell the batches already in the db counters
+        """
+        cls.count_delta_ledgers[model_class] = ledger_class
+
+    @classmethod
+    def get_pending_count_delta_batches(cls, model_class, fields):
+        """
+        Pending deltas of many counters of a model per batch, in one script call
+
+        Output:
+        List of (batch name, deltas in the order of fields), the delta log
+        not taken by a flush yet comes first with the batch name None
+        """
+        conn = cls._get_count_deltas_connection(model_class)
+        class_name = model_class.__name__
+        results = cls._get_script(conn, READ_COUNT_DELTAS_SCRIPT)(
+            keys=[
+                COUNT_DELTAS_PATTERN.format(class_name=class_name),
+                COUNT_DELTA_BATCHES_PATTERN.format(class_name=class_name),
+            ],
+            args=fields,
+            client=conn,
+        )
+        return [
+            (
+                batch_name.decode() if batch_name else None,
+                [int(delta) if delta is not None else 0 for delta in deltas],
+            )
+            for batch_name, deltas in results
+        ]
+
+    @classmethod
+    def _load_counts_from_db(cls, model_class, fields, load_counts):
+        """
+        Counters from db plus their pending deltas
+
+        The pending batches are read before the db so a batch applied and
+        removed by a concurrent flush can't be missed. The batches applied in
+        between are in the db counters already, the ledger read in the same
+        transaction as the counters tells them, they are not added twice.
+
+        Input:
+        @load_counts(func): reads the db counters, called in the transaction
+
+        Output:
+        (result of load_counts, pending deltas in the order of fields)
+        """
+        batches = cls.get_pending_count_delta_batches(model_class, fields)
+        batch_names = [batch_name for batch_name, _ in batches if batch_name]
+        ledger_class = cls.count_delta_ledgers.get(model_class)
+        applied_names = set()
+        if ledger_class is None or not batch_names:
+            db_counts = load_counts()
+        else:
+            # one snapshot for the counters and the ledger
+            with transaction.atomic():
+                db_counts = load_counts()
+                applied_names = set(ledger_class.objects.filter(
+                    batch_name__in=batch_names,
+                ).values_list('batch_name', flat=True))
+        pending_deltas = [0] * len(fields)
+        for batch_name, deltas in batches:
+            if batch_name in applied_names:
+                continue
+            for index, delta in enumerate(deltas):
+                pending_deltas[index] += delta
+        return db_counts, pending_deltas
+
+    @classmethod
+    def _set_count_from_db(cls, obj, attr):
+        # the db counter lags behind by the deltas not flushed yet
+        name = cls.get_count_name(obj, attr)
+        conn = RedisClient.get_connection(RedisRole.COUNTER, name)
+        _, pending_deltas = cls._load_counts_from_db(
+            obj.__class__,
+            [cls.get_count_delta_field(obj, attr)],
+            obj.refresh_from_db,
+        )
+        count = getattr(obj, attr) + pending_deltas[0]
+        conn.set(name, count, ex=settings.REDIS_KEY_EXPIRE_TIME)
+        return count
+
+    @classmethod
+    def _incr_cached_count(cls, obj, attr, delta):
+        """
+        Increment the cached counter, None if it is not cached
+        """
         name = cls.get_count_name(obj, attr)
+        conn = RedisClient.get_connection(RedisRole.COUNTER, name)
+        return cls._get_script(conn, INCR_CACHED_COUNT_SCRIPT)(keys=[name], args=[delta])
+
+    @classmethod
+    def incr_count(cls, obj, attr):
+        count = cls._incr_cached_count(obj, attr, 1)
         # cache miss then get count from db
         # db counter gets increment outside the RedisHelper
-        # must assure the object already has the counter attribute
-        if not conn.exists(name):
-            conn.set(name, getattr(obj, attr))
-            conn.expire(name, settings.REDIS_KEY_EXPIRE_TIME)
-            cnt = getattr(obj, attr)
-            print("NOT EXIST", cls.get_count_name(obj, attr), " ::: ", cnt)
-            return getattr(obj, attr)
-        # counter in cache, user cache built-in function to get increment
-        cnt = conn.incr(name)
-        print(cls.get_count_name(obj, attr), " ::: ", cnt)
-        return cnt
+        if count is None:
+            return cls._set_count_from_db(obj, attr)
+        return count
 
     @classmethod
     def decr_count(cls, obj, attr):
-        conn = RedisClient.get_connection()
-        name = cls.get_count_name(obj, attr)
+        count = cls._incr_cached_count(obj, attr, -1)
         # cache miss then get count from db
         # db counter gets increment outside the RedisHelper
-        # must assure the object already has the counter attribute
-        if not conn.exists(name):
-            conn.set(name, getattr(obj, attr))
-            conn.expire(name, settings.REDIS_KEY_EXPIRE_TIME)
-            return getattr(obj, attr)
-        # counter in cache, user cache built-in function to get increment
-        return conn.decr(name)
+        if count is None:
+            return cls._set_count_from_db(obj, attr)
+        return count
+
+    @classmethod
+    def log_count_delta(cls, obj, attr, delta):
+        """
+        Write-behind counter, the delta only goes to Redis
+        the db counter is updated later when the delta log is flushed
+        """
+        cls._get_count_deltas_connection(obj.__class__).hincrby(
+            COUNT_DELTAS_PATTERN.format(class_name=obj.__class__.__name__),
+            cls.get_count_delta_field(obj, attr),
+            delta,
+        )
+        count = cls._incr_cached_count(obj, attr, delta)
+        # cache miss, the count from db includes the delta just logged
+        if count is None:
+            return cls._set_count_from_db(obj, attr)
+        return count
+
+    @classmethod
+    def take_count_deltas(cls, model_class):
+        """
+        Move the delta log of the model into a pending batch
+        """
+        conn = cls._get_count_deltas_connection(model_class)
+        class_name = model_class.__name__
+        return conn.eval(
+            TAKE_COUNT_DELTAS_SCRIPT,
+            3,
+            COUNT_DELTAS_PATTERN.format(class_name=class_name),
+            COUNT_DELTA_BATCH_PATTERN.format(class_name=class_name, batch_id=uuid.uuid4().hex),
+            COUNT_DELTA_BATCHES_PATTERN.format(class_name=class_name),
+        )
+
+    @classmethod
+    def load_count_delta_batches(cls, model_class):
+        """
+        Output:
+        List of (batch name, {(object id, attr): delta}) of the pending batches,
+        including the ones left over by a crashed flush
+        """
+        conn = cls._get_count_deltas_connection(model_class)
+        batch_names = sorted(conn.smembers(
+            COUNT_DELTA_BATCHES_PATTERN.format(class_name=model_class.__name__)
+        ))
+        pipe = conn.pipeline(transaction=False)
+        for batch_name in batch_names:
+            pipe.hgetall(batch_name)
+        batches = []
+        for batch_name, deltas in zip(batch_names, pipe.execute()):
+            parsed_deltas = {}
+            for field, delta in deltas.items():
+                object_id, attr = field.decode().split(':')
+                if int(delta):
+                    parsed_deltas[(int(object_id), attr)] = int(delta)
+            batches.append((batch_name.decode(), parsed_deltas))
+        return batches
+
+    @classmethod
+    def remove_count_delta_batch(cls, model_class, batch_name):
+        conn = cls._get_count_deltas_connection(model_class)
+        pipe = conn.pipeline(transaction=True)
+        pipe.delete(batch_name)
+        pipe.srem(COUNT_DELTA_BATCHES_PATTERN.format(class_name=model_class.__name__), batch_name)
+        pipe.execute()
+
+    @classmethod
+    def get_counts(cls, objects, attrs):
+        """
+        Counters of a page of objects, one MGET per shard for all of them
+        the misses are read from the db in one query and written back in one pipeline
+
+        Output:
+        Dict of (object id, attr) -> count
+        """
+        objects = {obj.id: obj for obj in objects}
+        if not objects:
+            return {}
+        keys = [(object_id, attr) for object_id in objects for attr in attrs]
+        names = [cls.get_count_name(objects[object_id], attr) for object_id, attr in keys]
+        # one MGET per shard
+        values = [None] * len(keys)
+        for conn, indexes in RedisClient.group_by_shard(RedisRole.COUNTER, names):
+            for index, value in zip(indexes, conn.mget([names[index] for index in indexes])):
+                values[index] = value
+        counts = {}
+        missed_ids = set()
+        for key, value in zip(keys, values):
+            if value is None:
+                missed_ids.add(key[0])
+            else:
+                counts[key] = int(value)
+        if not missed_ids:
+            return counts
+
+        # cache miss, get the counters from db and add the pending deltas
+        model_class = next(iter(objects.values())).__class__
+        missed_keys = [key for key in keys if key[0] in missed_ids]
+        rows, pending_deltas = cls._load_counts_from_db(
+            model_class,
+            [
+                cls.get_count_delta_field(objects[object_id], attr)
+                for object_id, attr in missed_keys
+            ],
+            lambda: list(model_class.objects.filter(id__in=missed_ids).values_list('id', *attrs)),
+        )
+        db_counts = {}
+        for row in rows:
+            for attr, count in zip(attrs, row[1:]):
+                db_counts[(row[0], attr)] = count
+        pipes = {}
+        for key, delta in zip(missed_keys, pending_deltas):
+            # object deleted in the meantime
+            if key not in db_counts:
+                continue
+            counts[key] = db_counts[key] + delta
+            name = cls.get_count_name(objects[key[0]], key[1])
+            conn = RedisClient.get_connection(RedisRole.COUNTER, name)
+            if id(conn) not in pipes:
+                pipes[id(conn)] = conn.pipeline(transaction=False)
+            pipes[id(conn)].set(name, counts[key], ex=settings.REDIS_KEY_EXPIRE_TIME)
+        # write back in one pipeline per shard
+        for pipe in pipes.values():
+            pipe.execute()
+        return counts
 
     @classmethod
     def get_count(cls, obj, attr):
-        # conn = RedisClient.get_connection()
-        # name = cls.get_count_name(obj, attr)
-        # # cache miss, get from db
-        # if not conn.exists(name):
-        #     obj.refresh_from_db()
-        #     conn.set(name, getattr(obj, attr))
-        #     conn.expire(name, settings.REDIS_KEY_EXPIRE_TIME)
-        #     return getattr(obj, attr)
-        # cnt = conn.get(name)
-        # return int(cnt)
-        conn = RedisClient.get_connection()
         name = cls.get_count_name(obj, attr)
+        conn = RedisClient.get_connection(RedisRole.COUNTER, name)
         count = conn.get(name)
         if count is not None:
             return int(count)
         # cache miss, get counter from db
-        obj.refresh_from_db()
-        count = getattr(obj, attr)
-        conn.set(name, count)
-        return count
-
+        return cls._set_count_from_db(obj, attr)
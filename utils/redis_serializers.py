@@ -1,10 +1,21 @@
-from utils.json_encoder import JSONEncoder
+import json
+
+from django.apps import apps
 from django.core import serializers
+from django.db import models
+from utils.json_encoder import JSONEncoder
+from utils.time_helper import datetime_to_ts, ts_to_datetime
 
 
-class DjangoModelSerializer:
+class JSONFixtureCodec:
+    """
+    Legacy format, a one-element Django JSON fixture, e.g.
+    [{"model": "tweets.tweet", "pk": 1, "fields": {...}}]
+    Only kept to decode the entries written before the compact codec
+    """
+
     @classmethod
-    def serialize(cls, instance):
+    def encode(cls, instance):
         return serializers.serialize(
             format='json',
             # django.core.serializers only work for queryset, not instance
@@ -13,8 +24,162 @@ class DjangoModelSerializer:
         )
 
     @classmethod
-    def deserialize(cls, serialized_data):
+    def decode(cls, data):
         return list(serializers.deserialize(
             format='json',
-            stream_or_string=serialized_data,
+            stream_or_string=data,
         ))[0].object
+
+
+class CompactCodec:
+    """
+    Version 1 format, a version header byte followed by a JSON array
+    b'\\x01["tweets.tweet",[1,2,1629000000000000,"content",0,0]]'
+
+    Values follow the order of model._meta.concrete_fields, datetimes are saved
+    as integer timestamps in microseconds. Decoding skips the Django deserializer
+    and builds the instance directly through Model.from_db().
+    """
+    VERSION = 1
+    HEADER = b'\x01'
+    # model label => (model_class, attnames, encoders, decoders)
+    _layouts = {}
+
+    @classmethod
+    def _get_layout(cls, label):
+        if label in cls._layouts:
+            return cls._layouts[label]
+        model_class = apps.get_model(label)
+        attnames, encoders, decoders = [], [], []
+        for field in model_class._meta.concrete_fields:
+            attnames.append(field.attname)
+            if isinstance(field, models.DateTimeField):
+                encoders.append(datetime_to_ts)
+                decoders.append(ts_to_datetime)
+            elif isinstance(field, (
+                models.AutoField,
+                models.BooleanField,
+                models.CharField,
+                models.ForeignKey,
+                models.IntegerField,
+                models.TextField,
+            )):
+                # json native values, no conversion needed
+                encoders.append(None)
+                decoders.append(None)
+            else:
+                encoders.append(field.get_prep_value)
+                decoders.append(field.to_python)
+        cls._layouts[label] = (model_class, attnames, encoders, decoders)
+        return cls._layouts[label]
+
+    @classmethod
+    def encode(cls, instance):
+        label = instance._meta.label_lower
+        _, attnames, encoders, _ = cls._get_layout(label)
+        values = []
+        for attname, encoder in zip(attnames, encoders):
+            value = getattr(instance, attname)
+            if encoder is not None and value is not None:
+                value = encoder(value)
+            values.append(value)
+        return cls.HEADER + json.dumps(
+            [label, values],
+            separators=(',', ':'),
+            cls=JSONEncoder,
+        ).encode('utf-8')
+
+    @classmethod
+    def decode(cls, data):
+        label, values = json.loads(data[len(cls.HEADER):])
+        model_class, attnames, _, decoders = cls._get_layout(label)
+        for index, decoder in enumerate(decoders):
+            if decoder is not None and index < len(values) and values[index] is not None:
+                values[index] = decoder(values[index])
+        # fields appended to the model after the entry was written stay deferred
+        return model_class.from_db(None, attnames[:len(values)], values)
+
+
+class DjangoModelSerializer:
+    """
+    Serialize model instances for the Redis cache
+
+    Writes always use the current codec. Reads pick the codec from the version
+    header of the entry, anything without a known header is a legacy JSON fixture,
+    so entries written by the previous versions still decode after a deploy.
+    """
+    codec = CompactCodec
+    codecs = {
+        CompactCodec.HEADER: CompactCodec,
+    }
+
+    @classmethod
+    def serialize(cls, instance):
+        return cls.codec.encode(instance)
+
+    @classmethod
+    def deserialize(cls, serialized_data):
+        if isinstance(serialized_data, str):
+            serialized_data = serialized_data.encode('utf-8')
+        codec = cls.codecs.get(serialized_data[:1], JSONFixtureCodec)
+        return codec.decode(serialized_data)
+
+
+class DjangoModelIdSerializer:
+    """
+    Serialize only the key fields of an instance, e.g. for the timeline lists
+    NewsFeed(id=3, user_id=1, tweet_id=2, created_at=...) => b'3:1:2:1629000000000000'
+
+    Popular objects are no longer copied into thousands of lists, the deserialized
+    instances keep the other fields deferred and callers hydrate them in batch
+    from the object cache. Entries written by DjangoModelSerializer still decode.
+    Only integer (ids, foreign keys) and datetime fields are supported.
+    """
+
+    def __init__(self, model_class, fields):
+        self.model_class = model_class
+        # Model.from_db() takes the values in the order of the concrete fields
+        self.fields = [
+            field
+            for field in model_class._meta.concrete_fields
+            if field.name in fields or field.attname in fields
+        ]
+        self.attnames = [field.attname for field in self.fields]
+        self.datetime_flags = [
+            isinstance(field, models.DateTimeField)
+            for field in self.fields
+        ]
+        # position of created_at in the entries, timelines are bisected on it
+        self.created_at_position = (
+            self.attnames.index('created_at')
+            if 'created_at' in self.attnames
+            else None
+        )
+
+    def serialize(self, instance):
+        values = []
+        for attname, is_datetime in zip(self.attnames, self.datetime_flags):
+            value = getattr(instance, attname)
+            if value is None:
+                values.append('')
+                continue
+            if is_datetime:
+                value = datetime_to_ts(value)
+            values.append(str(value))
+        return ':'.join(values).encode('utf-8')
+
+    def deserialize(self, serialized_data):
+        if isinstance(serialized_data, str):
+            serialized_data = serialized_data.encode('utf-8')
+        # entries cached in the full object formats, JSON fixtures or versioned
+        header = serialized_data[:1]
+        if header == b'[' or header in DjangoModelSerializer.codecs:
+            return DjangoModelSerializer.deserialize(serialized_data)
+        values = [
+            int(value) if value else None
+            for value in serialized_data.split(b':')
+        ]
+        for index, is_datetime in enumerate(self.datetime_flags):
+            if is_datetime and values[index] is not None:
+                values[index] = ts_to_datetime(values[index])
+        return self.model_class.from_db(None, self.attnames, values)
@@ -1,5 +1,24 @@
+import threading
+import tracemalloc
+from datetime import timedelta
+from dateutil import parser
+from django.conf import settings
+from django.test import override_settings
+from friendships.hbase_models import HBaseFollower
+from types import SimpleNamespace
 from testing.testcases import TestCase
-from utils.redis_client import RedisClient
+from utils.hash_ring import HashRing
+from utils.paginations import EndlessPagination
+from tweets.models import Tweet
+from tweets.services import TWEET_ID_SERIALIZER
+from utils.cache import USER_TWEET_PATTERN
+from utils.cache import USER_TWEET_SORTED_SET_PATTERN
+from utils.redis_client import RedisClient, RedisRole
+from utils.redis_helper import RedisHelper
+from utils.redis_serializers import CompactCodec
+from utils.redis_serializers import DjangoModelSerializer
+from utils.redis_serializers import JSONFixtureCodec
+from utils.time_helper import parse_iso_datetime, ts_now_as_int, utc_now
 
 
 class RedisTest(TestCase):
@@ -16,3 +35,430 @@ class RedisTest(TestCase):
 
         self.clear_cache()
         self.assertEqual(conn.lrange('testkey', 0, -1), [])
+
+    def test_connection_roles(self):
+        timeline_conn = RedisClient.get_connection(RedisRole.TIMELINE)
+        counter_conn = RedisClient.get_connection(RedisRole.COUNTER)
+        self.assertIs(RedisClient.get_connection(), timeline_conn)
+        self.assertIsNot(timeline_conn.connection_pool, counter_conn.connection_pool)
+        # counter commands are not idempotent, never retried after a timeout
+        node = RedisClient._get_nodes(RedisRole.COUNTER)[0]
+        self.assertTrue(RedisClient._get_pool_kwargs(RedisRole.TIMELINE, node)['retry_on_timeout'])
+        self.assertFalse(RedisClient._get_pool_kwargs(RedisRole.COUNTER, node)['retry_on_timeout'])
+
+        # threads share the client of a role
+        conns = []
+        threads = [
+            threading.Thread(target=lambda: conns.append(RedisClient.get_connection(RedisRole.COUNTER)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(all(conn is counter_conn for conn in conns))
+
+
+class RedisHelperTest(TestCase):
+
+    def setUp(self) -> None:
+        self.clear_cache()
+        self.user1 = self.create_user(username='user1')
+        self.user2 = self.create_user(username='user2')
+
+    def test_load_objects_batch(self):
+        tweets1 = [self.create_tweet(user=self.user1) for _ in range(3)][::-1]
+        tweets2 = [self.create_tweet(user=self.user2) for _ in range(2)][::-1]
+        self.clear_cache()
+        lists = [
+            (
+                USER_TWEET_PATTERN.format(user_id=user.id),
+                Tweet.objects.filter(user_id=user.id).order_by('-created_at'),
+                DjangoModelSerializer,
+            )
+            for user in [self.user1, self.user2]
+        ]
+
+        # cache miss, rebuild both lists from db
+        tweets_list = RedisHelper.load_objects_batch(lists)
+        self.assertEqual([t.id for t in tweets_list[0]], [t.id for t in tweets1])
+        self.assertEqual([t.id for t in tweets_list[1]], [t.id for t in tweets2])
+
+        # cache hit
+        conn = RedisClient.get_connection()
+        for name, _, _ in lists:
+            self.assertTrue(conn.exists(name))
+        tweets_list = RedisHelper.load_objects_batch(lists)
+        self.assertEqual([t.id for t in tweets_list[0]], [t.id for t in tweets1])
+        self.assertEqual([t.id for t in tweets_list[1]], [t.id for t in tweets2])
+
+    def test_single_flight_rebuild(self):
+        tweets = [self.create_tweet(user=self.user1) for _ in range(3)][::-1]
+        self.clear_cache()
+        name = USER_TWEET_PATTERN.format(user_id=self.user1.id)
+        queryset = Tweet.objects.filter(user_id=self.user1.id).order_by('-created_at')
+        conn = RedisClient.get_connection()
+
+        # another process is rebuilding, read the db without writing the cache
+        token = RedisHelper._acquire_rebuild_lock(name)
+        self.assertIsNotNone(token)
+        self.assertIsNone(RedisHelper._acquire_rebuild_lock(name))
+        objects = RedisHelper.load_objects(name, queryset)
+        self.assertEqual([t.id for t in objects], [t.id for t in tweets])
+        self.assertFalse(conn.exists(name))
+        RedisHelper._release_rebuild_lock(name, token)
+
+        # rebuilding twice never fills the list twice
+        RedisHelper._rebuild_cache(name, queryset)
+        RedisHelper._rebuild_cache(name, queryset)
+        self.assertEqual(conn.llen(name), 3)
+        objects = RedisHelper.load_objects(name, queryset)
+        self.assertEqual([t.id for t in objects], [t.id for t in tweets])
+        # lock released after the rebuild
+        self.assertIsNotNone(RedisHelper._acquire_rebuild_lock(name))
+
+    def test_load_list_window(self):
+        tweets = [self.create_tweet(user=self.user1) for _ in range(10)][::-1]
+        name = USER_TWEET_PATTERN.format(user_id=self.user1.id)
+        queryset = Tweet.objects.filter(user_id=self.user1.id).order_by('-created_at')
+        RedisHelper.load_objects(name, queryset, TWEET_ID_SERIALIZER)
+
+        # only the window is read out of the list
+        loaded, objects = RedisHelper._load_list_window(
+            name, TWEET_ID_SERIALIZER, limit=3, created_at__lt=tweets[4].created_at,
+        )
+        self.assertTrue(loaded)
+        self.assertEqual([t.id for t in objects], [t.id for t in tweets[5:8]])
+        loaded, objects = RedisHelper._load_list_window(
+            name, TWEET_ID_SERIALIZER, created_at__gt=tweets[4].created_at,
+        )
+        self.assertEqual([t.id for t in objects], [t.id for t in tweets[:4]])
+        loaded, objects = RedisHelper._load_list_window(
+            name, TWEET_ID_SERIALIZER, created_at__gt=tweets[0].created_at,
+        )
+        self.assertEqual(objects, [])
+        for created_at__lt in [tweets[0].created_at, tweets[9].created_at]:
+            self.assertEqual(
+                [t.id for t in RedisHelper.load_objects(
+                    name, queryset, TWEET_ID_SERIALIZER, 5, created_at__lt=created_at__lt,
+                )],
+                [t.id for t in RedisHelper._cut_window(tweets, 5, created_at__lt=created_at__lt)],
+            )
+
+        # full objects of the older codecs fall back to the whole list
+        conn = RedisClient.get_connection()
+        conn.lset(name, 5, DjangoModelSerializer.serialize(tweets[5]))
+        loaded, _ = RedisHelper._load_list_window(
+            name, TWEET_ID_SERIALIZER, limit=3, created_at__lt=tweets[0].created_at,
+        )
+        self.assertFalse(loaded)
+        objects = RedisHelper.load_objects(
+            name, queryset, TWEET_ID_SERIALIZER, 3, created_at__lt=tweets[4].created_at,
+        )
+        self.assertEqual([t.id for t in objects], [t.id for t in tweets[5:8]])
+
+    def test_push_objects_to_cache(self):
+        tweets1 = [self.create_tweet(user=self.user1) for _ in range(2)]
+        tweets2 = [self.create_tweet(user=self.user2) for _ in range(2)]
+        conn = RedisClient.get_connection()
+        name1 = USER_TWEET_PATTERN.format(user_id=self.user1.id)
+        name2 = USER_TWEET_PATTERN.format(user_id=self.user2.id)
+        items = [
+            (name, Tweet.objects.filter(user_id=user.id).order_by('-created_at'), tweet)
+            for name, user, tweet in [
+                (name1, self.user1, self.create_tweet(user=self.user1)),
+                (name2, self.user2, self.create_tweet(user=self.user2)),
+            ]
+        ]
+        tweets1.append(items[0][2])
+        tweets2.append(items[1][2])
+        conn.delete(name2)
+        conn.lpop(name1)
+        conn.expire(name1, 10)
+        conn.set('stale', 1)
+
+        # existing list is pushed and its ttl refreshed, missing list is rebuilt
+        pushed = RedisHelper.push_objects_to_cache(items, TWEET_ID_SERIALIZER, stale_names=['stale'])
+        self.assertEqual(pushed, [True, False])
+        self.assertFalse(conn.exists('stale'))
+        self.assertGreater(conn.ttl(name1), 10)
+        for name, tweets in [(name1, tweets1), (name2, tweets2)]:
+            self.assertEqual(
+                [t.id for t in RedisHelper.load_objects(name, None, TWEET_ID_SERIALIZER)],
+                [t.id for t in tweets[::-1]],
+            )
+
+    @override_settings(REDIS_LIST_LENGTH_LIMIT=3)
+    def test_remove_objects_from_full_timelines(self):
+        tweets = [self.create_tweet(user=self.user1) for _ in range(5)][::-1]
+        queryset = Tweet.objects.filter(user_id=self.user1.id).order_by('-created_at', '-id')
+        conn = RedisClient.get_connection()
+        for name, sorted_set in [
+            (USER_TWEET_PATTERN.format(user_id=self.user1.id), False),
+            (USER_TWEET_SORTED_SET_PATTERN.format(user_id=self.user1.id), True),
+        ]:
+            self.clear_cache()
+            load = RedisHelper.load_sorted_set_objects if sorted_set else RedisHelper.load_objects
+            self.assertEqual([t.id for t in load(name, queryset, TWEET_ID_SERIALIZER)], [t.id for t in tweets[:3]])
+
+            # the full timeline keeps its other entries, only the tail is refilled on read
+            RedisHelper.remove_objects_from_timelines([(name, tweets[1])], TWEET_ID_SERIALIZER, sorted_set)
+            self.assertEqual(conn.zcard(name) if sorted_set else conn.llen(name), 2)
+            self.assertEqual(
+                [t.id for t in load(name, queryset.exclude(id=tweets[1].id), TWEET_ID_SERIALIZER)],
+                [tweets[0].id, tweets[2].id, tweets[3].id],
+            )
+            self.assertEqual(conn.zcard(name) if sorted_set else conn.llen(name), 3)
+
+    def test_get_counts(self):
+        tweets = [self.create_tweet(user=self.user1) for _ in range(3)]
+        self.create_like(self.user2, tweets[0])
+        self.create_comment(self.user2, tweets[1])
+        self.clear_cache()
+        expected = {
+            (tweets[0].id, 'like_count'): 1,
+            (tweets[0].id, 'comment_count'): 0,
+            (tweets[1].id, 'like_count'): 0,
+            (tweets[1].id, 'comment_count'): 1,
+            (tweets[2].id, 'like_count'): 0,
+            (tweets[2].id, 'comment_count'): 0,
+        }
+
+        # cache miss, every counter is read in one query
+        with self.assertNumQueries(1):
+            counts = RedisHelper.get_counts(tweets, ('like_count', 'comment_count'))
+        self.assertEqual(counts, expected)
+
+        # cache hit
+        with self.assertNumQueries(0):
+            counts = RedisHelper.get_counts(tweets, ('like_count', 'comment_count'))
+        self.assertEqual(counts, expected)
+        self.assertEqual(RedisHelper.get_count(tweets[0], 'like_count'), 1)
+
+
+class RedisShardingTest(TestCase):
+
+    def setUp(self) -> None:
+        self.clear_cache()
+        # different dbs stand in for several redis-server processes
+        pools = dict(settings.REDIS_POOLS)
+        for role in (RedisRole.TIMELINE, RedisRole.COUNTER):
+            pools[role] = dict(pools[role], shards=[{'db': 13}, {'db': 14}, {'db': 15}])
+        override = override_settings(REDIS_POOLS=pools)
+        override.enable()
+        self.addCleanup(override.disable)
+        shards = RedisClient.shards
+        RedisClient.shards = {}
+        self.addCleanup(setattr, RedisClient, 'shards', shards)
+        self.addCleanup(RedisClient.clear)
+
+        self.user1 = self.create_user(username='user1')
+
+    def test_hash_ring(self):
+        keys = [str(i) for i in range(10000)]
+        ring = HashRing(['node1', 'node2', 'node3'])
+        nodes = {key: ring.get_node(key) for key in keys}
+        for node in ['node1', 'node2', 'node3']:
+            self.assertGreater(list(nodes.values()).count(node), 2500)
+
+        # adding the 4th node only takes about 1/4 of the keys from the others
+        ring.add_node('node4')
+        moved = [key for key in keys if ring.get_node(key) != nodes[key]]
+        self.assertTrue(1500 < len(moved) < 3500)
+        self.assertTrue(all(ring.get_node(key) == 'node4' for key in moved))
+        ring.remove_node('node4')
+        self.assertTrue(all(ring.get_node(key) == nodes[key] for key in keys))
+
+    def test_sharded_keys(self):
+        users = [self.user1] + [self.create_user(username='user{}'.format(i)) for i in range(2, 7)]
+        tweets = [self.create_tweet(user=user) for user in users]
+        lists = [
+            (
+                USER_TWEET_PATTERN.format(user_id=user.id),
+                Tweet.objects.filter(user_id=user.id).order_by('-created_at'),
+                TWEET_ID_SERIALIZER,
+            )
+            for user in users
+        ]
+        # the lists are spread over the shards, each one lives on its own shard
+        shards = RedisClient.group_by_shard(RedisRole.TIMELINE, [name for name, _, _ in lists])
+        self.assertGreater(len(shards), 1)
+        for conn, indexes in shards:
+            for index in indexes:
+                self.assertTrue(conn.exists(lists[index][0]))
+        tweets_list = RedisHelper.load_objects_batch(lists)
+        self.assertEqual([t[0].id for t in tweets_list], [t.id for t in tweets])
+        # the rebuild lock follows the list
+        name = lists[0][0]
+        self.assertEqual(RedisClient.get_shard_key(name + ':rebuild_lock'), str(self.user1.id))
+
+        self.create_like(users[1], tweets[0])
+        counts = RedisHelper.get_counts(tweets, ('like_count',))
+        self.assertEqual(counts[(tweets[0].id, 'like_count')], 1)
+        self.assertEqual(RedisHelper.get_counts(tweets, ('like_count',)), counts)
+
+
+class DjangoModelSerializerTest(TestCase):
+
+    def setUp(self) -> None:
+        self.clear_cache()
+        self.user1 = self.create_user(username='user1')
+
+    def _assert_same_tweet(self, tweet, other):
+        self.assertEqual(tweet.id, other.id)
+        self.assertEqual(tweet.user_id, other.user_id)
+        self.assertEqual(tweet.content, other.content)
+        self.assertEqual(tweet.created_at, other.created_at)
+        self.assertEqual(tweet.like_count, other.like_count)
+        self.assertEqual(tweet.comment_count, other.comment_count)
+
+    def test_compact_codec(self):
+        tweet = self.create_tweet(user=self.user1, content='compact content')
+        serialized_tweet = DjangoModelSerializer.serialize(tweet)
+        self.assertTrue(serialized_tweet.startswith(CompactCodec.HEADER))
+        self.assertLess(len(serialized_tweet), len(JSONFixtureCodec.encode(tweet)))
+        # microseconds are not truncated
+        self._assert_same_tweet(DjangoModelSerializer.deserialize(serialized_tweet), tweet)
+
+    def test_legacy_entries_still_decode(self):
+        tweet = self.create_tweet(user=self.user1)
+        self._assert_same_tweet(
+            DjangoModelSerializer.deserialize(JSONFixtureCodec.encode(tweet)),
+            tweet,
+        )
+
+        # a cached list mixing legacy and compact entries
+        self.clear_cache()
+        new_tweet = self.create_tweet(user=self.user1)
+        name = USER_TWEET_PATTERN.format(user_id=self.user1.id)
+        conn = RedisClient.get_connection()
+        conn.delete(name)
+        conn.rpush(
+            name,
+            DjangoModelSerializer.serialize(new_tweet),
+            JSONFixtureCodec.encode(tweet),
+        )
+        tweets = RedisHelper.load_objects(name, Tweet.objects.none())
+        self.assertEqual(len(tweets), 2)
+        self._assert_same_tweet(tweets[0], new_tweet)
+        self._assert_same_tweet(tweets[1], tweet)
+
+
+class EndlessPaginationTest(TestCase):
+
+    def _paginate(self, objects, **query_params):
+        paginator = EndlessPagination()
+        paginator.page_size = 3
+        request = SimpleNamespace(query_params=query_params)
+        return paginator._paginate_ordered_list(objects, request), paginator.has_next_page
+
+    def test_parse_iso_datetime(self):
+        for value in [
+            '2021-08-01T12:34:56.123456Z',
+            '2021-08-01T12:34:56Z',
+            '2021-08-01T12:34:56.123456+00:00',
+            # not the fixed format, parsed by dateutil
+            '2021-08-01T12:34:56.123+08:00',
+            '2021-08-01 12:34:56.123456Z',
+        ]:
+            self.assertEqual(parse_iso_datetime(value), parser.isoparse(value))
+        with self.assertRaises(ValueError):
+            parse_iso_datetime('2021-13-01T12:34:56Z')
+
+    def test_paginate_ordered_list(self):
+        now = utc_now().replace(microsecond=0)
+        # sorted by (created_at, id) descending, with ties
+        created_ats = [now - timedelta(seconds=second) for second in [0, 1, 1, 2, 3, 3, 4, 5]]
+        objects = [
+            SimpleNamespace(id=len(created_ats) - index, created_at=created_at)
+            for index, created_at in enumerate(created_ats)
+        ]
+
+        def cursor(seconds):
+            return (now - timedelta(seconds=seconds)).isoformat().replace('+00:00', 'Z')
+
+        page, has_next_page = self._paginate(objects)
+        self.assertEqual([obj.id for obj in page], [8, 7, 6])
+        self.assertEqual(has_next_page, True)
+
+        for seconds in range(-1, 7):
+            page, has_next_page = self._paginate(objects, created_at__lt=cursor(seconds))
+            older = [obj for obj in objects if obj.created_at < now - timedelta(seconds=seconds)]
+            self.assertEqual(page, older[:3])
+            self.assertEqual(has_next_page, len(older) > 3)
+
+            page, has_next_page = self._paginate(objects, created_at__gt=cursor(seconds))
+            newer = [obj for obj in objects if obj.created_at > now - timedelta(seconds=seconds)]
+            self.assertEqual(page, newer)
+            self.assertEqual(has_next_page, False)
+
+        self.assertEqual(self._paginate([], created_at__lt=cursor(0)), ([], False))
+        self.assertEqual(self._paginate([], created_at__gt=cursor(0)), ([], False))
+
+    def test_sort_ties(self):
+        now = utc_now()
+        created_ats = [now - timedelta(seconds=second) for second in [0, 0, 1, 1, 1, 2, 3, 3]]
+        # the ties are kept in any order by the cache
+        ids = [6, 7, 3, 5, 4, 2, 0, 1]
+        objects = [SimpleNamespace(id=id, created_at=created_at) for id, created_at in zip(ids, created_ats)]
+
+        paginator = EndlessPagination()
+        paginator.page_size = 3
+        request = SimpleNamespace(query_params={})
+        page = paginator._paginate_ordered_list(objects, request)
+        self.assertEqual([obj.id for obj in page], [7, 6, 5])
+        paginator._set_page(page)
+        next_cursor = paginator.get_paginated_response([]).data['next_cursor']
+        request = SimpleNamespace(query_params={'before': next_cursor})
+        page = paginator._paginate_ordered_list(objects, request)
+        self.assertEqual([obj.id for obj in page], [4, 3, 2])
+        # only the ties at the cursor and at the ends of the pages are sorted
+        self.assertEqual([obj.id for obj in objects[6:]], [0, 1])
+
+
+class EndlessPaginationHBaseTest(TestCase):
+
+    def setUp(self) -> None:
+        super(EndlessPaginationHBaseTest, self).setUp()
+
+    def _create_followers(self, to_user_id, count):
+        now = ts_now_as_int()
+        HBaseFollower.batch_create([
+            {'to_user_id': to_user_id, 'created_at': now + i, 'from_user_id': i}
+            for i in range(1, count + 1)
+        ], batch_size=1000)
+        return now
+
+    def _paginate(self, to_user_id, **query_params):
+        paginator = EndlessPagination()
+        request = SimpleNamespace(query_params=query_params)
+        page = paginator.paginate_hbase(HBaseFollower, (to_user_id,), request)
+        return page, paginator
+
+    def test_refresh_gap(self):
+        now = self._create_followers(1, 50)
+        page, paginator = self._paginate(1, created_at__gt=str(now + 40))
+        self.assertEqual([obj.from_user_id for obj in page], list(range(50, 40, -1)))
+        self.assertEqual((paginator.has_gap, paginator.has_next_page), (False, False))
+
+        # away for longer than a page, the newest page and a gap
+        page, paginator = self._paginate(1, created_at__gt=str(now + 9))
+        self.assertEqual([obj.from_user_id for obj in page], list(range(50, 30, -1)))
+        self.assertEqual((paginator.has_gap, paginator.has_next_page), (True, True))
+        # the gap is filled by scrolling down
+        next_cursor = paginator.get_paginated_response([]).data['next_cursor']
+        page, paginator = self._paginate(1, before=next_cursor)
+        self.assertEqual([obj.from_user_id for obj in page], list(range(30, 10, -1)))
+
+    def test_refresh_memory(self):
+        # the refresh scan is bounded by the page, not by the new rows
+        peaks = []
+        for to_user_id, count in [(1, 1000), (2, 100000)]:
+            now = self._create_followers(to_user_id, count)
+            tracemalloc.start()
+            page, paginator = self._paginate(to_user_id, created_at__gt=str(now))
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            self.assertEqual(len(page), paginator.page_size)
+            self.assertEqual(paginator.has_gap, True)
+        self.assertLess(peaks[1], peaks[0] * 2)
@@ -1,7 +1,11 @@
-from datetime import datetime
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from dateutil import parser
 import pytz
 import time
 
+EPOCH = pytz.utc.localize(datetime(1970, 1, 1))
+
 
 def ts_now_as_int():
     return int(time.time() * 1000000)
@@ -12,4 +16,85 @@ def utc_now():
     #
     # local_datetime = local_tz.localize(datetime.now(), is_dst=None)
     # utc_datetime = local_datetime.astimezone(pytz.UTC)
-    # return utc_datetime
\ No newline at end of file
+    # return utc_datetime
+
+
+def datetime_to_ts(dt):
+    # integer microseconds, avoid the float precision loss of dt.timestamp()
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+
+def ts_to_datetime(ts):
+    return EPOCH + timedelta(microseconds=ts)
+
+
+def parse_iso_datetime(value):
+    """
+    Parse the created_at cursors the api renders, e.g. 2021-08-01T12:34:56.123456Z
+    The fixed format is sliced directly, anything else goes through dateutil
+    """
+    body = None
+    if value.endswith('Z'):
+        body = value[:-1]
+    elif value.endswith('+00:00'):
+        body = value[:-6]
+    if body is not None and len(body) in (19, 26) \
+            and body[4] == body[7] == '-' and body[10] == 'T' \
+            and body[13] == body[16] == ':' and body[19:20] in ('', '.'):
+        try:
+            return datetime(
+                int(body[0:4]),
+                int(body[5:7]),
+                int(body[8:10]),
+                int(body[11:13]),
+                int(body[14:16]),
+                int(body[17:19]),
+                int(body[20:26] or 0),
+                tzinfo=pytz.utc,
+            )
+        except ValueError:
+            pass
+    return parser.isoparse(value)
+
+
+class _NegatedKeys:
+    """
+    (created_at, id) keys of objects sorted by them descending, negated so
+    that bisect sees them ascending. Keys are computed on access, a lookup
+    only touches O(log n) objects. id is read from the tie_breaker attribute.
+    """
+
+    def __init__(self, objects, tie_breaker='id'):
+        self.objects = objects
+        self.tie_breaker = tie_breaker
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __getitem__(self, index):
+        obj = self.objects[index]
+        # unsaved objects have no id
+        return -datetime_to_ts(obj.created_at), -(getattr(obj, self.tie_breaker) or 0)
+
+
+def count_newer(objects, created_at, id=None, tie_breaker='id'):
+    """
+    Number of leading objects after (created_at, id), objects sorted by
+    (created_at, id) descending. Without id, the objects created after created_at
+    """
+    return bisect_left(
+        _NegatedKeys(objects, tie_breaker),
+        (-datetime_to_ts(created_at), -id if id is not None else float('-inf')),
+    )
+
+
+def index_older(objects, created_at, id=None, tie_breaker='id'):
+    """
+    Index of the first object before (created_at, id), objects sorted by
+    (created_at, id) descending. Without id, the first object created before
+    created_at
+    """
+    return bisect_right(
+        _NegatedKeys(objects, tie_breaker),
+        (-datetime_to_ts(created_at), -id if id is not None else float('inf')),
+    )